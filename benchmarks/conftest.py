@@ -0,0 +1,194 @@
+"""
+Benchmarks of the public views: query count, wall time and allocated memory, compared with JSON baselines.
+
+They are skipped unless --run-benchmarks is given:
+
+    pytest benchmarks --run-benchmarks                      # compare with the baselines
+    pytest benchmarks --run-benchmarks --update-baselines   # record the baselines
+    BENCHMARK_SCALE=1 pytest benchmarks --run-benchmarks    # full size data set (millions of playback rows)
+
+The numbers depend on the database and on the size of the data set. The query counts are the same on every
+machine: their baselines are kept in benchmarks/baselines/<database vendor>-scale-<scale>.json, in the repository.
+The times and the memory depend on the machine: their baselines are kept per host, in
+benchmarks/baselines/local/<host name>-<database vendor>-scale-<scale>.json (not in the repository), and are
+compared only once recorded on the host running the benchmarks.
+"""
+import json
+import os
+import socket
+import statistics
+import time
+import tracemalloc
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from benchmarks.factories import create_dataset
+
+BASELINES_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+LOCAL_BASELINES_DIR = os.path.join(BASELINES_DIR, 'local')
+# the measures which do not depend on the machine
+SHARED_MEASURES = ('queries',)
+DEFAULT_SCALE = 0.1
+REPEAT = 5
+
+# a measure is a regression when it exceeds the baseline by more than its tolerance
+QUERY_TOLERANCE = 0
+TIME_TOLERANCE = float(os.environ.get('BENCHMARK_TIME_TOLERANCE', 0.5))  # fraction of the baseline
+TIME_MIN_DIFFERENCE_MS = 5  # smaller differences are noise
+MEMORY_TOLERANCE = float(os.environ.get('BENCHMARK_MEMORY_TOLERANCE', 0.25))  # fraction of the baseline
+
+# name -> measures of this session
+results = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--run-benchmarks', action='store_true', help='Run the benchmarks of the views')
+    group.addoption('--update-baselines', action='store_true', help='Save the measures as the new baselines')
+
+
+def pytest_collection_modifyitems(config, items):
+    # the options are not registered when pytest is not started on the benchmarks directory
+    if config.getoption('--run-benchmarks', default=False):
+        return
+    skip = pytest.mark.skip(reason='benchmarks: use --run-benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+def get_scale():
+    return float(os.environ.get('BENCHMARK_SCALE', DEFAULT_SCALE))
+
+
+def get_baselines_path():
+    return os.path.join(BASELINES_DIR, f"{connection.vendor}-scale-{get_scale():g}.json")
+
+
+def get_local_baselines_path():
+    return os.path.join(LOCAL_BASELINES_DIR, f"{socket.gethostname()}-{connection.vendor}-scale-{get_scale():g}.json")
+
+
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baselines(path, measures):
+    """Updates the baselines of path with measures: name -> dict of measures."""
+    baselines = load_baselines(path)
+    baselines.update(measures)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def get_regressions(measures, baseline):
+    """
+    Returns the descriptions of the measures exceeding the baseline by more than the tolerances.
+
+    The measures without a baseline (e.g. the times, not recorded on this host) are not compared.
+    """
+    regressions = []
+    if 'queries' in baseline and measures['queries'] > baseline['queries'] + QUERY_TOLERANCE:
+        regressions.append(f"queries {measures['queries']} > {baseline['queries']}")
+    if 'time_ms' in baseline:
+        time_limit = max(baseline['time_ms'] * (1 + TIME_TOLERANCE), baseline['time_ms'] + TIME_MIN_DIFFERENCE_MS)
+        if measures['time_ms'] > time_limit:
+            regressions.append(f"time {measures['time_ms']:.1f} ms > {time_limit:.1f} ms")
+    if 'peak_memory_kb' in baseline:
+        memory_limit = baseline['peak_memory_kb'] * (1 + MEMORY_TOLERANCE)
+        if measures['peak_memory_kb'] > memory_limit:
+            regressions.append(f"peak memory {measures['peak_memory_kb']:.0f} KiB > {memory_limit:.0f} KiB")
+    return regressions
+
+
+class Benchmark:
+    def __init__(self, update_baselines):
+        self.update_baselines = update_baselines
+        self.baselines = load_baselines(get_baselines_path())
+        for name, measures in load_baselines(get_local_baselines_path()).items():
+            self.baselines[name] = {**self.baselines.get(name, {}), **measures}
+
+    def measure(self, name, request, repeat=REPEAT):
+        """
+        Measures request(), a function returning a response, in the steady state: after a first call which fills
+        the caches. Fails if the response is an error or a measure exceeds the baseline.
+
+        :return: dict with queries, time_ms (median of repeat calls) and peak_memory_kb (allocated by one call)
+        """
+        response = request()
+        assert response.status_code < 400, f"{name}: status {response.status_code}"
+
+        with CaptureQueriesContext(connection) as queries:
+            request()
+        # read now: the log is emptied by the next requests
+        query_count = len(queries.captured_queries)
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            request()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            request()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        measures = {
+            'queries': query_count,
+            'time_ms': round(statistics.median(times) * 1000, 2),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+        results[name] = measures
+
+        baseline = self.baselines.get(name)
+        if baseline is not None and not self.update_baselines:
+            regressions = get_regressions(measures, baseline)
+            assert not regressions, f"{name}: " + ", ".join(regressions)
+        return measures
+
+
+@pytest.fixture(scope='session')
+def benchmark_data(django_db_setup, django_db_blocker):
+    """The data set, created once for the session (the requests of the benchmarks run in rolled back transactions)."""
+    with django_db_blocker.unblock():
+        return create_dataset(get_scale())
+
+
+@pytest.fixture
+def benchmark(request, benchmark_data):
+    cache.clear()
+    return Benchmark(request.config.getoption('--update-baselines', default=False))
+
+
+def pytest_sessionfinish(session):
+    if not results or not session.config.getoption('--update-baselines', default=False):
+        return
+    save_baselines(get_baselines_path(), {
+        name: {key: value for key, value in measures.items() if key in SHARED_MEASURES}
+        for name, measures in results.items()
+    })
+    save_baselines(get_local_baselines_path(), {
+        name: {key: value for key, value in measures.items() if key not in SHARED_MEASURES}
+        for name, measures in results.items()
+    })
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not results:
+        return
+    terminalreporter.section(f"benchmarks (scale {get_scale():g})")
+    for name, measures in sorted(results.items()):
+        terminalreporter.write_line(f"{name:30} {measures['queries']:6} queries {measures['time_ms']:10.2f} ms "
+                                    f"{measures['peak_memory_kb']:10.1f} KiB")
@@ -0,0 +1,158 @@
+"""
+Builders of a realistic data set for the benchmarks.
+
+Everything is inserted with bulk_create in batches: the sizes of FULL_SIZES, multiplied by the scale, are reached in
+seconds for the small scales and in minutes for scale 1 (millions of playback rows).
+"""
+import datetime
+import random
+import uuid
+
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from core.models import Category, Video, VideoCategory, Document, DocumentCategory, VideoPlaybackEvent, VideoCounter
+from registration.capacity import bulk_add_participations
+from registration.models import InformationEvent, EventCapacity, Subscriber, EventParticipation
+
+BATCH_SIZE = 5000
+
+# sizes at scale 1
+FULL_SIZES = {
+    'categories': 300,
+    'videos': 5000,
+    'documents': 2000,
+    'playback_events': 2000000,
+    'events': 2000,
+    'subscribers': 20000,
+    'participations': 60000,
+}
+
+
+def get_sizes(scale):
+    return {name: max(1, int(size * scale)) for name, size in FULL_SIZES.items()}
+
+
+def bulk_create(model, objects, **lookup):
+    """bulk_create in batches; returns the created objects with their primary key, read back with lookup if needed."""
+    created = model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    if connection.features.can_return_rows_from_bulk_insert:
+        return created
+    # e.g. MySQL: the primary keys are not set by bulk_create
+    return list(model.objects.filter(**lookup).order_by('id'))
+
+
+def make_categories(count):
+    """A tree of categories: a tenth of them are roots, the others children of a root."""
+    roots = bulk_create(Category, [
+        Category(name=f"Category {i}", slug=f"bench-category-{i}", order=i) for i in range(max(1, count // 10))
+    ], slug__startswith='bench-category-', parent__isnull=True)
+    children = bulk_create(Category, [
+        Category(name=f"Category {len(roots) + i}", slug=f"bench-category-{len(roots) + i}", order=i,
+                 parent=roots[i % len(roots)])
+        for i in range(count - len(roots))
+    ], slug__startswith='bench-category-', parent__isnull=False)
+    return roots + children
+
+
+def make_videos(count, categories, rng):
+    """Videos with a file name (no file is written), each in one to three categories."""
+    videos = bulk_create(Video, [
+        Video(title=f"Video {i}", description=f"<p>Description of video {i}</p>" * 5, authors=f"Author {i % 50}",
+              video_file=f"bench/video_{i}.mp4", duration=datetime.timedelta(minutes=rng.randint(5, 90)),
+              width=1920, height=1080, ref_token=uuid.UUID(int=rng.getrandbits(128)))
+        for i in range(count)
+    ], video_file__startswith='bench/')
+    VideoCategory.objects.bulk_create([
+        VideoCategory(media=video, category=category, order=order)
+        for video in videos
+        for order, category in enumerate(rng.sample(categories, min(len(categories), rng.randint(1, 3))))
+    ], batch_size=BATCH_SIZE)
+    VideoCounter.objects.bulk_create([VideoCounter(video=video) for video in videos], batch_size=BATCH_SIZE)
+    return videos
+
+
+def make_documents(count, categories, rng):
+    documents = bulk_create(Document, [
+        Document(title=f"Document {i}", document_file=f"bench/document_{i}.pdf") for i in range(count)
+    ], document_file__startswith='bench/')
+    DocumentCategory.objects.bulk_create([
+        DocumentCategory(media=document, category=rng.choice(categories), order=i)
+        for i, document in enumerate(documents)
+    ], batch_size=BATCH_SIZE)
+    return documents
+
+
+def make_playback_events(count, videos, rng):
+    """Playback rows over the last year, from a pool of addresses; the popular videos get most of them."""
+    now = timezone.now()
+    weights = [1 / (rank + 1) for rank in range(len(videos))]
+    for start in range(0, count, BATCH_SIZE):
+        size = min(BATCH_SIZE, count - start)
+        batch_videos = rng.choices(videos, weights=weights, k=size)
+        VideoPlaybackEvent.objects.bulk_create([
+            VideoPlaybackEvent(video=video, ip_address=f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.1",
+                               timestamp=now - datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600)))
+            for video in batch_videos
+        ])
+
+
+def make_events(count, rng):
+    """Events from a year ago to a year ahead, with their seat counters."""
+    today = timezone.localdate()
+    events = bulk_create(InformationEvent, [
+        InformationEvent(title=f"Event {i}", description=f"Description of event {i}", speaker=f"Speaker {i % 30}",
+                         event_date=today + datetime.timedelta(days=rng.randint(-365, 365)),
+                         event_start_time=datetime.time(rng.randint(8, 17), 0),
+                         event_end_time=datetime.time(18, 0), meeting_url="https://example.org/meeting")
+        for i in range(count)
+    ], meeting_url="https://example.org/meeting", title__startswith="Event ")
+    # bulk_create sends no post_save: the counters are created here
+    EventCapacity.objects.bulk_create([EventCapacity(event=event) for event in events], batch_size=BATCH_SIZE)
+    return events
+
+
+def make_subscribers(count):
+    return bulk_create(Subscriber, [
+        Subscriber(name=f"Name{i}", surname=f"Surname{i}", matricola=f"bench-{i}", email=f"bench{i}@example.org")
+        for i in range(count)
+    ], matricola__startswith='bench-')
+
+
+def make_participations(count, events, subscribers, rng):
+    """Distinct (event, subscriber) pairs, with the seat counters updated."""
+    pairs = set()
+    while len(pairs) < min(count, len(events) * len(subscribers)):
+        pairs.add((rng.choice(events).id, rng.choice(subscribers).id))
+    pairs = sorted(pairs)
+    for start in range(0, len(pairs), BATCH_SIZE):
+        bulk_add_participations([EventParticipation(event_id=event_id, subscriber_id=subscriber_id)
+                                 for event_id, subscriber_id in pairs[start:start + BATCH_SIZE]])
+
+
+def create_dataset(scale, seed=0):
+    """
+    Creates the whole data set; the same scale and seed give the same data.
+
+    :return: dict with some of the created objects, used by the benchmarks as targets of the requests
+    """
+    rng = random.Random(seed)
+    sizes = get_sizes(scale)
+
+    categories = make_categories(sizes['categories'])
+    videos = make_videos(sizes['videos'], categories, rng)
+    make_documents(sizes['documents'], categories, rng)
+    make_playback_events(sizes['playback_events'], videos, rng)
+    events = make_events(sizes['events'], rng)
+    subscribers = make_subscribers(sizes['subscribers'])
+    make_participations(sizes['participations'], events, subscribers, rng)
+
+    # the category with most videos: the worst case of the category page
+    busiest_category = Category.objects.annotate(video_count=Count('videocategory')).order_by('-video_count').first()
+    return {
+        'sizes': sizes,
+        'category': busiest_category,
+        'video': videos[0],
+        'subscriber': subscribers[0],
+    }
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from django.urls import reverse
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db]
+
+PREVIEW_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+
+def test_show_categories(client, benchmark):
+    url = reverse('show-categories')
+    benchmark.measure('ShowCategories', lambda: client.get(url))
+
+
+def test_show_home_with_category(client, benchmark, benchmark_data):
+    url = reverse('show-category-home', args=[benchmark_data['category'].slug])
+    benchmark.measure('ShowHomeWithCategory', lambda: client.get(url))
+
+
+def test_manage_subscription(client, benchmark, benchmark_data):
+    subscriber = benchmark_data['subscriber']
+    response = client.post(reverse('subscriber-login'), {'matricola': subscriber.matricola, 'email': subscriber.email})
+    assert response.status_code == 302
+
+    url = reverse('manage-subscription')
+    benchmark.measure('manage_subscription', lambda: client.get(url))
+
+
+def test_check_subscriber(client, benchmark, benchmark_data):
+    subscriber = benchmark_data['subscriber']
+    url = reverse('check-subscriber')
+    benchmark.measure('CheckSubscriberView',
+                      lambda: client.get(url, {'matricola': subscriber.matricola, 'email': subscriber.email}))
+
+
+def test_video_player_event(client, benchmark, benchmark_data):
+    url = reverse('video_player_event')
+    benchmark.measure('video_player_event', lambda: client.post(url, {'ref_token': benchmark_data['video'].ref_token}))
+
+
+@pytest.mark.skipif(not os.path.exists(PREVIEW_FONT), reason='the font of the preview images is not installed')
+def test_get_preview_image(client, benchmark, benchmark_data):
+    url = reverse('get_preview_image', args=[benchmark_data['video'].ref_token])
+    benchmark.measure('get_preview_image', lambda: client.get(url))
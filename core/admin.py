@@ -8,7 +8,8 @@ from django.urls import path, reverse
 
 from mediamatrixhub.admin_utils import ExportExcelMixin
 from .models import Video, VideoPill, Playlist, Structure, Person, Tag, PlaylistVideo, Category, VideoCategory, \
-    Document, VideoDocument, DocumentCategory, MessageLog, VideoPlaybackEvent, VideoCounter, AutomaticPreviewImage
+    Document, VideoDocument, DocumentCategory, MessageLog, VideoPlaybackEvent, VideoCounter, AutomaticPreviewImage, \
+    MediaBlob, ChunkedUpload
 from .forms import VideoAdminForm
 from .signals import extract_frame
 from .tools.movie_tools import get_video_resolution, get_video_duration
@@ -96,6 +97,8 @@ class VideoAdmin(admin.ModelAdmin):
         'transcription_type',
         'is_transcription_available',
         'video_file',
+        'file_checksum',
+        'checksum_verified_at',
         'publication_date',
         'duration',
         'start_time',
@@ -105,7 +108,7 @@ class VideoAdmin(admin.ModelAdmin):
         'created_at',
         'updated_at'
     )
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'file_checksum', 'checksum_verified_at')
     change_form_template = "admin/video_change_form.html"  # Specify the custom template
 
     def display_categories(self, obj):
@@ -181,7 +184,7 @@ class VideoAdmin(admin.ModelAdmin):
 
 @admin.register(VideoPill)
 class VideoPillAdmin(admin.ModelAdmin):
-    list_display = ('video', 'start_time', 'stop_time')
+    list_display = ('video', 'start_time', 'stop_time', 'clip_file')
     search_fields = ('video__title',)
 
 
@@ -388,4 +391,19 @@ class AutomaticPreviewImageAdmin(admin.ModelAdmin):
             return format_html('<img src="{}" style="height:50px;"/>', obj.image.url)
         return "No image"
 
-    image_tag.short_description = 'Preview Image'
\ No newline at end of file
+    image_tag.short_description = 'Preview Image'
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at')
+    search_fields = ('name', 'sha256')
+    readonly_fields = ('name', 'sha256', 'size', 'ref_count', 'created_at')
+
+
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ('upload_id', 'filename', 'total_size', 'target_type', 'target_id', 'status', 'username',
+                    'created_at', 'completed_at')
+    list_filter = ('status', 'target_type')
+    search_fields = ('filename', 'username')
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+from django.core.files import File
+
+from core.storage import is_content_addressed
+from core.tools.movie_tools import cut_video_clip
+
+CLIP_FIELDS = ['clip_file', 'clip_start_time', 'clip_stop_time']
+
+
+def clip_file_name(source_name, start_time, stop_time):
+    """Returns the file name of the clip cut from source_name for the given range."""
+    base_name = os.path.splitext(os.path.basename(source_name))[0]
+    start = int(start_time.total_seconds())
+    stop = int(stop_time.total_seconds()) if stop_time is not None else 'end'
+    return f"{base_name}_clip_{start}_{stop}.mp4"
+
+
+def delete_clip(instance):
+    """Deletes the materialised clip of a MaterializedClip instance, if any."""
+    if not instance.clip_file and instance.clip_start_time is None and instance.clip_stop_time is None:
+        return False
+
+    if instance.clip_file and not is_content_addressed(instance.clip_file.storage):
+        # the content-addressed storage releases the replaced file when the instance is saved
+        instance.clip_file.delete(save=False)
+    instance.clip_file = None
+    instance.clip_start_time = None
+    instance.clip_stop_time = None
+    instance.save(update_fields=CLIP_FIELDS)
+    return True
+
+
+def materialize_clip(instance, force=False):
+    """
+    Cuts the sub-range of a MaterializedClip instance (Video or VideoPill) into its own file.
+
+    The clip is regenerated only when the range has changed since the last cut (or when force is True).
+    If the instance covers the whole recording, any existing clip is deleted.
+
+    :param instance: Video or VideoPill instance
+    :param force: regenerate the clip even if it is up to date
+    :return: True if the clip has been (re)generated or deleted, False if nothing changed
+    """
+    source = instance.get_clip_source()
+    clip_range = instance.get_clip_range()
+
+    if not source or clip_range is None:
+        return delete_clip(instance)
+
+    if instance.is_clip_current() and not force:
+        return False
+
+    start_time, stop_time = clip_range
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_clip_path = os.path.join(temp_dir, 'clip.mp4')
+        cut_video_clip(source.path, temp_clip_path, start_time, stop_time)
+
+        if instance.clip_file and not is_content_addressed(instance.clip_file.storage):
+            instance.clip_file.delete(save=False)
+
+        with open(temp_clip_path, 'rb') as f:
+            instance.clip_file.save(clip_file_name(source.name, start_time, stop_time), File(f), save=False)
+
+    instance.clip_start_time = start_time
+    instance.clip_stop_time = stop_time
+    instance.save(update_fields=CLIP_FIELDS)
+
+    print(f"Clip materialised for {instance}: {instance.clip_file.name}")
+    return True
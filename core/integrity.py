@@ -0,0 +1,95 @@
+import hashlib
+import threading
+import time
+
+from django.db.models import Count
+
+from core.storage import is_sharded_name
+from core.tools.file_tools import CHECKSUM_CHUNK_SIZE
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the bytes read per second, shared by the threads of the scrub.
+
+    :param bytes_per_second: maximum read rate, 0 means unlimited
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def acquire(self, n):
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + n / self.bytes_per_second
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def compute_field_file_checksum(field_file, rate_limiter=None, chunk_size=CHECKSUM_CHUNK_SIZE):
+    """
+    Computes the sha256 of a FieldFile reading it in chunks from its storage.
+
+    :param field_file: FieldFile (e.g. video.video_file)
+    :param rate_limiter: optional RateLimiter throttling the reads
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    with field_file.storage.open(field_file.name, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if rate_limiter is not None:
+                rate_limiter.acquire(len(chunk))
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_ingest_checksum(field_file):
+    """
+    Returns the checksum of a newly stored file.
+
+    Files stored by ContentAddressedStorage are named after their sha256, which has just been computed while
+    saving them: in this case the file is not read again.
+    """
+    if is_sharded_name(field_file.name):
+        return field_file.name.rsplit('/', 1)[-1].split('.', 1)[0]
+    return compute_field_file_checksum(field_file)
+
+
+def update_media_checksum(instance):
+    """
+    Computes and stores the checksum of the main file of a Video or Document instance.
+
+    :return: the checksum, or None if the instance has no file
+    """
+    field_file = instance.get_media_file()
+    if not field_file:
+        return None
+
+    instance.file_checksum = get_ingest_checksum(field_file)
+    instance.save(update_fields=['file_checksum'])
+    return instance.file_checksum
+
+
+def find_duplicates(instance):
+    """Returns the queryset of the other instances of the same model with the same file checksum."""
+    if not instance.file_checksum:
+        return type(instance).objects.none()
+    return type(instance).objects.filter(file_checksum=instance.file_checksum).exclude(pk=instance.pk)
+
+
+def get_duplicate_checksums(model):
+    """Returns the checksums shared by more than one instance of model, with their counts."""
+    return model.objects.exclude(file_checksum='') \
+        .values('file_checksum') \
+        .annotate(count=Count('id')) \
+        .filter(count__gt=1) \
+        .order_by('-count')
@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+INSTRUMENTATION_MIDDLEWARE = 'mediamatrixhub.instrumentation.InstrumentationMiddleware'
+
+
+class Command(BaseCommand):
+    help = 'Measure the overhead of the instrumentation middleware: the same requests are timed, alternately, ' \
+           'with and without it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path requested (can be repeated); default the categories page')
+        parser.add_argument('--requests', type=int, default=200, help='Requests of a path in each round')
+        parser.add_argument('--rounds', type=int, default=10, help='Rounds with and without the middleware')
+
+    def get_client(self, middleware, path):
+        with override_settings(MIDDLEWARE=middleware, INSTRUMENTATION_ENABLED=True):
+            client = Client()
+            # the middleware chain is built by the first request, with the overridden settings
+            client.get(path)
+        return client
+
+    def run_round(self, client, paths, requests):
+        start = time.perf_counter()
+        for _ in range(requests):
+            for path in paths:
+                client.get(path)
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [reverse('show-categories')]
+        for path in paths:
+            status_code = Client().get(path).status_code
+            if status_code >= 400:
+                raise CommandError(f"{path}: status {status_code}")
+
+        other_middleware = [name for name in settings.MIDDLEWARE if name != INSTRUMENTATION_MIDDLEWARE]
+        plain = self.get_client(other_middleware, paths[0])
+        instrumented = self.get_client([INSTRUMENTATION_MIDDLEWARE] + other_middleware, paths[0])
+
+        plain_times, instrumented_times = [], []
+        for _ in range(options['rounds']):
+            # alternated, so that both suffer the same noise
+            plain_times.append(self.run_round(plain, paths, options['requests']))
+            instrumented_times.append(self.run_round(instrumented, paths, options['requests']))
+
+        # the fastest rounds: the least disturbed by the rest of the machine
+        count = options['requests'] * len(paths)
+        plain_ms = min(plain_times) / count * 1000
+        instrumented_ms = min(instrumented_times) / count * 1000
+        self.stdout.write(f"without instrumentation: {plain_ms:.3f} ms/request")
+        self.stdout.write(f"with instrumentation: {instrumented_ms:.3f} ms/request")
+        self.stdout.write(f"overhead: {(instrumented_ms / plain_ms - 1) * 100:.2f}%")
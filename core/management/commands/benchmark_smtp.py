@@ -0,0 +1,105 @@
+import socketserver
+import threading
+import time
+
+from django.core.management import BaseCommand
+
+from mediamatrixhub.email_utils import SMTPConnectionPool, send_many
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server which accepts and discards every message, answering after server.latency seconds."""
+
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost benchmark sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-localhost\r\n')
+                self.reply('250 8BITMIME')
+            elif command == b'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.messages = 0
+
+
+class Command(BaseCommand):
+    help = 'Measure the messages/sec sent to a local SMTP sink with a new connection for each message ' \
+           '(the old behaviour of my_send_email) and with pooled connections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Number of messages of each run')
+        parser.add_argument('--latency', type=float, default=2.0,
+                            help='Delay in ms of each reply of the sink, to simulate the network round trip')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent connections of the last run')
+        parser.add_argument('--max-messages', type=int, default=100, help='Messages per pooled connection')
+
+    def handle(self, *args, **options):
+        sink = SMTPSink(options['latency'] / 1000)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        email_host = '%s:%d' % sink.server_address
+
+        messages = [{
+            'from_email': 'benchmark@example.org',
+            'to_addresses': [f'subscriber{i}@example.org'],
+            'subject': f'Benchmark message {i}',
+            'body': f'<p>Message {i}</p>' + '<p>Lorem ipsum dolor sit amet.</p>' * 50,
+        } for i in range(options['messages'])]
+
+        runs = [
+            ('new connection per message', SMTPConnectionPool(email_host, max_connections=0, max_messages=1), 1),
+            ('pooled, 1 connection', SMTPConnectionPool(email_host, max_messages=options['max_messages']), 1),
+            (f"pooled, {options['workers']} connections",
+             SMTPConnectionPool(email_host, max_connections=options['workers'], max_messages=options['max_messages']),
+             options['workers']),
+        ]
+
+        try:
+            for label, pool, workers in runs:
+                received = sink.messages
+                start = time.perf_counter()
+                results = send_many(messages, workers=workers, pool=pool)
+                elapsed = time.perf_counter() - start
+                pool.close()
+
+                errors = [error for error in results if error is not None]
+                self.stdout.write(f"{label}: {len(messages)} messages in {elapsed:.2f} s, "
+                                  f"{len(messages) / elapsed:.0f} messages/s, "
+                                  f"{pool.connections_opened} connections, "
+                                  f"received {sink.messages - received}, errors {len(errors)}")
+                if errors:
+                    self.stdout.write(self.style.WARNING(f"first error: {errors[0]!r}"))
+        finally:
+            sink.shutdown()
+            sink.server_close()
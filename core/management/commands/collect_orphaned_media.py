@@ -0,0 +1,96 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from core.media_gc import collect_referenced_keys, scan_directory, find_ref_count_mismatches, delete_orphaned_blobs, \
+    DELETE_BATCH_SIZE
+from core.storage import is_sharded_name
+
+
+class Command(BaseCommand):
+    help = 'Find the files of MEDIA_ROOT not referenced by any file field (mark and sweep) ' \
+           'and optionally delete them, with the stale files of the interrupted uploads. ' \
+           'Report the content-addressed files whose reference count is wrong.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='Delete the orphaned files (default: report only)')
+        parser.add_argument('--grace-days', type=int, default=7,
+                            help='Ignore the files modified in the last GRACE_DAYS days')
+        parser.add_argument('--workers', type=int, default=8, help='Number of threads scanning the directories')
+        parser.add_argument('--exclude', action='append', default=[],
+                            help='Directory relative to MEDIA_ROOT to be skipped (can be repeated)')
+        parser.add_argument('--quiet', action='store_true', help='Print only the summary')
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        excluded = {os.path.normpath(path).strip('/') for path in options['exclude']}
+
+        start = time.perf_counter()
+        blob_references = Counter()
+        referenced = collect_referenced_keys(blob_references=blob_references)
+        self.stdout.write(f"Referenced files: {len(referenced)} ({time.perf_counter() - start:.1f} s)")
+
+        mismatches = 0
+        for name, ref_count, references in find_ref_count_mismatches(blob_references):
+            mismatches += 1
+            self.stdout.write(self.style.WARNING(f"ref_count mismatch: {name} "
+                                                 f"(ref_count {ref_count}, references {references})"))
+
+        min_age_timestamp = time.time() - options['grace_days'] * 86400
+        orphans_count = 0
+        orphans_bytes = 0
+        directories = 0
+        errors = 0
+        # content-addressed files deleted, whose rows are deleted in batches
+        deleted_blobs = []
+
+        # the scan is depth-first on a bounded pool: at most max_pending directories are submitted at a time, and
+        # the directories waiting are the subdirectories found along the current paths
+        max_pending = options['workers'] * 2
+        waiting = ['']
+        pending = set()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while waiting or pending:
+                while waiting and len(pending) < max_pending:
+                    pending.add(executor.submit(scan_directory, root, waiting.pop(), referenced, min_age_timestamp,
+                                                options['delete']))
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        orphans, subdirs, directory_errors = future.result()
+                    except OSError as e:
+                        self.stdout.write(self.style.ERROR(str(e)))
+                        errors += 1
+                        continue
+
+                    directories += 1
+                    for relative_name, size in orphans:
+                        orphans_count += 1
+                        if options['delete'] and is_sharded_name(relative_name):
+                            deleted_blobs.append(relative_name)
+                        orphans_bytes += size
+                        if not options['quiet']:
+                            self.stdout.write(f"{'deleted' if options['delete'] else 'orphan'}: {relative_name} ({size} bytes)")
+                    for message in directory_errors:
+                        self.stdout.write(self.style.ERROR(message))
+                        errors += 1
+
+                    waiting.extend(subdir for subdir in subdirs if subdir not in excluded)
+
+                    if len(deleted_blobs) >= DELETE_BATCH_SIZE:
+                        delete_orphaned_blobs(deleted_blobs)
+                        deleted_blobs.clear()
+
+        delete_orphaned_blobs(deleted_blobs)
+
+        action = 'reclaimed' if options['delete'] else 'reclaimable'
+        summary = f"Scanned {directories} directories in {time.perf_counter() - start:.1f} s: " \
+                  f"{orphans_count} orphaned files, {orphans_bytes / 1024 / 1024:.1f} MB {action}, " \
+                  f"{mismatches} ref_count mismatches, {errors} errors"
+        healthy = not errors and not mismatches
+        self.stdout.write(self.style.SUCCESS(summary) if healthy else self.style.WARNING(summary))
@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from core.clips import materialize_clip
+from core.models import Video, VideoPill
+
+
+class Command(BaseCommand):
+    help = 'Cut VideoPill ranges and videos with non-default start/stop times into their own clip files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate clips even if they are up to date')
+
+    def handle(self, *args, **options):
+        force = options['force']
+
+        counter = 0
+        errors = 0
+
+        for instance in list(Video.objects.exclude(video_file='')) + list(VideoPill.objects.select_related('video')):
+            try:
+                if materialize_clip(instance, force=force):
+                    self.stdout.write(f"{instance}: {instance.clip_file.name or 'clip removed'}")
+                    counter += 1
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Error materialising clip for {instance}: {e}"))
+                errors += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Clips updated: {counter}, errors: {errors}"))
@@ -0,0 +1,120 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from core.media_gc import get_file_fields
+from core.models import MediaBlob
+from core.storage import ContentAddressedStorage, is_sharded_name
+
+
+class Command(BaseCommand):
+    help = 'Move existing media files to the hash-sharded layout of ContentAddressedStorage ' \
+           'and rewrite the FileField paths. Run it while uploads are stopped, once CONTENT_ADDRESSED_STORAGE is on.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of threads hashing and moving files')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows updated per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only show what would be moved')
+        parser.add_argument('--keep-legacy-files', action='store_true',
+                            help='Do not delete the legacy files after the paths have been rewritten')
+
+    def handle(self, *args, **options):
+        if not settings.CONTENT_ADDRESSED_STORAGE and not options['dry_run']:
+            # the plain storage would delete the shared files and would not count the references
+            raise CommandError("CONTENT_ADDRESSED_STORAGE is off: turn it on before moving the files")
+
+        storage = ContentAddressedStorage(location=settings.MEDIA_ROOT)
+
+        # legacy name -> list of (model, field name, pk)
+        references = defaultdict(list)
+
+        for model, field_name in get_file_fields():
+            queryset = model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            for pk, name in queryset.values_list('pk', field_name).iterator(chunk_size=2000):
+                if not is_sharded_name(name):
+                    references[name].append((model, field_name, pk))
+
+        self.stdout.write(f"Legacy files: {len(references)}")
+
+        if options['dry_run']:
+            for name, refs in references.items():
+                self.stdout.write(f"{name}: {len(refs)} references")
+            return
+
+        # hash and link the files in parallel: this does not touch the database
+        moved = {}
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(storage.adopt, name): name for name in references if storage.exists(name)}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    moved[name] = future.result()
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"Error moving {name}: {e}"))
+
+        missing = [name for name in references if name not in moved]
+        for name in missing:
+            self.stdout.write(self.style.WARNING(f"Skipped (missing or unreadable): {name}"))
+
+        # rewrite the paths and the reference counts, one transaction per batch of files
+        names = list(moved)
+        batch_size = options['batch_size']
+        rows = 0
+
+        for i in range(0, len(names), batch_size):
+            batch = names[i:i + batch_size]
+
+            # legacy names with a row not rewritten: the file is kept, the media GC deletes it if it is an orphan
+            not_rewritten = set()
+
+            with transaction.atomic():
+                ref_counts = defaultdict(int)
+                blob_info = {}
+
+                for name in batch:
+                    blob_name, sha256, size = moved[name]
+                    blob_info[blob_name] = (sha256, size)
+                    for model, field_name, pk in references[name]:
+                        updated = model._default_manager.filter(pk=pk, **{field_name: name}) \
+                            .update(**{field_name: blob_name})
+                        # 0 if the row has been changed or deleted since the scan
+                        rows += updated
+                        ref_counts[blob_name] += updated
+                        if not updated:
+                            not_rewritten.add(name)
+
+                existing = set(MediaBlob.objects.filter(name__in=ref_counts).values_list('name', flat=True))
+                for blob_name, count in ref_counts.items():
+                    if blob_name in existing and count:
+                        MediaBlob.objects.filter(name=blob_name).update(ref_count=F('ref_count') + count)
+                MediaBlob.objects.bulk_create([
+                    MediaBlob(name=blob_name, sha256=blob_info[blob_name][0], size=blob_info[blob_name][1],
+                              ref_count=count)
+                    for blob_name, count in ref_counts.items() if blob_name not in existing
+                ])
+
+            if not options['keep_legacy_files']:
+                for name in batch:
+                    if name not in not_rewritten:
+                        self.delete_legacy_file(storage, name)
+
+            self.stdout.write(f"Moved {min(i + batch_size, len(names))}/{len(names)} files")
+
+        self.stdout.write(self.style.SUCCESS(f"Files moved: {len(names)}, rows updated: {rows}, "
+                                             f"skipped: {len(missing)}"))
+
+    @staticmethod
+    def delete_legacy_file(storage, name):
+        path = storage.path(name)
+        try:
+            os.remove(path)
+            # legacy layout: one directory per uploaded file
+            if os.path.dirname(path) != os.path.normpath(storage.location):
+                os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
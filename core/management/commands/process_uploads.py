@@ -0,0 +1,34 @@
+import datetime
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from core.models import ChunkedUpload
+from core.uploads import process_upload
+
+
+class Command(BaseCommand):
+    help = 'Run the post-upload processing (duration, clips, checksum, previews) of the chunked uploads left ' \
+           'pending, e.g. because the worker was restarted before its background thread finished.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=30,
+                            help='Minutes since the completion, so that the uploads still processed by their '
+                                 'background thread are left alone')
+
+    def handle(self, *args, **options):
+        completed_before = timezone.now() - datetime.timedelta(minutes=options['min_age'])
+        uploads = ChunkedUpload.objects.filter(status=ChunkedUpload.STATUS_PROCESSING,
+                                               completed_at__lt=completed_before).order_by('completed_at')
+
+        processed = 0
+        errors = 0
+        for upload in uploads:
+            try:
+                process_upload(upload)
+                processed += 1
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Error processing {upload}: {e}"))
+                errors += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Uploads processed: {processed}, errors: {errors}"))
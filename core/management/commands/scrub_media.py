@@ -0,0 +1,118 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from core.integrity import RateLimiter, compute_field_file_checksum, get_duplicate_checksums
+from core.models import Video, Document
+from mediamatrixhub.email_utils import my_send_email
+from mediamatrixhub.settings import SUBJECT_EMAIL, MONITOR_EMAIL_ADDRESSES, FROM_EMAIL, EMAIL_HOST
+
+OK = 'ok'
+MISMATCH = 'mismatch'
+MISSING = 'missing'
+COMPUTED = 'computed'
+
+
+def verify(instance, rate_limiter):
+    """
+    Re-reads the media file of instance and compares its checksum with the stored one.
+
+    :return: tuple (result, checksum, bytes read)
+    """
+    field_file = instance.get_media_file()
+    try:
+        if not field_file.storage.exists(field_file.name):
+            return MISSING, None, 0
+        size = field_file.storage.size(field_file.name)
+        checksum = compute_field_file_checksum(field_file, rate_limiter)
+    except OSError:
+        return MISSING, None, 0
+
+    if not instance.file_checksum:
+        return COMPUTED, checksum, size
+    return (OK if checksum == instance.file_checksum else MISMATCH), checksum, size
+
+
+class Command(BaseCommand):
+    help = 'Re-verify the checksums of the media files (bit-rot scrubbing) and report mismatches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of threads reading files')
+        parser.add_argument('--rate-limit', type=float, default=50,
+                            help='Maximum read rate in MB/s shared by all the threads (0 = unlimited)')
+        parser.add_argument('--days', type=int, default=0,
+                            help='Skip files verified in the last DAYS days')
+        parser.add_argument('--duplicates', action='store_true', help='Also report files with the same content')
+        parser.add_argument('--send_email', action='store_true', help='Send the report by email')
+
+    def handle(self, *args, **options):
+        rate_limiter = RateLimiter(int(options['rate_limit'] * 1024 * 1024))
+
+        instances = []
+        for model in (Video, Document):
+            queryset = model.objects.all()
+            if options['days']:
+                verified_since = timezone.now() - timedelta(days=options['days'])
+                queryset = queryset.exclude(checksum_verified_at__gte=verified_since)
+            instances.extend(instance for instance in queryset if instance.get_media_file())
+
+        self.stdout.write(f"Files to verify: {len(instances)}")
+
+        report = []
+        counters = {OK: 0, MISMATCH: 0, MISSING: 0, COMPUTED: 0}
+        total_bytes = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(verify, instance, rate_limiter): instance for instance in instances}
+
+            for future in as_completed(futures):
+                instance = futures[future]
+                result, checksum, size = future.result()
+                counters[result] += 1
+                total_bytes += size
+                label = f"{type(instance).__name__} #{instance.id} {instance.get_media_file().name}"
+
+                if result == MISMATCH:
+                    message = f"CHECKSUM MISMATCH: {label} expected {instance.file_checksum} found {checksum}"
+                    self.stdout.write(self.style.ERROR(message))
+                    report.append(message)
+                elif result == MISSING:
+                    message = f"MISSING FILE: {label}"
+                    self.stdout.write(self.style.ERROR(message))
+                    report.append(message)
+                else:
+                    update = {'checksum_verified_at': timezone.now()}
+                    if result == COMPUTED:
+                        update['file_checksum'] = checksum
+                    type(instance).objects.filter(pk=instance.pk).update(**update)
+
+        elapsed = time.perf_counter() - start
+        summary = f"verified: {counters[OK]}, checksums computed: {counters[COMPUTED]}, " \
+                  f"mismatches: {counters[MISMATCH]}, missing: {counters[MISSING]}, " \
+                  f"read {total_bytes / 1024 / 1024:.1f} MB in {elapsed:.1f} s"
+
+        if options['duplicates']:
+            for model in (Video, Document):
+                for row in get_duplicate_checksums(model):
+                    ids = list(model.objects.filter(file_checksum=row['file_checksum']).values_list('id', flat=True))
+                    message = f"DUPLICATE {model.__name__} {row['file_checksum']}: ids {ids}"
+                    self.stdout.write(self.style.WARNING(message))
+                    report.append(message)
+
+        self.stdout.write(self.style.SUCCESS(summary) if not report else self.style.WARNING(summary))
+
+        if options['send_email']:
+            email_body = "<h1>Verifica integrità archivio media</h1><br>" + "<br>".join(report) + f"<br><br>{summary}"
+            my_send_email(
+                FROM_EMAIL,
+                MONITOR_EMAIL_ADDRESSES,
+                f'{SUBJECT_EMAIL} Verifica integrità archivio media',
+                email_body,
+                bcc_addresses=None,
+                attachments=None,
+                email_host=EMAIL_HOST
+            )
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import re
+from urllib.parse import unquote
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from django_ckeditor_5.fields import CKEditor5Field
+
+from core.models import MediaBlob, ChunkedUpload
+from core.storage import is_sharded_name
+from core.uploads import PARTIAL_UPLOADS_DIR
+
+# rows of MediaBlob deleted with one query
+DELETE_BATCH_SIZE = 500
+
+# directories of the files being uploaded: the storage temporary files and the chunked uploads
+UPLOAD_DIRS = ('.incoming', PARTIAL_UPLOADS_DIR)
+
+
+def get_file_fields():
+    """Returns the list of (model, field name) of every FileField/ImageField of the installed models."""
+    result = []
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                result.append((model, field.name))
+    return result
+
+
+def get_rich_text_fields():
+    """Returns the list of (model, field name) of the CKEditor fields, which may embed uploaded images."""
+    result = []
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, CKEditor5Field):
+                result.append((model, field.name))
+    return result
+
+
+def path_key(name):
+    """
+    Returns a compact key of a file name relative to MEDIA_ROOT.
+
+    A 64-bit hash is stored instead of the name, so that the set of the referenced files of a large archive
+    stays small; a collision can only make an orphan look referenced, never the opposite.
+    """
+    name = os.path.normpath(name).lstrip('/')
+    return int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def collect_referenced_keys(chunk_size=5000, blob_references=None):
+    """
+    Mark phase: streams the names referenced by every file field and by the media URLs embedded in rich text,
+    and the partial files of the chunked uploads in progress.
+
+    The MediaBlob rows are not marks: a content-addressed file no field points to is an orphan, whatever its
+    ref_count says (see find_ref_count_mismatches).
+
+    :param blob_references: Counter updated with the number of file field values pointing to each hash-sharded name
+    :return: set of path_key() of the referenced files
+    """
+    referenced = set()
+
+    for model, field_name in get_file_fields():
+        queryset = model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        for name in queryset.values_list(field_name, flat=True).iterator(chunk_size=chunk_size):
+            referenced.add(path_key(name))
+            if blob_references is not None and is_sharded_name(name):
+                blob_references[name] += 1
+
+    # the partial files of the completed, cancelled (deleted) or unknown uploads are swept with the grace period
+    uploads_in_progress = ChunkedUpload.objects.filter(status=ChunkedUpload.STATUS_UPLOADING)
+    for upload_id in uploads_in_progress.values_list('upload_id', flat=True).iterator(chunk_size=chunk_size):
+        referenced.add(path_key(os.path.join(PARTIAL_UPLOADS_DIR, f"{upload_id}.part")))
+
+    media_url_re = re.compile(re.escape(settings.MEDIA_URL) + r'([^"\'\s?#)<>]+)')
+    for model, field_name in get_rich_text_fields():
+        queryset = model._default_manager.filter(**{f'{field_name}__contains': settings.MEDIA_URL})
+        for text in queryset.values_list(field_name, flat=True).iterator(chunk_size=chunk_size):
+            for match in media_url_re.finditer(text):
+                referenced.add(path_key(unquote(match.group(1))))
+
+    return referenced
+
+
+def scan_directory(root, relative_dir, referenced, min_age_timestamp, delete=False):
+    """
+    Sweep phase for one directory: finds the files not in referenced and older than min_age_timestamp.
+
+    :return: tuple (list of (relative name, size) of the orphans, list of relative subdirectories, errors)
+    """
+    orphans = []
+    subdirs = []
+    errors = []
+    directory = os.path.join(root, relative_dir)
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            relative_name = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    # the other hidden directories do not belong to the application
+                    if not entry.name.startswith('.') or relative_name in UPLOAD_DIRS:
+                        subdirs.append(relative_name)
+                    continue
+                if path_key(relative_name) in referenced:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > min_age_timestamp:
+                    continue
+                if delete:
+                    os.remove(entry.path)
+                orphans.append((relative_name, stat.st_size))
+            except OSError as e:
+                errors.append(f"{relative_name}: {e}")
+
+    if delete and orphans and relative_dir:
+        try:
+            # legacy layout: one directory per uploaded file
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    return orphans, subdirs, errors
+
+
+def find_ref_count_mismatches(blob_references, chunk_size=5000):
+    """
+    Compares the ref_count of the MediaBlob rows with the references found by the mark phase.
+
+    :param blob_references: Counter filled by collect_referenced_keys
+    :return: generator of (name, ref_count, references); ref_count is None for a referenced file without a row
+    """
+    seen = set()
+    for name, ref_count in MediaBlob.objects.values_list('name', 'ref_count').iterator(chunk_size=chunk_size):
+        seen.add(name)
+        if ref_count != blob_references.get(name, 0):
+            yield name, ref_count, blob_references.get(name, 0)
+
+    for name, references in blob_references.items():
+        if name not in seen:
+            yield name, None, references
+
+
+def delete_orphaned_blobs(names, batch_size=DELETE_BATCH_SIZE):
+    """Deletes the MediaBlob rows of the content-addressed files deleted by the sweep."""
+    names = [name for name in names if is_sharded_name(name)]
+    for i in range(0, len(names), batch_size):
+        MediaBlob.objects.filter(name__in=names[i:i + batch_size]).delete()
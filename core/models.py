@@ -1,3 +1,4 @@
+import datetime
 import time
 import uuid
 
@@ -67,6 +68,23 @@ class Person(models.Model):
         return f"{self.name} {self.surname}"
 
 
+class MediaBlob(models.Model):
+    """
+    A file stored by core.storage.ContentAddressedStorage.
+
+    Files are stored once per content (sha256) under a hash-sharded path: ref_count is the number of
+    FileField values pointing to the file, which is deleted when the count drops to zero.
+    """
+    name = models.CharField(max_length=512, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"MediaBlob {self.name} refs={self.ref_count}"
+
+
 def calc_directory_path(instance, filename):
     now_ms = int(time.time_ns() / 1000)
 
@@ -144,6 +162,10 @@ class Media(models.Model):
 
     publication_date = models.DateField(null=True, blank=True, verbose_name=_("Publication Date"))
 
+    # sha256 of the media file, computed at ingest and re-verified by the scrub_media command
+    file_checksum = models.CharField(max_length=64, blank=True, db_index=True, verbose_name=_("File Checksum"))
+    checksum_verified_at = models.DateTimeField(null=True, blank=True, verbose_name=_("Checksum verified at"))
+
     created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
     updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
 
@@ -164,6 +186,10 @@ class Media(models.Model):
     def has_tags(self):
         return self.tags.exists()
 
+    def get_media_file(self):
+        """Returns the FieldFile of the main file of the media (video or document file)."""
+        raise NotImplementedError
+
     def get_associated_image(self):
         # if self.preview_image:
         #     print(f"Associated image: {self.preview_image}")
@@ -193,8 +219,7 @@ class Document(Media):
     # version = models.CharField(max_length=255, blank=True, verbose_name=_("Version"))
     # doi = models.CharField(max_length=255, blank=True, verbose_name=_("Document Identifier (DOI)"))
     # accessibility_info = models.TextField(blank=True, verbose_name=_("Accessibility Information"))
-    # file_checksum = models.CharField(max_length=255, blank=True, verbose_name=_("File Checksum"))
-    # Consider adding methods for preview generation, search optimization, and file integrity verification
+    # Consider adding methods for preview generation and search optimization
 
     def __str__(self):
         return self.title
@@ -202,6 +227,9 @@ class Document(Media):
     def is_document(self):
         return True
 
+    def get_media_file(self):
+        return self.document_file
+
     def is_pdf(self):
         return self.document_file.name.endswith('.pdf')
 
@@ -249,7 +277,48 @@ class VideoDocument(models.Model):
         unique_together = ('video', 'document', 'order')  # Optional: ensures unique combinations
 
 
-class Video(Media):
+class MaterializedClip(models.Model):
+    """
+    Abstract model for objects that define a sub-range of a video file.
+
+    The sub-range is cut into its own file (clip_file) so that only the clip is streamed to the client instead of
+    the full source file. clip_start_time and clip_stop_time record the range the clip was cut for, so that the clip
+    is regenerated only when the range changes.
+    """
+    clip_file = models.FileField(upload_to=calc_directory_path, max_length=512, blank=True, null=True,
+                                 verbose_name=_("Clip"))
+    clip_start_time = models.DurationField(null=True, blank=True, editable=False)
+    clip_stop_time = models.DurationField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def get_clip_source(self):
+        """Returns the FileField of the full recording the clip is cut from."""
+        raise NotImplementedError
+
+    def get_clip_range(self):
+        """
+        Returns the (start, stop) tuple of the sub-range to be materialised,
+        or None if the whole source file has to be served; stop is None for a range up to the end of the source.
+        """
+        raise NotImplementedError
+
+    def is_clip_current(self):
+        """Check if clip_file exists and has been cut for the current range."""
+        clip_range = self.get_clip_range()
+        if clip_range is None or not self.clip_file:
+            return False
+        return (self.clip_start_time, self.clip_stop_time) == clip_range
+
+    def get_playback_file(self):
+        """Returns the clip if it is up to date, otherwise the full source file."""
+        if self.is_clip_current():
+            return self.clip_file
+        return self.get_clip_source()
+
+
+class Video(MaterializedClip, Media):
     categories = models.ManyToManyField('core.Category', through='VideoCategory')
 
     video_file = models.FileField(upload_to=calc_directory_path, max_length = 512)
@@ -294,8 +363,26 @@ class Video(Media):
     def is_video(self):
         return True
 
+    def get_media_file(self):
+        return self.video_file
+
+    def get_clip_source(self):
+        return self.video_file
 
-class VideoPill(models.Model):
+    def get_clip_range(self):
+        start_time = self.start_time or datetime.timedelta(0)
+        stop_time = self.stop_time or self.duration
+
+        if start_time == datetime.timedelta(0) and (stop_time is None or stop_time == self.duration):
+            # default range: the whole recording
+            return None
+        if stop_time is not None and stop_time <= start_time:
+            return None
+        # stop_time None (no stop time and duration unknown): up to the end of the recording
+        return start_time, stop_time
+
+
+class VideoPill(MaterializedClip):
     video = models.OneToOneField(Video, on_delete=models.CASCADE)
     start_time = models.DurationField()
     stop_time = models.DurationField()
@@ -303,6 +390,77 @@ class VideoPill(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"Pill of {self.video} ({self.start_time} - {self.stop_time})"
+
+    def get_clip_source(self):
+        return self.video.video_file
+
+    def get_clip_range(self):
+        if self.stop_time <= self.start_time:
+            return None
+        return self.start_time, self.stop_time
+
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload of a large file, sent in fixed-size chunks (see core/uploads.py).
+
+    The chunks are written into a partial file under MEDIA_ROOT; when all of them have been received, the file is
+    moved into the storage and attached to the target Video or Document.
+    """
+    TARGET_VIDEO = 'video'
+    TARGET_DOCUMENT = 'document'
+    TARGET_CHOICES = [
+        (TARGET_VIDEO, _("Video")),
+        (TARGET_DOCUMENT, _("Document")),
+    ]
+
+    STATUS_UPLOADING = 'uploading'
+    # the file is attached, the post-upload processing of the target is pending
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, _("Uploading")),
+        (STATUS_PROCESSING, _("Processing")),
+        (STATUS_COMPLETE, _("Complete")),
+    ]
+
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    target_type = models.CharField(max_length=10, choices=TARGET_CHOICES)
+    target_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    username = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"ChunkedUpload {self.upload_id} {self.filename} ({self.status})"
+
+    @property
+    def number_of_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def chunk_length(self, index):
+        """Returns the expected length of the chunk with the given index."""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+
+class ChunkedUploadPart(models.Model):
+    upload = models.ForeignKey(ChunkedUpload, on_delete=models.CASCADE, related_name='parts')
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('upload', 'index')
+
 
 class Playlist(models.Model):
     videos = models.ManyToManyField(Video, through='PlaylistVideo')
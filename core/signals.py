@@ -1,18 +1,71 @@
 import PIL
 import io
+import time
+from functools import partial
 
 from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db import transaction
+from django.db.models import FileField
+from django.db.models.signals import post_save, post_delete, m2m_changed, pre_save, pre_delete
 from django.dispatch import receiver
 from moviepy import VideoFileClip
 
-from core.models import Document, Video, AutomaticPreviewImage
+from core.clips import materialize_clip, CLIP_FIELDS
+from core.integrity import update_media_checksum, find_duplicates
+from core.models import Document, Video, AutomaticPreviewImage, VideoPill, Image
+from core.storage import is_content_addressed
 from core.tools.movie_tools import get_video_resolution, get_video_duration, extract_text_from_vtt
+from mediamatrixhub.metrics import CLIP_MATERIALIZATIONS, CLIP_MATERIALIZATION_DURATION
+
+
+def is_processing_deferred(instance):
+    """True when the slow post-upload processing is left to core.uploads.process_upload (chunked uploads)."""
+    return getattr(instance, 'defer_media_processing', False)
+
+
+def get_content_addressed_fields(sender, update_fields):
+    """The file fields of sender saved by ContentAddressedStorage, among update_fields if given."""
+    return [field for field in sender._meta.concrete_fields
+            if isinstance(field, FileField) and is_content_addressed(field.storage)
+            and (update_fields is None or field.name in update_fields)]
+
+
+@receiver(pre_save)
+def remember_stored_file_names(sender, instance, **kwargs):
+    """Keep the file names stored before the save, so that update_media_blob_references can see the replaced ones."""
+    fields = get_content_addressed_fields(sender, kwargs.get('update_fields', None))
+    if not fields:
+        return
+
+    stored_names = {}
+    if not instance._state.adding:
+        stored_names = sender._base_manager.filter(pk=instance.pk).values(*[f.attname for f in fields]).first() or {}
+    instance._stored_file_names = stored_names
+
+
+# connected before the other post_save receivers, which may save the instance again
+@receiver(post_save)
+def update_media_blob_references(sender, instance, **kwargs):
+    """
+    Count the references to the content-addressed files: the new file gains one, the replaced file loses one.
+
+    The counts are updated after the commit, so that a save rolled back does not change them.
+    """
+    stored_names = instance.__dict__.pop('_stored_file_names', None)
+    if stored_names is None:
+        return
+
+    for field in get_content_addressed_fields(sender, kwargs.get('update_fields', None)):
+        old_name = stored_names.get(field.attname) or ''
+        new_name = getattr(instance, field.attname).name or ''
+        if new_name != old_name:
+            transaction.on_commit(partial(field.storage.update_reference, old_name, new_name))
 
 
 @receiver(post_save, sender='core.Video')
 def video_post_save(sender, instance, **kwargs):
+    if is_processing_deferred(instance):
+        return
     # if created:
     if (
             instance.video_file
@@ -64,11 +117,107 @@ def update_fulltext_search_data(sender, instance, **kwargs):
         print(f"Fulltext search data updated for #{instance.id} {instance.title}")
 
 
+# fields which define the range of a clip: a save touching only other fields does not need a new cut
+CLIP_RANGE_FIELDS = {'video_file', 'duration', 'start_time', 'stop_time'}
+
+
+def clip_range_may_have_changed(update_fields):
+    if update_fields is None:
+        return True
+    if set(update_fields) <= set(CLIP_FIELDS):
+        return False
+    return bool(set(update_fields) & CLIP_RANGE_FIELDS)
+
+
+def measured_materialize_clip(instance):
+    """materialize_clip, counted and timed in the metrics."""
+    start = time.perf_counter()
+    try:
+        changed = materialize_clip(instance)
+    except Exception:
+        CLIP_MATERIALIZATIONS.inc(result='error')
+        raise
+    if changed:
+        CLIP_MATERIALIZATION_DURATION.observe(time.perf_counter() - start)
+    CLIP_MATERIALIZATIONS.inc(result='changed' if changed else 'unchanged')
+    return changed
+
+
+@receiver(post_save, sender=Video)
+def materialize_video_clip(sender, instance, **kwargs):
+    if is_processing_deferred(instance) or not clip_range_may_have_changed(kwargs.get('update_fields', None)):
+        return
+
+    try:
+        measured_materialize_clip(instance)
+    except Exception as e:
+        print(f"Error materialising clip for #{instance.id} {instance.title}: {e}")
+
+    # the pill is cut from this video: check it is still up to date
+    try:
+        measured_materialize_clip(instance.videopill)
+    except VideoPill.DoesNotExist:
+        pass
+    except Exception as e:
+        print(f"Error materialising pill clip for #{instance.id} {instance.title}: {e}")
+
+
+@receiver(post_save, sender=VideoPill)
+def materialize_video_pill_clip(sender, instance, **kwargs):
+    if not clip_range_may_have_changed(kwargs.get('update_fields', None)):
+        return
+
+    try:
+        measured_materialize_clip(instance)
+    except Exception as e:
+        print(f"Error materialising clip for {instance}: {e}")
+
+
+@receiver(post_delete, sender=VideoPill)
+def delete_video_pill_clip(sender, instance, **kwargs):
+    if instance.clip_file:
+        instance.clip_file.delete(save=False)
+
+
+@receiver(pre_save, sender=Video)
+@receiver(pre_save, sender=Document)
+def reset_file_checksum(sender, instance, **kwargs):
+    """Clear the checksum when the file of an existing instance is replaced, so that it is computed again."""
+    update_fields = kwargs.get('update_fields', None)
+    if not instance.pk or not instance.file_checksum or update_fields == {'file_checksum'}:
+        return
+
+    field_name = instance.get_media_file().field.name
+    stored_name = sender.objects.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+    if stored_name != instance.get_media_file().name:
+        instance.file_checksum = ''
+        instance.checksum_verified_at = None
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Document)
+def compute_media_checksum(sender, instance, **kwargs):
+    """Compute the checksum of the media file at ingest."""
+    if is_processing_deferred(instance) or instance.file_checksum or not instance.get_media_file():
+        return
+
+    try:
+        update_media_checksum(instance)
+    except Exception as e:
+        print(f"Error computing checksum for {sender.__name__} #{instance.id}: {e}")
+        return
+
+    for duplicate in find_duplicates(instance):
+        print(f"{sender.__name__} #{instance.id} {instance} has the same file content of #{duplicate.id} {duplicate}")
+
+
 @receiver(post_save, sender=Document)
 def generate_preview_image(sender, instance, created, **kwargs):
     """
     Signal handler to generate a preview image for the Document instance if it's a PDF and no preview_image is defined.
     """
+    if is_processing_deferred(instance):
+        return
     if not instance.preview_image and instance.is_pdf():
         instance.generate_pdf_preview()
         instance.save()
@@ -78,22 +227,47 @@ def generate_preview_image(sender, instance, created, **kwargs):
 @receiver(post_delete, sender=Document)
 def delete_document_file(sender, instance, **kwargs):
     if instance.document_file:
-        if default_storage.exists(instance.document_file.path):
-            default_storage.delete(instance.document_file.path)
+        # delete through the storage of the field: shared files are removed only with their last reference
+        instance.document_file.delete(save=False)
 
 
 @receiver(post_delete, sender=Video)
 def delete_video_file(sender, instance, **kwargs):
     if instance.video_file:
-        if default_storage.exists(instance.video_file.path):
-            default_storage.delete(instance.video_file.path)
+        instance.video_file.delete(save=False)
+    if instance.clip_file:
+        instance.clip_file.delete(save=False)
 
 
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Document)
+def delete_media_secondary_files(sender, instance, **kwargs):
+    if instance.preview_image:
+        instance.preview_image.delete(save=False)
+    if instance.raw_transcription_file:
+        instance.raw_transcription_file.delete(save=False)
+
+
+# pre_delete: the many-to-many rows are already gone in post_delete
+@receiver(pre_delete, sender=Video)
+@receiver(pre_delete, sender=Document)
 def delete_automatic_preview_images(sender, instance, **kwargs):
     for preview_image in instance.automatic_preview_images.all():
         preview_image.delete()
 
 
+@receiver(post_delete, sender=AutomaticPreviewImage)
+def delete_automatic_preview_image_file(sender, instance, **kwargs):
+    if instance.image:
+        instance.image.delete(save=False)
+
+
+@receiver(post_delete, sender=Image)
+def delete_image_file(sender, instance, **kwargs):
+    if instance.image_file:
+        instance.image_file.delete(save=False)
+
+
 def extract_frame(video_path, t):
     with VideoFileClip(video_path) as video:
         frame = video.get_frame(t)
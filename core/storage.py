@@ -0,0 +1,142 @@
+import os
+import re
+import shutil
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from core.tools.file_tools import compute_checksum, compute_file_checksum
+
+SHARDED_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[^/]*)?$')
+
+
+def sharded_name(sha256, filename):
+    """Returns the hash-sharded name of a file: ab/cd/<sha256>.<ext>"""
+    ext = os.path.splitext(filename)[1].lower()
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def is_sharded_name(name):
+    return bool(name) and SHARDED_NAME_RE.match(name) is not None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage which stores files under hash-sharded paths (ab/cd/<sha256>.<ext>).
+
+    Identical uploads share the same file: each stored file has a MediaBlob row counting the references to it,
+    and delete() removes the file only when the last reference goes away.
+    Files saved with other names (e.g. before the migration to this storage) are handled as plain files.
+
+    _save() only stores the file: the reference is counted when the instance pointing to it is saved and committed
+    (see update_reference and core.signals.update_media_blob_references), so a failed save leaves a blob with no
+    references, which the media GC collects.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # the name is decided by the content in _save
+        return name
+
+    def _save(self, name, content):
+        from core.models import MediaBlob
+
+        incoming_dir = self.path('.incoming')
+        os.makedirs(incoming_dir, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            # uploaded to a temporary file (or assembled by a chunked upload): hash it where it is and move it, as
+            # FileSystemStorage does; a rename when it is on the same file system
+            temp_path = content.temporary_file_path()
+            sha256 = compute_file_checksum(temp_path)
+        else:
+            fd, temp_path = tempfile.mkstemp(dir=incoming_dir)
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            with open(temp_path, 'rb') as f:
+                sha256 = compute_checksum(f)
+
+        blob_name = sharded_name(sha256, name)
+        blob_path = self.path(blob_name)
+        size = os.path.getsize(temp_path)
+
+        try:
+            with transaction.atomic():
+                MediaBlob.objects.get_or_create(name=blob_name, defaults={'sha256': sha256, 'size': size})
+        except IntegrityError:
+            # created by a concurrent upload of the same content
+            pass
+
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            file_move_safe(temp_path, blob_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(blob_path, self.file_permissions_mode)
+        else:
+            # the same content is already stored; it is referenced only after the commit: a new modification time
+            # keeps it out of the media GC meanwhile, as the grace period does for the new files
+            os.remove(temp_path)
+            os.utime(blob_path)
+
+        return blob_name
+
+    def delete(self, name):
+        from core.models import MediaBlob
+
+        if not is_sharded_name(name):
+            return super().delete(name)
+
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None:
+                if blob.ref_count > 1:
+                    # still referenced by other records
+                    MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                    return
+                blob.delete()
+
+        super().delete(name)
+
+    def update_reference(self, old_name, new_name):
+        """
+        Moves one reference from old_name to new_name, when a FileField value has been replaced.
+
+        Called after the commit of the save: the blob old_name is deleted with its last reference.
+        Names which are not hash-sharded (legacy files) are not counted and are left alone.
+        """
+        from core.models import MediaBlob
+
+        if is_sharded_name(new_name):
+            MediaBlob.objects.filter(name=new_name).update(ref_count=F('ref_count') + 1)
+        if is_sharded_name(old_name):
+            self.delete(old_name)
+
+    def adopt(self, name):
+        """
+        Links an existing (legacy) file into its hash-sharded path, without touching the database.
+
+        :param name: name of the existing file, relative to the storage location
+        :return: tuple (sharded name, sha256, size)
+        """
+        source_path = self.path(name)
+        sha256 = compute_file_checksum(source_path)
+        blob_name = sharded_name(sha256, name)
+        blob_path = self.path(blob_name)
+
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            temp_path = f"{blob_path}.{os.getpid()}.tmp"
+            try:
+                os.link(source_path, temp_path)
+            except OSError:
+                shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, blob_path)
+
+        return blob_name, sha256, os.path.getsize(blob_path)
+
+
+def is_content_addressed(storage):
+    return isinstance(storage, ContentAddressedStorage)
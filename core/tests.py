@@ -1,3 +1,167 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
 
-# Create your tests here.
+import pytest
+
+from core.models import ChunkedUpload, Document
+
+CAS_BACKEND = 'core.storage.ContentAddressedStorage'
+FILE_SYSTEM_BACKEND = 'django.core.files.storage.FileSystemStorage'
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def use_storage(settings, backend):
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': backend}}
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_upload(data, chunk_size):
+    from core.uploads import create_upload
+
+    document = Document.objects.create(title="Document")
+    upload = create_upload('report.txt', len(data), ChunkedUpload.TARGET_DOCUMENT, document.pk, chunk_size=chunk_size)
+    return upload, document
+
+
+@pytest.mark.django_db
+def test_chunk_sent_again_never_overwrites_the_received_one(media_root):
+    from core.uploads import write_chunk, get_partial_file_path, get_received_chunks, UploadError
+
+    data = b'0123456789'
+    upload, _ = make_upload(data, chunk_size=4)
+    write_chunk(upload, 0, io.BytesIO(data[:4]), 4)
+
+    # the same content is accepted again, with or without checksum
+    assert write_chunk(upload, 0, io.BytesIO(data[:4]), 4).index == 0
+    assert write_chunk(upload, 0, io.BytesIO(data[:4]), 4, expected_sha256=sha256(data[:4])).index == 0
+
+    # a different content is refused, with or without checksum
+    for expected_sha256 in (None, sha256(b'XXXX')):
+        with pytest.raises(UploadError) as e:
+            write_chunk(upload, 0, io.BytesIO(b'XXXX'), 4, expected_sha256=expected_sha256)
+        assert e.value.status == 409
+
+    # a new chunk with a wrong checksum or cut short is not written
+    with pytest.raises(UploadError) as e:
+        write_chunk(upload, 4, io.BytesIO(b'YYYY'), 4, expected_sha256=sha256(data[4:8]))
+    assert e.value.status == 460
+    with pytest.raises(UploadError):
+        write_chunk(upload, 4, io.BytesIO(b'YY'), 4)
+
+    assert get_received_chunks(upload) == [0]
+    with open(get_partial_file_path(upload), 'rb') as f:
+        assert f.read() == data[:4] + bytes(6)
+    assert os.listdir(media_root / '.uploads') == [f"{upload.upload_id}.part"]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('backend', [CAS_BACKEND, FILE_SYSTEM_BACKEND])
+def test_complete_upload_moves_the_file_and_defers_the_processing(settings, media_root, backend):
+    from core.uploads import write_chunk, complete_upload, process_upload, UploadError
+
+    use_storage(settings, backend)
+    data = b'0123456789'
+    upload, document = make_upload(data, chunk_size=4)
+    for offset in (8, 0, 4):
+        write_chunk(upload, offset, io.BytesIO(data[offset:offset + 4]), len(data[offset:offset + 4]))
+
+    retried = ChunkedUpload.objects.get(pk=upload.pk)
+    document = complete_upload(upload)
+    with document.document_file.open('rb') as f:
+        assert f.read() == data
+    # moved, not copied: nothing left in the partial uploads directory
+    assert os.listdir(media_root / '.uploads') == []
+
+    # a retry of the request, which read the upload before the completion
+    with pytest.raises(UploadError) as e:
+        complete_upload(retried)
+    assert e.value.status == 409
+
+    upload.refresh_from_db()
+    document.refresh_from_db()
+    assert upload.status == ChunkedUpload.STATUS_PROCESSING and not document.file_checksum
+
+    process_upload(upload)
+    upload.refresh_from_db()
+    document.refresh_from_db()
+    assert upload.status == ChunkedUpload.STATUS_COMPLETE and document.file_checksum == sha256(data)
+
+
+@pytest.mark.django_db
+def test_blob_references_follow_saves_replacements_and_deletions(settings, media_root,
+                                                                  django_capture_on_commit_callbacks):
+    from django.core.files.base import ContentFile
+    from django.db import transaction
+    from core.models import MediaBlob
+
+    use_storage(settings, CAS_BACKEND)
+
+    def ref_counts():
+        return dict(MediaBlob.objects.values_list('sha256', 'ref_count'))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        first = Document.objects.create(title="First", document_file=ContentFile(b'same', name='a.txt'))
+        second = Document.objects.create(title="Second", document_file=ContentFile(b'same', name='b.txt'))
+    shared_name = first.document_file.name
+    assert second.document_file.name == shared_name
+    assert ref_counts() == {sha256(b'same'): 2}
+
+    # a save rolled back does not count
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(RuntimeError), transaction.atomic():
+            second.document_file.save('c.txt', ContentFile(b'other'))
+            raise RuntimeError
+    second.refresh_from_db()
+    assert ref_counts() == {sha256(b'same'): 2}
+
+    # the replaced file loses a reference
+    with django_capture_on_commit_callbacks(execute=True):
+        second.document_file.save('c.txt', ContentFile(b'other'))
+    assert ref_counts() == {sha256(b'same'): 1, sha256(b'other'): 1}
+    assert os.path.exists(media_root / shared_name)
+
+    # the file is deleted with its last reference
+    with django_capture_on_commit_callbacks(execute=True):
+        first.delete()
+    assert ref_counts() == {sha256(b'other'): 1}
+    assert not os.path.exists(media_root / shared_name)
+
+
+@pytest.mark.django_db
+def test_orphaned_media_dry_run_finds_replaced_files_and_stale_uploads(media_root):
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+    from core.models import MediaBlob
+    from core.uploads import get_partial_file_path
+
+    document = Document.objects.create(title="Document", document_file=ContentFile(b'first', name='a.txt'))
+    replaced_name = document.document_file.name
+    document.document_file.save('b.txt', ContentFile(b'second'))
+
+    stale_upload, _ = make_upload(b'0123456789', chunk_size=4)
+    stale_partial_path = get_partial_file_path(stale_upload)
+    stale_upload.delete()
+    active_upload, _ = make_upload(b'0123456789', chunk_size=4)
+    (media_root / '.incoming').mkdir()
+    (media_root / '.incoming' / 'tmp1234').write_bytes(b'left over')
+    MediaBlob.objects.create(name=f"ab/cd/{'ab' * 32}.txt", sha256='ab' * 32, ref_count=2)
+
+    out = io.StringIO()
+    call_command('collect_orphaned_media', '--grace-days', '0', stdout=out)
+    output = out.getvalue()
+
+    assert f"orphan: {replaced_name}" in output
+    assert f"orphan: .uploads/{os.path.basename(stale_partial_path)}" in output
+    assert "orphan: .incoming/tmp1234" in output
+    assert f"ref_count mismatch: ab/cd/{'ab' * 32}.txt (ref_count 2, references 0)" in output
+    assert str(active_upload.upload_id) not in output and document.document_file.name not in output
+    assert os.path.exists(media_root / replaced_name) and os.path.exists(stale_partial_path)
@@ -0,0 +1,27 @@
+import hashlib
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_checksum(f, algorithm='sha256', chunk_size=CHECKSUM_CHUNK_SIZE):
+    """
+    Computes the checksum of a file object reading it in chunks, without loading the whole file into memory.
+
+    :param f: file object opened in binary mode (or a django File)
+    :param algorithm: name of the hashlib algorithm
+    :param chunk_size: size of the chunks read from the file
+    :return: hex digest of the file content
+    """
+    h = hashlib.new(algorithm)
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def compute_file_checksum(file_path, algorithm='sha256', chunk_size=CHECKSUM_CHUNK_SIZE):
+    """Computes the checksum of the file at file_path, see compute_checksum."""
+    with open(file_path, 'rb') as f:
+        return compute_checksum(f, algorithm, chunk_size)
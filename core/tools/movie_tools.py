@@ -1,6 +1,8 @@
 import re
 import datetime
+import subprocess
 
+from imageio_ffmpeg import get_ffmpeg_exe
 from moviepy import VideoFileClip
 
 
@@ -19,6 +21,45 @@ def get_video_resolution(video_path):
     return width, height
 
 
+def cut_video_clip(video_path, clip_path, start_time, stop_time):
+    """
+    Cut the [start_time, stop_time] range of a video file into clip_path.
+
+    The stream is copied without re-encoding whenever possible: seeking on the input snaps the start of the clip
+    to the previous keyframe, so the cut is fast even for long recordings. If stream copy fails (e.g. the container
+    does not support it), the clip is re-encoded.
+
+    :param video_path: path of the source video file
+    :param clip_path: path of the clip to be written (overwritten if it exists)
+    :param start_time: datetime.timedelta, start of the range
+    :param stop_time: datetime.timedelta, end of the range, or None to cut until the end of the video
+    """
+    ffmpeg = get_ffmpeg_exe()
+    start = f"{start_time.total_seconds():.3f}"
+    # without -t, ffmpeg reads until the end of the input
+    duration = ['-t', f"{(stop_time - start_time).total_seconds():.3f}"] if stop_time is not None else []
+
+    copy_command = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-ss', start, '-i', video_path, *duration,
+        '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart',
+        clip_path,
+    ]
+    result = subprocess.run(copy_command, capture_output=True, text=True)
+    if result.returncode == 0:
+        return
+
+    print(f"cut_video_clip - stream copy failed, re-encoding: {result.stderr.strip()}")
+
+    encode_command = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-ss', start, '-i', video_path, *duration,
+        '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac', '-movflags', '+faststart',
+        clip_path,
+    ]
+    subprocess.run(encode_command, capture_output=True, text=True, check=True)
+
+
 def extract_text_from_vtt(data: str) -> str:
     """
     Extracts the text from a VTT file, removing timestamps and UUIDs
@@ -0,0 +1,304 @@
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from core.models import ChunkedUpload, ChunkedUploadPart, Video, Document
+from mediamatrixhub.metrics import UPLOADS_IN_PROGRESS, register_collector
+
+# partial files are written under MEDIA_ROOT, so that completing an upload is a rename
+PARTIAL_UPLOADS_DIR = '.uploads'
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+TARGET_FIELDS = {
+    ChunkedUpload.TARGET_VIDEO: (Video, 'video_file'),
+    ChunkedUpload.TARGET_DOCUMENT: (Document, 'document_file'),
+}
+
+
+class UploadError(Exception):
+    """Raised when a chunk or an upload request is not valid; status is the HTTP status to be returned."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class PartialUploadFile(File):
+    """The assembled partial file: storages move it into place instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_partial_file_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, PARTIAL_UPLOADS_DIR, f"{upload.upload_id}.part")
+
+
+def get_target_instance(target_type, target_id):
+    try:
+        model, field_name = TARGET_FIELDS[target_type]
+    except KeyError:
+        raise UploadError(f"unknown target type: {target_type}")
+    try:
+        return model.objects.get(pk=target_id), field_name
+    except model.DoesNotExist:
+        raise UploadError(f"{target_type} {target_id} not found", status=404)
+
+
+def parse_checksum_header(value):
+    """
+    Parses a tus-style checksum header: "sha256 <base64 digest>".
+
+    :return: the hex digest, or None if the header is empty
+    """
+    if not value:
+        return None
+    try:
+        algorithm, encoded_digest = value.split(' ', 1)
+        digest = base64.b64decode(encoded_digest.strip(), validate=True)
+    except (ValueError, binascii.Error):
+        raise UploadError("malformed Upload-Checksum header")
+    if algorithm.lower() != 'sha256':
+        raise UploadError(f"unsupported checksum algorithm: {algorithm}")
+    return digest.hex()
+
+
+def create_upload(filename, total_size, target_type, target_id, username='', chunk_size=None):
+    """
+    Creates a new ChunkedUpload and preallocates its partial file.
+    """
+    get_target_instance(target_type, target_id)
+
+    if total_size <= 0:
+        raise UploadError("Upload-Length must be positive")
+
+    upload = ChunkedUpload.objects.create(
+        filename=os.path.basename(filename),
+        total_size=total_size,
+        chunk_size=chunk_size or getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', DEFAULT_CHUNK_SIZE),
+        target_type=target_type,
+        target_id=target_id,
+        username=username,
+    )
+
+    partial_path = get_partial_file_path(upload)
+    os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+    with open(partial_path, 'wb') as f:
+        f.truncate(total_size)
+
+    return upload
+
+
+def get_received_chunks(upload):
+    return sorted(upload.parts.values_list('index', flat=True))
+
+
+def get_upload_offset(upload, received_chunks=None):
+    """Returns the number of contiguous bytes received from the beginning of the file (tus Upload-Offset)."""
+    if received_chunks is None:
+        received_chunks = get_received_chunks(upload)
+    contiguous = 0
+    for index in received_chunks:
+        if index != contiguous:
+            break
+        contiguous += 1
+    return min(contiguous * upload.chunk_size, upload.total_size)
+
+
+def receive_chunk(upload, index, stream, content_length, read_size):
+    """
+    Reads a chunk from stream into a temporary file next to the partial file.
+
+    :return: (path of the temporary file, hex sha256 of the chunk)
+    """
+    fd, chunk_path = tempfile.mkstemp(dir=os.path.dirname(get_partial_file_path(upload)),
+                                      prefix=f"{upload.upload_id}.{index}.", suffix='.chunk')
+    h = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            remaining = content_length
+            while remaining > 0:
+                data = stream.read(min(read_size, remaining))
+                if not data:
+                    raise UploadError("connection closed before the end of the chunk")
+                h.update(data)
+                f.write(data)
+                remaining -= len(data)
+    except BaseException:
+        os.remove(chunk_path)
+        raise
+    return chunk_path, h.hexdigest()
+
+
+def copy_chunk(upload, chunk_path, offset, read_size):
+    """Copies a verified chunk into its place in the partial file."""
+    fd = os.open(get_partial_file_path(upload), os.O_WRONLY)
+    try:
+        with open(chunk_path, 'rb') as f:
+            position = offset
+            while data := f.read(read_size):
+                os.pwrite(fd, data, position)
+                position += len(data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def get_received_part(upload, index, sha256):
+    """The part already received with this index; UploadError if its content is different."""
+    part = ChunkedUploadPart.objects.get(upload=upload, index=index)
+    if part.sha256 != sha256:
+        raise UploadError(f"chunk {index} already received with a different content", status=409)
+    return part
+
+
+def write_chunk(upload, offset, stream, content_length, expected_sha256=None, read_size=1024 * 1024):
+    """
+    Writes one chunk read from stream at the given offset of the partial file.
+
+    Chunks may arrive in any order and in parallel. Each one is received into its own temporary file and copied
+    into the partial file only when it is complete, its checksum matches and its index has been claimed by creating
+    its ChunkedUploadPart: a chunk already received is never overwritten, and it is accepted again only if its
+    checksum is the same.
+
+    :param upload: ChunkedUpload instance
+    :param offset: offset of the chunk, must be a multiple of upload.chunk_size
+    :param stream: file-like object with the chunk content (the request)
+    :param content_length: length of the chunk
+    :param expected_sha256: hex digest the chunk must match, or None
+    :return: ChunkedUploadPart instance
+    """
+    if upload.status != ChunkedUpload.STATUS_UPLOADING:
+        raise UploadError("upload already completed", status=409)
+    if offset < 0 or offset % upload.chunk_size or offset >= upload.total_size:
+        raise UploadError("Upload-Offset is not the start of a chunk", status=409)
+
+    index = offset // upload.chunk_size
+    if content_length != upload.chunk_length(index):
+        raise UploadError(f"chunk {index} must be {upload.chunk_length(index)} bytes long")
+
+    if expected_sha256 is not None and upload.parts.filter(index=index).exists():
+        # a retry of a chunk already received: answered without reading it
+        return get_received_part(upload, index, expected_sha256)
+
+    chunk_path, sha256 = receive_chunk(upload, index, stream, content_length, read_size)
+    try:
+        if expected_sha256 is not None and sha256 != expected_sha256:
+            raise UploadError(f"checksum mismatch for chunk {index}", status=460)
+
+        try:
+            # the part is visible, and complete_upload can see the chunk, only after the copy; a concurrent
+            # request with the same index waits for the commit and gets the IntegrityError
+            with transaction.atomic():
+                part = ChunkedUploadPart.objects.create(upload=upload, index=index, size=content_length,
+                                                        sha256=sha256)
+                copy_chunk(upload, chunk_path, offset, read_size)
+        except IntegrityError:
+            # received before: the partial file already has it
+            return get_received_part(upload, index, sha256)
+        return part
+    finally:
+        os.remove(chunk_path)
+
+
+def complete_upload(upload):
+    """
+    Moves the assembled file into the storage and attaches it to the target Video or Document.
+
+    The post-upload processing of the target (duration, clips, checksum, previews...), which can take minutes for a
+    large video, is not run in the request: the upload is left in STATUS_PROCESSING and processed by a background
+    thread after the commit (see process_upload), or by the process_uploads command if the thread did not finish.
+
+    :return: the target instance
+    """
+    if upload.status != ChunkedUpload.STATUS_UPLOADING:
+        raise UploadError("upload already completed", status=409)
+
+    received_chunks = get_received_chunks(upload)
+    if len(received_chunks) != upload.number_of_chunks:
+        missing = sorted(set(range(upload.number_of_chunks)) - set(received_chunks))
+        raise UploadError(f"missing chunks: {missing[:20]}", status=409)
+
+    instance, field_name = get_target_instance(upload.target_type, upload.target_id)
+    field_file = getattr(instance, field_name)
+    partial_path = get_partial_file_path(upload)
+
+    with transaction.atomic():
+        # claim the upload: a concurrent request (e.g. a retry of the client) waits for the commit and gets a 409
+        upload.completed_at = timezone.now()
+        claimed = ChunkedUpload.objects.filter(pk=upload.pk, status=ChunkedUpload.STATUS_UPLOADING).update(
+            status=ChunkedUpload.STATUS_PROCESSING, completed_at=upload.completed_at, updated_at=upload.completed_at)
+        if not claimed:
+            raise UploadError("upload already completed", status=409)
+        upload.status = ChunkedUpload.STATUS_PROCESSING
+
+        with open(partial_path, 'rb') as f:
+            # the storage moves the partial file into place
+            field_file.save(upload.filename, PartialUploadFile(f, name=upload.filename), save=False)
+
+        instance.defer_media_processing = True
+        instance.save()
+        upload.parts.all().delete()
+
+    try:
+        os.remove(partial_path)
+    except FileNotFoundError:
+        pass
+
+    upload_pk = upload.pk
+    transaction.on_commit(lambda: start_processing_thread(upload_pk))
+    return instance
+
+
+def process_upload(upload):
+    """
+    Runs the post-upload processing of the target of a completed upload, deferred by complete_upload.
+
+    The processing is done by the post_save signal handlers of the target; they are idempotent, so an upload
+    processed twice (by the thread and by the command) does no harm.
+    """
+    instance, field_name = get_target_instance(upload.target_type, upload.target_id)
+    instance.save(update_fields=[field_name])
+    upload.status = ChunkedUpload.STATUS_COMPLETE
+    upload.save(update_fields=['status', 'updated_at'])
+
+
+def process_upload_in_background(upload_pk):
+    close_old_connections()
+    try:
+        upload = ChunkedUpload.objects.filter(pk=upload_pk, status=ChunkedUpload.STATUS_PROCESSING).first()
+        if upload is not None:
+            process_upload(upload)
+    except Exception as e:
+        # left in STATUS_PROCESSING: the process_uploads command tries again
+        print(f"Error processing upload #{upload_pk}: {e}")
+    finally:
+        close_old_connections()
+
+
+def start_processing_thread(upload_pk):
+    threading.Thread(target=process_upload_in_background, args=(upload_pk,), daemon=True,
+                     name=f"process-upload-{upload_pk}").start()
+
+
+def delete_upload(upload):
+    """Deletes an upload and its partial file."""
+    try:
+        os.remove(get_partial_file_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+@register_collector
+def collect_upload_metrics():
+    return [(UPLOADS_IN_PROGRESS, {}, ChunkedUpload.objects.filter(status=ChunkedUpload.STATUS_UPLOADING).count())]
@@ -2,7 +2,7 @@ from django.urls import path
 from django.conf.urls.static import static
 
 from core.views import ShowHomeWithCategory, SearchHomeWithCategory, get_preview_image, proxy_django_auth, \
-    video_player_event, ShowCategories
+    video_player_event, ShowCategories, chunked_upload_create, chunked_upload, chunked_upload_complete
 
 urlpatterns = [
     path('c/', ShowCategories.as_view(), name='show-categories'),
@@ -12,4 +12,8 @@ urlpatterns = [
     path('get_preview_image/<str:ref_token>/', get_preview_image, name='get_preview_image'),
     path('proxy_django_auth/', proxy_django_auth, name='proxy_django_auth'),
     path('video_player_event/', video_player_event, name='video_player_event'),
+
+    path('uploads/', chunked_upload_create, name='chunked_upload_create'),
+    path('uploads/<uuid:upload_id>/', chunked_upload, name='chunked_upload'),
+    path('uploads/<uuid:upload_id>/complete/', chunked_upload_complete, name='chunked_upload_complete'),
 ]
@@ -9,12 +9,17 @@ import io
 from django.http import HttpResponse
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_http_methods
+from django.urls import reverse
 from PIL import Image, ImageDraw, ImageFont
 
-from core.models import Category, Media, Video, VideoPlaybackEvent, VideoCounter, get_category_documents
+from core.models import Category, Media, Video, VideoPlaybackEvent, VideoCounter, get_category_documents, \
+    ChunkedUpload
+from core.uploads import create_upload, write_chunk, complete_upload, delete_upload, get_received_chunks, \
+    get_upload_offset, parse_checksum_header, UploadError
 from core.tools.stat_tools import process_http_request
 from mediamatrixhub import settings
+from mediamatrixhub.metrics import VIDEO_PLAYBACK_EVENTS, PREVIEW_IMAGES, UPLOAD_BYTES, UPLOADS_COMPLETED
 from mediamatrixhub.settings import DEBUG, APPLICATION_TITLE, TECHNICAL_CONTACT_EMAIL, TECHNICAL_CONTACT
 
 from mediamatrixhub.view_tools import is_private_ip
@@ -138,6 +143,7 @@ def get_preview_image(request, ref_token):
         buffer = io.BytesIO()
         image.save(buffer, format='PNG')
         buffer.seek(0)
+        PREVIEW_IMAGES.inc()
 
         # Serve the image
         return HttpResponse(buffer, content_type='image/png')
@@ -167,6 +173,7 @@ def video_player_event(request):
 
     video_counter = VideoCounter.check_create_counter(video.id)
     video_counter.inc_playback_event_counter()
+    VIDEO_PLAYBACK_EVENTS.inc()
 
     # Process the video URL as needed
     return JsonResponse({'status': 'success', 'message': 'ref_token received'})
@@ -176,3 +183,98 @@ def category_hierarchy_view(request):
     category_html_table = Category.get_categories_hierarchy_html()   #objects.first().get_html_table()  # Assuming there is at least one category
     return render(request, 'core/admin/category_hierarchy.html', {'category_html_table': category_html_table})
 
+
+
+def chunked_upload_response(upload, status=200):
+    received_chunks = get_received_chunks(upload)
+    response = JsonResponse({
+        'upload_id': str(upload.upload_id),
+        'status': upload.status,
+        'chunk_size': upload.chunk_size,
+        'total_size': upload.total_size,
+        'received_chunks': received_chunks,
+    }, status=status)
+    response['Upload-Offset'] = str(get_upload_offset(upload, received_chunks))
+    response['Upload-Length'] = str(upload.total_size)
+    response['Location'] = reverse('chunked_upload', args=[upload.upload_id])
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@require_POST
+def chunked_upload_create(request):
+    """
+    Creates a resumable upload for the file of a Video or Document (staff only).
+
+    Headers: Upload-Length (total size of the file).
+    POST parameters: filename, target_type ('video' or 'document'), target_id.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    try:
+        upload = create_upload(
+            request.POST.get('filename', ''),
+            int(request.headers.get('Upload-Length', '0')),
+            request.POST.get('target_type'),
+            int(request.POST.get('target_id', '0')),
+            username=request.user.username,
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Upload-Length and target_id must be integers'}, status=400)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+
+    return chunked_upload_response(upload, status=201)
+
+
+@require_http_methods(['HEAD', 'GET', 'PATCH', 'DELETE'])
+def chunked_upload(request, upload_id):
+    """
+    HEAD/GET: returns the state of the upload (Upload-Offset and the list of received chunks).
+    PATCH: receives the chunk starting at Upload-Offset, verified against the optional Upload-Checksum header
+    ("sha256 <base64 digest>"). Chunks can be sent in parallel and in any order.
+    DELETE: cancels the upload.
+    """
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+
+    if request.method == 'PATCH':
+        try:
+            content_length = int(request.headers.get('Content-Length', '0'))
+            write_chunk(
+                upload,
+                int(request.headers.get('Upload-Offset', '-1')),
+                request,
+                content_length,
+                expected_sha256=parse_checksum_header(request.headers.get('Upload-Checksum')),
+            )
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset must be an integer'}, status=400)
+        except UploadError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        UPLOAD_BYTES.inc(content_length)
+    elif request.method == 'DELETE':
+        delete_upload(upload)
+        return HttpResponse(status=204)
+
+    return chunked_upload_response(upload)
+
+
+@require_POST
+def chunked_upload_complete(request, upload_id):
+    """Assembles the uploaded file into the storage and attaches it to the target Video or Document."""
+    if not request.user.is_authenticated or not request.user.is_staff:
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id)
+
+    try:
+        instance = complete_upload(upload)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    UPLOADS_COMPLETED.inc()
+
+    return JsonResponse({'status': 'success', 'upload_id': str(upload.upload_id), 'target_id': instance.pk})
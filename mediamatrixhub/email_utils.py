@@ -1,10 +1,17 @@
 # Import smtplib for the actual sending function
+import atexit
 import mimetypes
 import os
 import smtplib
-from email.message import EmailMessage
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage, MIMEPart
+from email.policy import default
 
-from mediamatrixhub.settings import DEBUG, FROM_EMAIL, EMAIL_HOST, DEBUG_EMAIL
+from mediamatrixhub.metrics import EMAILS_SENT, EMAIL_SEND_DURATION, SMTP_CONNECTIONS_OPENED
+from mediamatrixhub.settings import DEBUG, FROM_EMAIL, EMAIL_HOST, DEBUG_EMAIL, EMAIL_POOL_MAX_CONNECTIONS, \
+    EMAIL_MAX_MESSAGES_PER_CONNECTION, EMAIL_CONNECTION_IDLE_TIMEOUT
 
 
 class MyTemporaryFile:
@@ -31,10 +38,271 @@ class MyTemporaryFile:
         return self.content
 
 
+def make_attachment_part(attachment):
+    """
+    Build the MIME part of an attachment.
+
+    The part is not modified when a message is sent, so the same part can be attached to many messages.
+
+    Parameters:
+        attachment: file path or MyTemporaryFile instance.
+
+    Returns:
+        MIMEPart: the attachment part.
+    """
+    if isinstance(attachment, MyTemporaryFile):
+        filename = attachment.get_file_name()
+        data = attachment.get_content().encode()
+        ctype, _ = mimetypes.guess_type(filename)
+    else:
+        filename = os.path.basename(attachment)
+        ctype, _ = mimetypes.guess_type(attachment)
+        with open(attachment, 'rb') as f:
+            data = f.read()
+
+    if ctype is None:
+        ctype = 'application/octet-stream'
+    maintype, subtype = ctype.split('/', 1)
+    part = MIMEPart(policy=default)
+    part.set_content(data, maintype=maintype, subtype=subtype, disposition='attachment', filename=filename)
+    return part
+
+
+class EmailMessageBuilder:
+    """
+    Build messages which share the sender, the subject and the attachments.
+
+    The parsed headers, the plain text part and the attachment parts are built once and shared by all the
+    messages: only the recipients and the HTML part are built for each message.
+
+    Args:
+        from_email (str): Sender email address.
+        subject (str): Email subject.
+        attachments (list, optional): List of attachments (file paths or MyTemporaryFile instances).
+        attachment_parts (list, optional): Parts built with make_attachment_part, used instead of attachments.
+
+    Methods:
+        build: Build the message for some recipients.
+    """
+
+    def __init__(self, from_email, subject, attachments=None, attachment_parts=None):
+        self.from_header = default.header_factory('From', from_email)
+        self.subject_header = default.header_factory('Subject', subject)
+
+        self.text_part = MIMEPart(policy=default)
+        self.text_part.set_content("This is a fallback plain text message.")
+
+        if attachment_parts is None:
+            attachment_parts = [make_attachment_part(attachment) for attachment in attachments or []]
+        self.attachment_parts = attachment_parts
+
+    def build(self, to_addresses, body, cc_addresses=None):
+        """
+        Build the message with HTML body for the recipients.
+
+        Parameters:
+            to_addresses (list): List of recipient email addresses.
+            body (str): HTML body of the email.
+            cc_addresses (list, optional): List of CC email addresses.
+
+        Returns:
+            EmailMessage: the message, ready to be sent.
+        """
+        html_part = MIMEPart(policy=default)
+        html_part.set_content(body, subtype='html')
+
+        alternative = MIMEPart(policy=default) if self.attachment_parts else EmailMessage()
+        alternative['Content-Type'] = 'multipart/alternative'
+        alternative.attach(self.text_part)
+        alternative.attach(html_part)
+
+        if self.attachment_parts:
+            msg = EmailMessage()
+            msg['Content-Type'] = 'multipart/mixed'
+            msg.attach(alternative)
+            for part in self.attachment_parts:
+                msg.attach(part)
+        else:
+            msg = alternative
+
+        msg['Subject'] = self.subject_header
+        msg['From'] = self.from_header
+        msg['To'] = ', '.join(to_addresses)
+        if cc_addresses:
+            msg['Cc'] = ', '.join(cc_addresses)
+        msg['MIME-Version'] = '1.0'
+        return msg
+
+
+def build_email_message(from_email, to_addresses, subject, body, cc_addresses=None, attachments=None,
+                        attachment_parts=None):
+    """
+    Build an email message with HTML body and optional attachments.
+
+    Use EmailMessageBuilder to build many messages with the same sender, subject and attachments.
+
+    Parameters:
+        from_email (str): Sender email address.
+        to_addresses (list): List of recipient email addresses.
+        subject (str): Email subject.
+        body (str): HTML body of the email.
+        cc_addresses (list, optional): List of CC email addresses.
+        attachments (list, optional): List of attachments (file paths or MyTemporaryFile instances).
+        attachment_parts (list, optional): Parts built with make_attachment_part, used instead of attachments.
+
+    Returns:
+        EmailMessage: the message, ready to be sent.
+    """
+    return EmailMessageBuilder(from_email, subject, attachments, attachment_parts).build(to_addresses, body,
+                                                                                        cc_addresses)
+
+
+# errors after which the connection is discarded and the message is sent again on a new one
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+class SMTPConnectionPool:
+    """
+    A pool of persistent SMTP connections to a host.
+
+    A connection is reused for up to max_messages messages (then it is closed with QUIT and a new one is
+    opened), and it is discarded when it has been idle for more than idle_timeout seconds, because the server
+    may have closed it meanwhile. If the server drops a connection while sending, the message is sent again
+    on a new connection.
+
+    Args:
+        email_host (str): SMTP server host, optionally as 'host:port'.
+        max_connections (int): Maximum number of idle connections kept open.
+        max_messages (int): Maximum number of messages sent on a connection.
+        idle_timeout (float): Seconds after which an idle connection is not reused.
+        timeout (float): Socket timeout of the connections.
+    """
+
+    def __init__(self, email_host, max_connections=4, max_messages=100, idle_timeout=30, timeout=60):
+        self.email_host = email_host
+        self.max_connections = max_connections
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        # idle connections: (smtp, number of messages sent, last use)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+
+    def connect(self):
+        smtp = smtplib.SMTP(self.email_host, timeout=self.timeout)
+        smtp.ehlo_or_helo_if_needed()
+        self.connections_opened += 1
+        SMTP_CONNECTIONS_OPENED.inc()
+        return smtp
+
+    def acquire(self):
+        """Returns an idle connection which can still be used, or a new one, as (smtp, messages sent)."""
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                smtp, sent, last_use = self.idle.pop()
+            if now - last_use <= self.idle_timeout:
+                return smtp, sent
+            self.discard(smtp)
+        return self.connect(), 0
+
+    def release(self, smtp, sent):
+        """Gives back a healthy connection, closing it when it has reached max_messages or the pool is full."""
+        if sent < self.max_messages:
+            with self.lock:
+                if len(self.idle) < self.max_connections:
+                    self.idle.append((smtp, sent, time.monotonic()))
+                    return
+        self.discard(smtp)
+
+    @staticmethod
+    def discard(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def send_message(self, msg, from_addr, to_addrs):
+        """Sends msg on a pooled connection, retrying once on a new connection if the server has dropped it."""
+        start = time.perf_counter()
+        try:
+            self.send_message_with_retry(msg, from_addr, to_addrs)
+        except BaseException:
+            EMAILS_SENT.inc(result='failed')
+            raise
+        EMAILS_SENT.inc(result='sent')
+        EMAIL_SEND_DURATION.observe(time.perf_counter() - start)
+
+    def send_message_with_retry(self, msg, from_addr, to_addrs):
+        for attempt in range(2):
+            smtp, sent = self.acquire()
+            try:
+                smtp.send_message(msg, from_addr=from_addr, to_addrs=to_addrs)
+            except RECONNECT_ERRORS:
+                smtp.close()
+                if attempt:
+                    raise
+                continue
+            except smtplib.SMTPException:
+                # refused recipients or message: the connection is still usable after a RSET
+                try:
+                    smtp.rset()
+                    self.release(smtp, sent + 1)
+                except (smtplib.SMTPException, OSError):
+                    smtp.close()
+                raise
+            except BaseException:
+                smtp.close()
+                raise
+            self.release(smtp, sent + 1)
+            return
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for smtp, _, _ in idle:
+            self.discard(smtp)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(email_host=None):
+    """Returns the connection pool of email_host (EMAIL_HOST by default), shared by the whole process."""
+    if email_host is None:
+        email_host = EMAIL_HOST
+    with _pools_lock:
+        pool = _pools.get(email_host)
+        if pool is None:
+            pool = _pools[email_host] = SMTPConnectionPool(
+                email_host,
+                max_connections=EMAIL_POOL_MAX_CONNECTIONS,
+                max_messages=EMAIL_MAX_MESSAGES_PER_CONNECTION,
+                idle_timeout=EMAIL_CONNECTION_IDLE_TIMEOUT,
+            )
+        return pool
+
+
+@atexit.register
+def close_smtp_pools():
+    """Closes the pooled connections with QUIT; called at exit."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
 def my_send_email(from_email, to_addresses, subject, body, cc_addresses=None, bcc_addresses=None, attachments=None, email_host=None):
     """
     Send an email with HTML body and optional attachments.
 
+    The message is sent on a pooled connection (see get_smtp_pool), reused by the following messages.
+
     Parameters:
         subject (str): Email subject.
         body (str): HTML body of the email.
@@ -50,41 +318,48 @@ def my_send_email(from_email, to_addresses, subject, body, cc_addresses=None, bc
         cc_addresses = []
     if bcc_addresses is None:
         bcc_addresses = []
-    if attachments is None:
-        attachments = []
-
-    # Create email message
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = from_email
-    msg['To'] = ', '.join(to_addresses)
-    if cc_addresses:
-        msg['Cc'] = ', '.join(cc_addresses)
-
-    # Attach body
-    msg.set_content("This is a fallback plain text message.")
-    msg.add_alternative(body, subtype='html')
-
-    # Attach files
-    for attachment in attachments:
-        if isinstance(attachment, MyTemporaryFile):
-            filename = attachment.get_file_name()
-            data = attachment.get_content().encode()
-            ctype, _ = mimetypes.guess_type(filename)
-        else:
-            filename = os.path.basename(attachment)
-            ctype, _ = mimetypes.guess_type(attachment)
-            with open(attachment, 'rb') as f:
-                data = f.read()
 
-        if ctype is None:
-            ctype = 'application/octet-stream'
-        maintype, subtype = ctype.split('/', 1)
-        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    msg = build_email_message(from_email, to_addresses, subject, body, cc_addresses, attachments)
 
     # Send email
-    with smtplib.SMTP(email_host) as s:
-        s.send_message(msg, from_addr=from_email, to_addrs=to_addresses + cc_addresses + bcc_addresses)
+    get_smtp_pool(email_host).send_message(msg, from_addr=from_email,
+                                           to_addrs=to_addresses + cc_addresses + bcc_addresses)
+
+
+def send_many(messages, email_host=None, workers=1, pool=None):
+    """
+    Send a batch of emails on pooled connections.
+
+    Parameters:
+        messages (iterable): dicts with the keyword arguments of my_send_email (email_host excluded).
+        email_host (str, optional): SMTP server host.
+        workers (int, optional): Number of connections used concurrently.
+        pool (SMTPConnectionPool, optional): Pool to use instead of the one of email_host.
+
+    Returns:
+        list: one item for each message, None if it has been sent or the exception raised while sending it.
+    """
+    if pool is None:
+        pool = get_smtp_pool(email_host)
+
+    def send(message):
+        to_addresses = list(message['to_addresses'])
+        cc_addresses = list(message.get('cc_addresses') or [])
+        bcc_addresses = list(message.get('bcc_addresses') or [])
+        try:
+            msg = build_email_message(message['from_email'], to_addresses, message['subject'], message['body'],
+                                      cc_addresses, message.get('attachments'))
+            pool.send_message(msg, from_addr=message['from_email'],
+                              to_addrs=to_addresses + cc_addresses + bcc_addresses)
+        except Exception as e:
+            return e
+        return None
+
+    if workers <= 1:
+        return [send(message) for message in messages]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(send, messages))
+
 
 # Example usage:
 # send_email(
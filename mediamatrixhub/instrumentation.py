@@ -0,0 +1,295 @@
+"""
+Per-request instrumentation: wall time, SQL queries, template rendering and cache hits of every request.
+
+InstrumentationMiddleware keeps, in the memory of each process:
+- aggregates by view (requests, time, queries, query time, template time, cache hits and misses);
+- a log of the slow requests (over INSTRUMENTATION_SLOW_REQUEST_MS), sampled with INSTRUMENTATION_SLOW_LOG_SAMPLE_RATE,
+  with their slowest SQL queries and, for the requests profiled (INSTRUMENTATION_PROFILE_SAMPLE_RATE), the cProfile
+  statistics, also dumped to INSTRUMENTATION_PROFILE_DIR if set.
+
+The aggregates and the slow log are served as JSON to the staff by instrumentation_view.
+
+The per-request cost is about ten microseconds plus one per query; the profiler, expensive, runs only on the sampled
+requests.
+"""
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from django.template.backends.django import Template as BackendTemplate
+from django.utils import timezone
+
+from mediamatrixhub.metrics import HTTP_REQUEST_DURATION
+
+# SQL statements kept for each request, for the slow log
+MAX_CAPTURED_QUERIES = 200
+# SQL statements and profiler lines shown for each slow request
+SLOW_LOG_QUERIES = 20
+SLOW_LOG_PROFILE_LINES = 30
+SQL_MAX_LENGTH = 1000
+
+_current = contextvars.ContextVar('instrumentation_request', default=None)
+_lock = threading.Lock()
+_started_at = timezone.now()
+# view name -> ViewStats
+_stats = {}
+_slow_requests = deque(maxlen=100)
+
+
+class RequestMetrics:
+    __slots__ = ('query_count', 'query_time', 'queries', 'template_time', 'template_depth', 'cache_hits',
+                 'cache_misses')
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.queries = []
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class ViewStats:
+    FIELDS = ('requests', 'errors', 'time', 'max_time', 'queries', 'query_time', 'template_time', 'cache_hits',
+              'cache_misses', 'slow_requests')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, duration, metrics, status_code, slow):
+        self.requests += 1
+        self.errors += status_code >= 500
+        self.time += duration
+        self.max_time = max(self.max_time, duration)
+        self.queries += metrics.query_count
+        self.query_time += metrics.query_time
+        self.template_time += metrics.template_time
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+        self.slow_requests += slow
+
+    def to_json(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'slow_requests': self.slow_requests,
+            'avg_ms': round(self.time / requests * 1000, 2),
+            'max_ms': round(self.max_time * 1000, 2),
+            'avg_queries': round(self.queries / requests, 2),
+            'avg_query_ms': round(self.query_time / requests * 1000, 2),
+            'avg_template_ms': round(self.template_time / requests * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper of the database connections: times the query."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        query_time = time.perf_counter() - start
+        metrics.query_count += 1
+        metrics.query_time += query_time
+        if len(metrics.queries) < MAX_CAPTURED_QUERIES:
+            metrics.queries.append((query_time, sql))
+
+
+def install_template_timer():
+    """Times the rendering of the templates (only the outermost render of nested ones)."""
+    if getattr(BackendTemplate.render, 'instrumented', False):
+        return
+    render = BackendTemplate.render
+
+    def timed_render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, context, request)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+    timed_render.instrumented = True
+    BackendTemplate.render = timed_render
+
+
+def install_cache_counters():
+    """Counts the hits and misses of get() and get_many() of the configured cache backends."""
+    missing = object()
+    for backend_class in {type(caches[alias]) for alias in settings.CACHES}:
+        if getattr(backend_class.get, 'instrumented', False):
+            continue
+        get, get_many = backend_class.get, backend_class.get_many
+
+        def counted_get(self, key, default=None, version=None, get=get):
+            metrics = _current.get()
+            if metrics is None:
+                return get(self, key, default, version)
+            value = get(self, key, missing, version)
+            if value is missing:
+                metrics.cache_misses += 1
+                return default
+            metrics.cache_hits += 1
+            return value
+
+        def counted_get_many(self, keys, version=None, get_many=get_many):
+            metrics = _current.get()
+            if metrics is None:
+                return get_many(self, keys, version)
+            keys = list(keys)
+            values = get_many(self, keys, version)
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+            return values
+
+        counted_get.instrumented = True
+        backend_class.get = counted_get
+        # the get_many() of BaseCache (e.g. of LocMemCache) calls get(), which counts the keys already
+        if get_many is not BaseCache.get_many:
+            backend_class.get_many = counted_get_many
+
+
+def get_profile_text(profiler):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(SLOW_LOG_PROFILE_LINES)
+    return output.getvalue()
+
+
+class InstrumentationMiddleware:
+    """
+    Records the metrics of every request; to be the first of MIDDLEWARE, so that the time includes the other ones.
+
+    Disabled by INSTRUMENTATION_ENABLED = False.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request_time = settings.INSTRUMENTATION_SLOW_REQUEST_MS / 1000
+        self.slow_log_sample_rate = settings.INSTRUMENTATION_SLOW_LOG_SAMPLE_RATE
+        self.profile_sample_rate = settings.INSTRUMENTATION_PROFILE_SAMPLE_RATE
+        self.profile_dir = settings.INSTRUMENTATION_PROFILE_DIR
+        install_template_timer()
+        install_cache_counters()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        # what connection.execute_wrapper() does, without the cost of a context manager at every request
+        wrapped = connections.all()
+        for connection in wrapped:
+            connection.execute_wrappers.append(record_query)
+        profiler = None
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if profiler is None:
+                response = self.get_response(request)
+            else:
+                response = profiler.runcall(self.get_response, request)
+        finally:
+            for connection in wrapped:
+                connection.execute_wrappers.remove(record_query)
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        slow = duration >= self.slow_request_time
+        match = request.resolver_match
+        view_name = (match.view_name or match._func_path) if match is not None else 'unresolved'
+        with _lock:
+            stats = _stats.get(view_name)
+            if stats is None:
+                stats = _stats[view_name] = ViewStats()
+            stats.add(duration, metrics, response.status_code, slow)
+        HTTP_REQUEST_DURATION.observe(duration, view=view_name)
+
+        if slow and random.random() < self.slow_log_sample_rate:
+            self.log_slow_request(request, response, view_name, duration, metrics, profiler)
+        return response
+
+    def log_slow_request(self, request, response, view_name, duration, metrics, profiler):
+        slowest_queries = sorted(metrics.queries, key=lambda query: query[0], reverse=True)[:SLOW_LOG_QUERIES]
+        entry = {
+            'at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'ms': round(duration * 1000, 2),
+            'queries': metrics.query_count,
+            'query_ms': round(metrics.query_time * 1000, 2),
+            'template_ms': round(metrics.template_time * 1000, 2),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'slowest_queries': [{'ms': round(query_time * 1000, 3), 'sql': sql[:SQL_MAX_LENGTH]}
+                                for query_time, sql in slowest_queries],
+            'profile': None,
+        }
+        if profiler is not None:
+            entry['profile'] = get_profile_text(profiler)
+            if self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{view_name.replace(':', '_')}.prof"
+                profiler.dump_stats(os.path.join(self.profile_dir, file_name))
+                entry['profile_file'] = file_name
+        with _lock:
+            _slow_requests.append(entry)
+
+
+def get_instrumentation_data():
+    with _lock:
+        views = {view_name: stats.to_json() for view_name, stats in sorted(_stats.items())}
+        slow_requests = list(reversed(_slow_requests))
+    return {
+        'pid': os.getpid(),
+        'since': _started_at.isoformat(),
+        'views': views,
+        'slow_requests': slow_requests,
+    }
+
+
+def reset_instrumentation_data():
+    global _started_at
+    with _lock:
+        _stats.clear()
+        _slow_requests.clear()
+        _started_at = timezone.now()
+
+
+@staff_member_required
+def instrumentation_view(request):
+    """
+    The aggregates and the slow requests of the process serving the request, as JSON (?reset=1 empties them after
+    the response is built).
+    """
+    data = get_instrumentation_data()
+    if request.GET.get('reset'):
+        reset_instrumentation_data()
+    return JsonResponse(data)
@@ -0,0 +1,394 @@
+"""
+Operational metrics (counters, gauges and histograms), exposed in the Prometheus text format by metrics_view.
+
+The metrics are defined in this module and updated by the application code, e.g.:
+
+    from mediamatrixhub.metrics import VIDEO_PLAYBACK_EVENTS
+    VIDEO_PLAYBACK_EVENTS.inc()
+
+Every process (e.g. each gunicorn worker) keeps its values in memory and, when METRICS_DIR is set, writes them to
+METRICS_DIR/metrics-<pid>.json at most every METRICS_FLUSH_INTERVAL seconds and at exit. The scrape adds up the files
+of all the processes; the counters and histograms of the processes which have exited are moved to the archive file,
+so that the totals do not go back, while their gauges are dropped. Without METRICS_DIR only the process serving the
+scrape is seen.
+
+Some gauges (e.g. the length of the email outbox) are not updated by the code but read from the database at every
+scrape by the functions registered with register_collector.
+"""
+import atexit
+import fcntl
+import glob
+import ipaddress
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = '.lock'
+
+# seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+# name -> metric, in the order of definition
+_metrics = {}
+# functions returning the samples of the gauges read at scrape time
+_collectors = []
+_lock = threading.RLock()
+_last_flush = time.monotonic()
+
+
+class Metric:
+    """A metric family: one value for each combination of the values of the labels."""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # tuple of label values -> value
+        self.values = {}
+        _metrics[name] = self
+
+    def get_key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def empty_value(self):
+        return 0
+
+    def merge_values(self, value, other):
+        return value + other
+
+    def samples(self, values):
+        """(suffix, labels, value) of the exposition of values."""
+        for key, value in sorted(values.items()):
+            yield '', dict(zip(self.labelnames, key)), value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        maybe_flush()
+
+
+class Gauge(Metric):
+    """A gauge of the process; the values of the processes are added up."""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.get_key(labels)
+        with _lock:
+            self.values[key] = value
+        maybe_flush()
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        maybe_flush()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    Observations counted in fixed buckets; the value is the list of the counts of each bucket (the last one is +Inf)
+    followed by the sum of the observations.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def empty_value(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def merge_values(self, value, other):
+        if len(other) != len(value):
+            # written with other buckets: not comparable
+            return value
+        return [a + b for a, b in zip(value, other)]
+
+    def observe(self, amount, **labels):
+        key = self.get_key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if amount <= bound), len(self.buckets))
+        with _lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = self.empty_value()
+            value[index] += 1
+            value[-1] += amount
+        maybe_flush()
+
+    def time(self, **labels):
+        """Context manager observing the seconds spent in its block."""
+        return _Timer(self, labels)
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), value):
+                cumulative += count
+                yield '_bucket', {**labels, 'le': format_value(bound)}, cumulative
+            yield '_sum', labels, value[-1]
+            yield '_count', labels, cumulative
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def register_collector(function):
+    """
+    Registers a function called at every scrape, returning (gauge, labels, value) tuples; usable as a decorator.
+    The values are those of the moment (e.g. read from the database), not added up across the processes.
+    """
+    _collectors.append(function)
+    return function
+
+
+# Process-wide values
+
+def get_snapshot():
+    """The values of this process: {name: {json list of the label values: value}}."""
+    with _lock:
+        return {metric.name: {json.dumps(key): value for key, value in metric.values.items()}
+                for metric in _metrics.values() if metric.values}
+
+
+def write_json(path, data):
+    """Writes data atomically: the readers see the old file or the new one."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def get_process_file(pid=None):
+    return os.path.join(settings.METRICS_DIR, f"metrics-{pid or os.getpid()}.json")
+
+
+def flush():
+    """Writes the values of this process to METRICS_DIR."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not settings.METRICS_DIR:
+        return
+    try:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_json(get_process_file(), get_snapshot())
+    except OSError:
+        # the metrics must never break the application
+        pass
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def reset_after_fork():
+    """The values inherited from the parent (e.g. the gunicorn master with preload) are its own, not the child's."""
+    global _lock, _last_flush
+    _lock = threading.RLock()
+    _last_flush = time.monotonic()
+    for metric in _metrics.values():
+        metric.values = {}
+
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+# Aggregation
+
+def merge_snapshot(totals, snapshot, types=None):
+    """Adds the values of snapshot to totals; with types, only the metrics of those types."""
+    for name, values in snapshot.items():
+        metric = _metrics.get(name)
+        if metric is None or (types is not None and metric.type not in types):
+            continue
+        merged = totals.setdefault(name, {})
+        for key, value in values.items():
+            merged[key] = metric.merge_values(merged.get(key, metric.empty_value()), value)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect_files():
+    """
+    Adds up the files of METRICS_DIR, moving the counters and histograms of the exited processes to the archive.
+
+    :return: {name: {json list of the label values: value}}
+    """
+    directory = settings.METRICS_DIR
+    totals = {}
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            archive_path = os.path.join(directory, ARCHIVE_FILE)
+            archive = read_json(archive_path)
+            exited = []
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+                snapshot = read_json(path)
+                if pid == os.getpid() or is_running(pid):
+                    merge_snapshot(totals, snapshot)
+                else:
+                    merge_snapshot(archive, snapshot, types={'counter', 'histogram'})
+                    exited.append(path)
+            if exited:
+                write_json(archive_path, archive)
+                for path in exited:
+                    os.unlink(path)
+            merge_snapshot(totals, archive)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return totals
+
+
+def collect():
+    """The values of all the processes, in the format of get_snapshot."""
+    if not settings.METRICS_DIR:
+        return get_snapshot()
+    flush()
+    try:
+        return collect_files()
+    except OSError:
+        return get_snapshot()
+
+
+# Exposition
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def escape_label_value(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_sample(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{key}="{escape_label_value(str(label))}"' for key, label in labels.items())
+        return f"{name}{{{label_text}}} {format_value(value)}"
+    return f"{name} {format_value(value)}"
+
+
+def generate_exposition():
+    """The metrics of all the processes and the collectors in the Prometheus text format."""
+    totals = collect()
+    collected = {}
+    for collector in _collectors:
+        for gauge, labels, value in collector():
+            collected.setdefault(gauge.name, {})[json.dumps(list(gauge.get_key(labels)))] = value
+
+    lines = []
+    for name, metric in _metrics.items():
+        values = {tuple(json.loads(key)): value
+                  for key, value in collected.get(name, totals.get(name, {})).items()}
+        if not values and metric.labelnames:
+            continue
+        if not values:
+            values = {(): metric.empty_value()}
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for suffix, labels, value in metric.samples(values):
+            lines.append(format_sample(name + suffix, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+def get_client_ip(request):
+    """The address of the client: X-Real-IP set by nginx, or the address of the connection."""
+    return request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR', '')
+
+
+def is_allowed_ip(ip):
+    """True if ip is in one of the addresses or networks of METRICS_ALLOWED_IPS."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    """The metrics in the Prometheus text format, for the clients in METRICS_ALLOWED_IPS."""
+    if not is_allowed_ip(get_client_ip(request)):
+        return HttpResponseForbidden()
+    return HttpResponse(generate_exposition(), content_type=CONTENT_TYPE)
+
+
+# The metrics of the application
+
+HTTP_REQUEST_DURATION = Histogram('mmh_http_request_duration_seconds', 'Time to serve the requests, by view',
+                                  ['view'])
+VIDEO_PLAYBACK_EVENTS = Counter('mmh_video_playback_events_total', 'Video playback events recorded')
+PREVIEW_IMAGES = Counter('mmh_preview_images_total', 'Preview images generated')
+UPLOAD_BYTES = Counter('mmh_upload_bytes_total', 'Bytes received by the chunked uploads')
+UPLOADS_COMPLETED = Counter('mmh_uploads_completed_total', 'Chunked uploads completed')
+UPLOADS_IN_PROGRESS = Gauge('mmh_uploads_in_progress', 'Chunked uploads not completed yet')
+CLIP_MATERIALIZATIONS = Counter('mmh_clip_materializations_total', 'Clips cut by the media signal handlers',
+                                ['result'])
+CLIP_MATERIALIZATION_DURATION = Histogram('mmh_clip_materialization_duration_seconds',
+                                          'Time to cut the clips in the media signal handlers',
+                                          buckets=JOB_DURATION_BUCKETS)
+SUBSCRIBER_LOGINS = Counter('mmh_subscriber_logins_total', 'Logins of the subscribers', ['result'])
+SUBSCRIBER_CHECKS = Counter('mmh_subscriber_checks_total', 'Subscriber lookups of the integrating applications',
+                            ['endpoint'])
+EVENT_PARTICIPATIONS = Counter('mmh_event_participations_total', 'Participations to the events added and removed',
+                               ['action'])
+CACHE_REQUESTS = Counter('mmh_cache_requests_total', 'Lookups of the application caches, by result',
+                         ['cache', 'result'])
+CACHE_INVALIDATIONS = Counter('mmh_cache_invalidations_total', 'Invalidations of the application caches', ['cache'])
+EMAILS_SENT = Counter('mmh_emails_sent_total', 'Emails sent, or failed, on the SMTP connection pool', ['result'])
+EMAIL_SEND_DURATION = Histogram('mmh_email_send_duration_seconds', 'Time to send an email on the pool')
+SMTP_CONNECTIONS_OPENED = Counter('mmh_smtp_connections_opened_total', 'SMTP connections opened by the pool')
+EMAIL_OUTBOX_MESSAGES = Gauge('mmh_email_outbox_messages', 'Messages of the email outbox, by status', ['status'])
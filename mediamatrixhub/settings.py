@@ -48,6 +48,23 @@ RECAPTCHA_REQUIRED_SCORE = 0.85
 MEDIA_ROOT = '/opt/media/MediaMatrixHub/media/'
 MEDIA_URL = '/media/'
 
+# store media files under hash-sharded paths, sharing identical uploads (see core/storage.py)
+# existing files must then be moved with: ./manage.py migrate_media_storage
+CONTENT_ADDRESSED_STORAGE = env.bool('CONTENT_ADDRESSED_STORAGE', default=False)
+
+# size of the chunks of the resumable uploads (core/uploads.py)
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage' if CONTENT_ADDRESSED_STORAGE
+        else 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 BASE_URL = env('BASE_URL')
 
 FROM_EMAIL = env('FROM_EMAIL')
@@ -56,6 +73,16 @@ EMAIL_HOST = env('EMAIL_HOST')
 EMAIL_PORT = env('EMAIL_PORT')
 DEBUG_EMAIL = env('DEBUG_EMAIL')
 
+# pooled SMTP connections (mediamatrixhub.email_utils)
+EMAIL_POOL_MAX_CONNECTIONS = env.int('EMAIL_POOL_MAX_CONNECTIONS', default=4)
+EMAIL_MAX_MESSAGES_PER_CONNECTION = env.int('EMAIL_MAX_MESSAGES_PER_CONNECTION', default=100)
+EMAIL_CONNECTION_IDLE_TIMEOUT = env.int('EMAIL_CONNECTION_IDLE_TIMEOUT', default=30)
+
+# write the EventLog rows in the background, in batches (registration/event_log_writer.py)
+EVENT_LOG_ASYNC = env.bool('EVENT_LOG_ASYNC', default=False)
+# gzipped JSONL files written by the archive_event_logs command
+EVENT_LOG_ARCHIVE_DIR = env('EVENT_LOG_ARCHIVE_DIR', default=os.path.join(BASE_DIR, 'archive', 'event_log'))
+
 MONITOR_EMAIL_ADDRESSES = env('MONITOR_EMAIL_ADDRESSES').split(',')
 
 REGISTRATION_URL = env('REGISTRATION_URL')
@@ -195,6 +222,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that the measured time includes the other middleware
+    'mediamatrixhub.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -207,6 +236,22 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'mediamatrixhub.urls'
 
+# Per-request instrumentation (time, SQL queries, templates, cache), served to the staff at /instrumentation/
+INSTRUMENTATION_ENABLED = env.bool('INSTRUMENTATION_ENABLED', default=True)
+# requests slower than this are slow: the fraction INSTRUMENTATION_SLOW_LOG_SAMPLE_RATE of them is logged with its SQL
+INSTRUMENTATION_SLOW_REQUEST_MS = env.int('INSTRUMENTATION_SLOW_REQUEST_MS', default=500)
+INSTRUMENTATION_SLOW_LOG_SAMPLE_RATE = env.float('INSTRUMENTATION_SLOW_LOG_SAMPLE_RATE', default=1.0)
+# fraction of the requests run under cProfile; the profiles of the slow ones are logged (and dumped if a dir is set)
+INSTRUMENTATION_PROFILE_SAMPLE_RATE = env.float('INSTRUMENTATION_PROFILE_SAMPLE_RATE', default=0.0)
+INSTRUMENTATION_PROFILE_DIR = env('INSTRUMENTATION_PROFILE_DIR', default='')
+
+# Operational metrics in the Prometheus format at /metrics/, for the addresses or networks of METRICS_ALLOWED_IPS.
+# Each process writes its values to METRICS_DIR (a local directory, e.g. on tmpfs, shared by the gunicorn workers),
+# at most every METRICS_FLUSH_INTERVAL seconds; without METRICS_DIR only the process serving the scrape is seen.
+METRICS_DIR = env('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = env.float('METRICS_FLUSH_INTERVAL', default=5.0)
+METRICS_ALLOWED_IPS = env('METRICS_ALLOWED_IPS', default='127.0.0.1 ::1').split()
+
 TEMPLATE_DIRS = [
     os.path.join(BASE_DIR, 'core/templates/'),
     os.path.join(BASE_DIR, 'registration/templates/'),
@@ -277,6 +322,39 @@ DATABASES = {
 }
 
 
+# Cache: redis when REDIS_CACHE_URL is set, otherwise a per-process memory cache
+REDIS_CACHE_URL = env('REDIS_CACHE_URL', default='')
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            # the default of 300 entries is exceeded by the subscriber checks of a single batch request
+            'OPTIONS': {'MAX_ENTRIES': env.int('LOCMEM_CACHE_MAX_ENTRIES', default=20000)},
+        }
+    }
+
+# seconds the results of check-subscriber are cached (they are also invalidated when a subscriber changes)
+SUBSCRIBER_CHECK_CACHE_TIMEOUT = env.int('SUBSCRIBER_CHECK_CACHE_TIMEOUT', default=60)
+
+# seconds the calendar feeds of the subscribers are cached (they are also invalidated when an event or a
+# participation changes)
+CALENDAR_FEED_CACHE_TIMEOUT = env.int('CALENDAR_FEED_CACHE_TIMEOUT', default=24 * 60 * 60)
+
+# load the HR dumps when the WSGI application is created, instead of at the first lookup of each worker
+DIRECTORY_PRELOAD = env.bool('DIRECTORY_PRELOAD', default=True)
+
+# seconds the rendered event fragments are kept in the cache (they are also invalidated when an event is saved)
+EVENT_FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -318,6 +396,11 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
 SESSION_COOKIE_AGE = 1209600*2  # 4 weeks, in seconds
 
+# how the registration app remembers the logged subscriber: 'signed_cookie' (no server-side state), 'cache' or
+# 'db' (the Django session, with a row for each login)
+REGISTRATION_SESSION_MODE = env('REGISTRATION_SESSION_MODE', default='signed_cookie')
+REGISTRATION_SESSION_AGE = env.int('REGISTRATION_SESSION_AGE', default=12 * 60 * 60)  # seconds
+
 USE_I18N = True  # Enable Django's translation system
 USE_L10N = True  # Enable localized formatting of data
 
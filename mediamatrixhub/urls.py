@@ -21,10 +21,14 @@ from django.urls import path
 
 from core.views import proxy_django_auth
 from mediamatrixhub import settings
+from mediamatrixhub.instrumentation import instrumentation_view
+from mediamatrixhub.metrics import metrics_view
 
 urlpatterns = [
     # path('proxy_django_auth/', proxy_django_auth, name='proxy_django_auth'),
     path('admin/', admin.site.urls),
+    path('instrumentation/', instrumentation_view, name='instrumentation'),
+    path('metrics/', metrics_view, name='metrics'),
     path('core/', include('core.urls')),
     path('registrazione/', include('registration.urls')),
 
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediamatrixhub.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.DIRECTORY_PRELOAD:
+    from registration.directory import preload_directory  # noqa: E402
+
+    preload_directory()
@@ -4,7 +4,8 @@ from openpyxl.workbook import Workbook
 
 from django.utils.translation import gettext_lazy as _
 
-from .models import InformationEvent, Subscriber, EventParticipation, EventLog, SubscriptionAlertMessage
+from .models import InformationEvent, Subscriber, EventParticipation, EventLog, SubscriptionAlertMessage, EventCapacity, \
+    EmailOutbox
 
 
 class InformationEventAdmin(admin.ModelAdmin):
@@ -123,8 +124,17 @@ class EventParticipationAdmin(admin.ModelAdmin):
 
 @admin.register(EventLog)
 class EventLogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created_at', 'event_type', 'event_title', 'event_target', 'event_data', 'created_at')
+    list_display = ('id', 'created_at', 'event_type', 'event_title', 'event_target', 'event_data', 'subscriber_id',
+                    'ip_address', 'created_at')
     list_filter = ['event_type']
+    search_fields = ('event_target',)
+    exclude = ('payload',)
+    readonly_fields = ('get_payload_text',)
+
+    def get_payload_text(self, obj):
+        return obj.payload.get_text() if obj.payload_id else ''
+
+    get_payload_text.short_description = 'Payload'
 
 
 class SubscriptionAlertMessageAdmin(admin.ModelAdmin):
@@ -134,3 +144,18 @@ class SubscriptionAlertMessageAdmin(admin.ModelAdmin):
 
 
 admin.site.register(SubscriptionAlertMessage, SubscriptionAlertMessageAdmin)
+
+
+@admin.register(EventCapacity)
+class EventCapacityAdmin(admin.ModelAdmin):
+    list_display = ('event', 'taken', 'max_participants', 'updated_at')
+    readonly_fields = ('event', 'taken', 'max_participants', 'updated_at')
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'status', 'to_addresses', 'subject', 'attempts', 'next_attempt_at',
+                    'sent_at', 'delivery_latency')
+    list_filter = ('status', 'log_event_type')
+    search_fields = ('to_addresses', 'subject', 'idempotency_key')
+    readonly_fields = ('created_at', 'sent_at', 'attempts', 'last_error')
@@ -0,0 +1,110 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from mediamatrixhub.metrics import CACHE_REQUESTS
+from mediamatrixhub.settings import PRODID, APPLICATION_TITLE
+from registration.models import InformationEvent, Subscriber
+
+GENERATION_KEY = 'calendar_feed:generation'
+
+
+def generate_calendar(events, name=None, dtstamp_from_update=False):
+    """
+    Returns a VCALENDAR with a VEVENT for each event.
+
+    :param events: InformationEvent instances
+    :param name: name of the calendar shown by the calendar applications
+    :param dtstamp_from_update: use the updated_at of the events as DTSTAMP, so that the output changes only when
+        the events change
+    """
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:-{PRODID}",
+    ]
+    if name:
+        lines.append(f"X-WR-CALNAME:{name}")
+        # hint for the clients on how often to poll the feed
+        lines.append("X-PUBLISHED-TTL:PT1H")
+    content = "\n".join(lines) + "\n"
+    for event in events:
+        content += event.generate_ics_vevent(dtstamp=event.updated_at if dtstamp_from_update else None)
+    return content + "END:VCALENDAR\n"
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def get_token_key(calendar_token):
+    return f"calendar_feed:token:{calendar_token}"
+
+
+def get_feed_key(generation, subscriber_id):
+    # the date: the past events leave the feed the next day
+    return f"calendar_feed:{generation}:{timezone.localdate()}:{subscriber_id}"
+
+
+def invalidate_calendar_feed(subscriber_id):
+    """Discards the cached feed of a subscriber, e.g. after a change of the participations."""
+    cache.delete(get_feed_key(get_generation(), subscriber_id))
+
+
+def forget_calendar_token(calendar_token):
+    """Discards the cached subscriber of a calendar token, e.g. after the subscriber has been disabled."""
+    if calendar_token is not None:
+        cache.delete(get_token_key(calendar_token))
+
+
+def invalidate_calendar_feeds():
+    """Discards all the cached feeds, e.g. after a change of an event."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, None)
+
+
+def get_calendar_feed(calendar_token):
+    """
+    Returns (content, etag) of the feed of the upcoming events of the subscriber with calendar_token, or None if
+    there is no such enabled subscriber.
+
+    The feed is cached for CALENDAR_FEED_CACHE_TIMEOUT seconds under the id of the subscriber, so that the changes
+    of the participations invalidate it without a query; the id of the subscriber of the token (which never changes)
+    is cached as well. The feed is generated with a single query on the events.
+    """
+    token_key = get_token_key(calendar_token)
+    cached = cache.get_many([GENERATION_KEY, token_key])
+    generation = cached.get(GENERATION_KEY) or get_generation()
+    subscriber_id = cached.get(token_key)
+
+    if subscriber_id is not None:
+        feed = cache.get(get_feed_key(generation, subscriber_id))
+        if feed is not None:
+            CACHE_REQUESTS.inc(cache='calendar_feed', result='hit')
+            return feed
+    CACHE_REQUESTS.inc(cache='calendar_feed', result='miss')
+
+    if subscriber_id is None:
+        subscriber_id = Subscriber.objects.filter(calendar_token=calendar_token, enabled=True) \
+            .values_list('id', flat=True).first()
+        if subscriber_id is None:
+            return None
+        cache.set(token_key, subscriber_id, settings.CALENDAR_FEED_CACHE_TIMEOUT)
+
+    events = InformationEvent.objects.filter(
+        eventparticipation__subscriber_id=subscriber_id, event_date__gte=timezone.localdate(), enabled=True,
+        is_deleted=False,
+    ).order_by('event_date', 'event_start_time')
+    content = generate_calendar(events, name=APPLICATION_TITLE, dtstamp_from_update=True)
+    etag = f'"{hashlib.sha1(content.encode()).hexdigest()}"'
+
+    cache.set(get_feed_key(generation, subscriber_id), (content, etag), settings.CALENDAR_FEED_CACHE_TIMEOUT)
+    return content, etag
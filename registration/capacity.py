@@ -0,0 +1,123 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from registration.models import EventCapacity, EventParticipation, InformationEvent
+
+
+def get_or_create_capacity(event):
+    """Returns the EventCapacity of event, creating it with the current number of participants if missing."""
+    try:
+        return EventCapacity.objects.get(event_id=event.id)
+    except EventCapacity.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return EventCapacity.objects.create(
+                event_id=event.id,
+                max_participants=event.max_participants,
+                taken=EventParticipation.objects.filter(event_id=event.id).count(),
+            )
+    except IntegrityError:
+        # created meanwhile by a concurrent request
+        return EventCapacity.objects.get(event_id=event.id)
+
+
+def is_registration_open(event, today=None):
+    """Subscriptions are accepted until the registration deadline (included), if any."""
+    if event.registration_deadline is None:
+        return True
+    if today is None:
+        today = timezone.localdate()
+    return today <= event.registration_deadline
+
+
+def reserve_seat(event):
+    """
+    Takes a seat of event, if one is available.
+
+    The check and the increment are a single conditional UPDATE, atomic in the database: under concurrent
+    subscriptions the counter never exceeds max_participants, and the row lock is held only until the end of
+    the current transaction. Call it in the transaction which creates the EventParticipation, with bulk_create:
+    the seat is already counted, while a save() of a new participation counts it again (see signals.py).
+
+    :return: True if the seat has been reserved
+    """
+    available = Q(max_participants__isnull=True) | Q(taken__lt=F('max_participants'))
+    for _ in range(2):
+        if EventCapacity.objects.filter(available, event_id=event.id).update(taken=F('taken') + 1):
+            return True
+        if EventCapacity.objects.filter(event_id=event.id).exists():
+            return False
+        get_or_create_capacity(event)
+    return False
+
+
+def release_seat(event_id, count=1):
+    """Gives back count seats of the event."""
+    EventCapacity.objects.filter(event_id=event_id, taken__gte=count).update(taken=F('taken') - count)
+
+
+def add_seats(event_id, count=1):
+    """Counts count participations added to the event without reserve_seat (the limit is not checked)."""
+    if not EventCapacity.objects.filter(event_id=event_id).update(taken=F('taken') + count):
+        # created counting the participations, the new ones included
+        get_or_create_capacity(InformationEvent.objects.only('id', 'max_participants').get(pk=event_id))
+
+
+def bulk_add_participations(participations):
+    """
+    Creates the participations with one query and updates the counters with one query per event.
+
+    For the bulk additions which do not reserve seats (e.g. imports); the limit of the events is not checked.
+
+    :param participations: unsaved EventParticipation instances
+    :return: the created participations
+    """
+    with transaction.atomic():
+        created = EventParticipation.objects.bulk_create(participations)
+        for event_id, count in Counter(participation.event_id for participation in created).items():
+            add_seats(event_id, count)
+    return created
+
+
+def reconcile_capacities(events=None, dry_run=False):
+    """
+    Recomputes the taken seats from the participations and fixes the counters which differ.
+
+    The counters are first compared with one aggregated query; each counter to be fixed is then locked and
+    recounted, so that concurrent subscriptions are not lost.
+
+    :param events: queryset of InformationEvent, all the events by default
+    :return: list of (event id, counter value, actual number of participations)
+    """
+    if events is None:
+        events = InformationEvent.objects.all()
+
+    actual_counts = events.annotate(actual=Count('eventparticipation')).values_list('id', 'max_participants', 'actual')
+    counters = {event_id: (taken, max_participants) for event_id, taken, max_participants in
+                EventCapacity.objects.filter(event__in=events).values_list('event_id', 'taken', 'max_participants')}
+
+    differences = []
+    for event_id, max_participants, actual in actual_counts:
+        taken, counter_max_participants = counters.get(event_id, (None, None))
+        if taken == actual and counter_max_participants == max_participants:
+            continue
+        if taken != actual:
+            differences.append((event_id, taken, actual))
+        if dry_run:
+            continue
+
+        with transaction.atomic():
+            capacity = EventCapacity.objects.select_for_update().filter(event_id=event_id).first()
+            actual = EventParticipation.objects.filter(event_id=event_id).count()
+            if capacity is None:
+                EventCapacity.objects.create(event_id=event_id, taken=actual, max_participants=max_participants)
+            else:
+                capacity.taken = actual
+                capacity.max_participants = max_participants
+                capacity.save(update_fields=['taken', 'max_participants', 'updated_at'])
+
+    return differences
@@ -0,0 +1,499 @@
+import json
+import os
+import sqlite3
+import syslog
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from registration.json_stream import iter_json_object, JSONStreamError
+
+PERSONS_FILE = os.path.join(settings.BASE_DIR, 'registration/res/persfvg_dump_persone_entita.json')
+STRUCTURES_FILE = os.path.join(settings.BASE_DIR, 'registration/res/persfvg_dump_final.json')
+# built from the two dumps by the build_persfvg_snapshot command
+SNAPSHOT_FILE = os.path.join(settings.BASE_DIR, 'registration/res/persfvg_snapshot.sqlite3')
+
+SNAPSHOT_MMAP_SIZE = 512 * 1024 * 1024
+
+# positions in the records of persfvg_dump_persone_entita.json
+MATRICOLA = 0
+EMAIL = 1
+SURNAME = 3
+NAME = 4
+UAF = 5
+STRUCTURE = 6
+
+# positions in the records of persfvg_dump_final.json (the key is the uaf of the structure)
+STRUCTURE_NAME = 0
+PARENT_UAF = 3
+
+# seconds between two checks of the modification time of the dumps
+DEFAULT_CHECK_INTERVAL = 5
+
+
+def load_json_dump(file_name):
+    """Returns the content of a dump, or an empty dictionary if it cannot be read."""
+    try:
+        # read record by record: the raw text of the file is never held in memory as a whole
+        return dict(iter_json_object(file_name))
+    except FileNotFoundError:
+        print(f"The file {file_name} was not found.")
+    except JSONStreamError:
+        print(f"Failed to decode JSON of {file_name}, please check the file format.")
+    return {}
+
+
+def get_file_signature(file_name):
+    """Returns (mtime, size) of a file, None if it does not exist."""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_field(record, position):
+    try:
+        return record[position] or None
+    except (IndexError, TypeError):
+        return None
+
+
+class DirectoryIndex:
+    """
+    Immutable snapshot of the two dumps with their indexes; it is replaced as a whole when a dump changes.
+    """
+
+    def __init__(self, persons, structures, signature=None):
+        self.persons = persons
+        self.structures = structures
+        self.signature = signature
+
+        self.by_matricola = {}
+        self.by_email = {}
+        self.by_structure = {}
+
+        for record in persons.values():
+            matricola = get_field(record, MATRICOLA)
+            email = get_field(record, EMAIL)
+            structure = get_field(record, STRUCTURE)
+            if matricola:
+                self.by_matricola[matricola] = record
+            if email:
+                self.by_email[email.lower()] = record
+            if structure:
+                self.by_structure.setdefault(structure, []).append(record)
+
+        self.children = {}
+        for uaf, record in structures.items():
+            try:
+                parent_uaf = record[PARENT_UAF]
+            except (IndexError, TypeError):
+                continue
+            if parent_uaf != uaf:
+                self.children.setdefault(parent_uaf, []).append(uaf)
+
+        self.build_tree_index()
+
+    def build_tree_index(self):
+        """
+        Numbers the structures with an Euler tour of the tree: the sub-structures of a uaf are the contiguous
+        slice tour[start[uaf]:end[uaf]], and the people of a subtree are a contiguous slice of the people sorted
+        in tour order.
+        """
+        children = self.children
+        self.tour = []
+        self.start = {}
+        self.end = {}
+
+        # roots: parents which are not structures themselves, then structures without a (valid) parent;
+        # the remaining nodes can only be reached through a cycle and are numbered last
+        roots = [uaf for uaf in children if uaf not in self.structures]
+        roots.extend(uaf for uaf in self.structures if self.parent_of(uaf) in (None, uaf))
+        roots.extend(self.structures)
+
+        for root in roots:
+            if root in self.start:
+                continue
+            self.start[root] = len(self.tour)
+            self.tour.append(root)
+            stack = [(root, iter(children.get(root, ())))]
+            while stack:
+                uaf, pending = stack[-1]
+                for child in pending:
+                    if child not in self.start:
+                        self.start[child] = len(self.tour)
+                        self.tour.append(child)
+                        stack.append((child, iter(children.get(child, ()))))
+                        break
+                else:
+                    self.end[uaf] = len(self.tour)
+                    stack.pop()
+
+        # people_offsets[i] is the position in tour_people of the first person of the structure tour[i]
+        self.tour_people = []
+        self.people_offsets = []
+        for uaf in self.tour:
+            self.people_offsets.append(len(self.tour_people))
+            self.tour_people.extend(self.by_structure.get(uaf, ()))
+        self.people_offsets.append(len(self.tour_people))
+
+    def get_person_by_matricola(self, matricola):
+        return self.by_matricola.get(matricola)
+
+    def get_person_by_email(self, email):
+        return self.by_email.get(email.lower())
+
+    def get_people_by_structure(self, uaf):
+        return self.by_structure.get(uaf, [])
+
+    def get_persons(self):
+        return self.persons
+
+    def get_structures(self):
+        return self.structures
+
+    def get_structure(self, uaf):
+        return self.structures.get(uaf)
+
+    def get_children(self, uaf):
+        return self.children.get(uaf, [])
+
+    def get_size(self):
+        """Returns (number of persons, number of structures)."""
+        return len(self.persons), len(self.structures)
+
+    def parent_of(self, uaf):
+        try:
+            return self.structures[uaf][PARENT_UAF]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    def get_subtree(self, uaf):
+        """Returns uaf and all its sub-structures, in O(size of the subtree)."""
+        if uaf not in self.start:
+            return [uaf]
+        return self.tour[self.start[uaf]:self.end[uaf]]
+
+    def get_subtree_people(self, uaf):
+        """Returns the people of uaf and of all its sub-structures, in O(number of people returned)."""
+        if uaf not in self.start:
+            return list(self.by_structure.get(uaf, ()))
+        return self.tour_people[self.people_offsets[self.start[uaf]]:self.people_offsets[self.end[uaf]]]
+
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE person (key TEXT, matricola TEXT, email TEXT, structure TEXT, tour_position INTEGER, record TEXT);
+CREATE TABLE structure (uaf TEXT PRIMARY KEY, parent_uaf TEXT, record TEXT);
+CREATE TABLE tour (position INTEGER PRIMARY KEY, uaf TEXT UNIQUE, subtree_end INTEGER);
+"""
+
+SNAPSHOT_INDEXES = """
+CREATE INDEX person_matricola ON person (matricola);
+CREATE INDEX person_email ON person (email);
+CREATE INDEX person_structure ON person (structure);
+CREATE INDEX person_tour_position ON person (tour_position);
+CREATE INDEX structure_parent_uaf ON structure (parent_uaf);
+"""
+
+
+def build_snapshot(persons_file=PERSONS_FILE, structures_file=STRUCTURES_FILE, snapshot_file=SNAPSHOT_FILE):
+    """
+    Converts the two JSON dumps into a SQLite snapshot which the directory queries in place.
+
+    The snapshot is written to a temporary file and then renamed, so that running processes keep reading the
+    previous one until they notice the change.
+
+    :return: (number of persons, number of structures)
+    """
+    index = DirectoryIndex(load_json_dump(persons_file), load_json_dump(structures_file))
+    tour_position = {uaf: position for position, uaf in enumerate(index.tour)}
+
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(snapshot_file), suffix='.tmp')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(tmp_file)
+        try:
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(SNAPSHOT_SCHEMA)
+            with connection:
+                connection.executemany(
+                    'INSERT INTO person VALUES (?, ?, ?, ?, ?, ?)',
+                    (
+                        (
+                            key,
+                            get_field(record, MATRICOLA),
+                            (get_field(record, EMAIL) or '').lower() or None,
+                            get_field(record, STRUCTURE),
+                            tour_position.get(get_field(record, STRUCTURE)),
+                            json.dumps(record, ensure_ascii=False),
+                        )
+                        for key, record in index.persons.items()
+                    )
+                )
+                connection.executemany(
+                    'INSERT INTO structure VALUES (?, ?, ?)',
+                    ((uaf, index.parent_of(uaf), json.dumps(record, ensure_ascii=False))
+                     for uaf, record in index.structures.items())
+                )
+                connection.executemany(
+                    'INSERT INTO tour VALUES (?, ?, ?)',
+                    ((position, uaf, index.end[uaf]) for position, uaf in enumerate(index.tour))
+                )
+            connection.executescript(SNAPSHOT_INDEXES)
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+        os.replace(tmp_file, snapshot_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    return index.get_size()
+
+
+class SnapshotIndex:
+    """
+    Same lookups of DirectoryIndex, answered by queries on the SQLite snapshot.
+
+    The file is opened read-only and memory-mapped: the processes share its pages through the page cache
+    instead of each one parsing the JSON dumps. Connections are per thread.
+    """
+
+    def __init__(self, snapshot_file, signature=None):
+        self.snapshot_file = snapshot_file
+        self.signature = signature
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # immutable: the snapshot is never modified in place, build_snapshot replaces the whole file
+            connection = sqlite3.connect(f'file:{self.snapshot_file}?mode=ro&immutable=1', uri=True,
+                                         check_same_thread=False)
+            connection.execute(f'PRAGMA mmap_size={SNAPSHOT_MMAP_SIZE}')
+            self.local.connection = connection
+        return connection
+
+    def query_records(self, sql, params=()):
+        return [json.loads(row[0]) for row in self.connection.execute(sql, params)]
+
+    def query_record(self, sql, params=()):
+        row = self.connection.execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_person_by_matricola(self, matricola):
+        # the dictionaries keep the last record of duplicated keys
+        return self.query_record('SELECT record FROM person WHERE matricola = ? ORDER BY rowid DESC LIMIT 1',
+                                 (matricola,))
+
+    def get_person_by_email(self, email):
+        return self.query_record('SELECT record FROM person WHERE email = ? ORDER BY rowid DESC LIMIT 1',
+                                 (email.lower(),))
+
+    def get_people_by_structure(self, uaf):
+        return self.query_records('SELECT record FROM person WHERE structure = ? ORDER BY rowid', (uaf,))
+
+    def get_persons(self):
+        return {key: json.loads(record) for key, record in
+                self.connection.execute('SELECT key, record FROM person ORDER BY rowid')}
+
+    def get_structures(self):
+        return {uaf: json.loads(record) for uaf, record in
+                self.connection.execute('SELECT uaf, record FROM structure ORDER BY rowid')}
+
+    def get_structure(self, uaf):
+        return self.query_record('SELECT record FROM structure WHERE uaf = ?', (uaf,))
+
+    def get_children(self, uaf):
+        return [row[0] for row in self.connection.execute(
+            'SELECT uaf FROM structure WHERE parent_uaf = ? AND uaf != ? ORDER BY rowid', (uaf, uaf))]
+
+    def get_size(self):
+        return tuple(self.connection.execute(
+            'SELECT (SELECT COUNT(*) FROM person), (SELECT COUNT(*) FROM structure)').fetchone())
+
+    def get_tour_range(self, uaf):
+        return self.connection.execute('SELECT position, subtree_end FROM tour WHERE uaf = ?', (uaf,)).fetchone()
+
+    def get_subtree(self, uaf):
+        tour_range = self.get_tour_range(uaf)
+        if tour_range is None:
+            return [uaf]
+        return [row[0] for row in self.connection.execute(
+            'SELECT uaf FROM tour WHERE position >= ? AND position < ? ORDER BY position', tour_range)]
+
+    def get_subtree_people(self, uaf):
+        tour_range = self.get_tour_range(uaf)
+        if tour_range is None:
+            return self.get_people_by_structure(uaf)
+        return self.query_records(
+            'SELECT record FROM person WHERE tour_position >= ? AND tour_position < ? ORDER BY tour_position, rowid',
+            tour_range)
+
+
+class OrganisationDirectory:
+    """
+    Lookups on the HR dumps (people and structures), loaded once per process.
+
+    The dumps are reloaded when their modification time changes: the new indexes are built aside and then
+    swapped in, so that concurrent lookups always see a complete snapshot.
+
+    :param persons_file: path of persfvg_dump_persone_entita.json
+    :param structures_file: path of persfvg_dump_final.json
+    :param snapshot_file: path of the SQLite snapshot; it is used instead of the dumps when it is newer
+    :param check_interval: minimum number of seconds between two checks of the files
+    """
+
+    def __init__(self, persons_file=PERSONS_FILE, structures_file=STRUCTURES_FILE, snapshot_file=SNAPSHOT_FILE,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        self.persons_file = persons_file
+        self.structures_file = structures_file
+        self.snapshot_file = snapshot_file
+        self.check_interval = check_interval
+        self._index = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get_signature(self):
+        return (get_file_signature(self.persons_file), get_file_signature(self.structures_file),
+                get_file_signature(self.snapshot_file) if self.snapshot_file else None)
+
+    def is_snapshot_current(self, signature):
+        """The snapshot is used when it exists and it is not older than the dumps."""
+        persons_signature, structures_signature, snapshot_signature = signature
+        if snapshot_signature is None:
+            return False
+        return all(dump_signature is None or dump_signature[0] <= snapshot_signature[0]
+                   for dump_signature in (persons_signature, structures_signature))
+
+    def build_index(self, signature):
+        if self.is_snapshot_current(signature):
+            return SnapshotIndex(self.snapshot_file, signature)
+        return DirectoryIndex(load_json_dump(self.persons_file), load_json_dump(self.structures_file), signature)
+
+    def reload(self):
+        """Loads the dumps again, unconditionally."""
+        with self._lock:
+            self._index = self.build_index(self.get_signature())
+            self._checked_at = time.monotonic()
+        return self._index
+
+    @property
+    def index(self):
+        index = self._index
+        if index is not None:
+            if time.monotonic() - self._checked_at < self.check_interval:
+                return index
+            # another thread is already checking (or reloading) the dumps: keep using the current snapshot
+            if not self._lock.acquire(blocking=False):
+                return index
+        else:
+            self._lock.acquire()
+
+        try:
+            # another thread may have loaded the dumps while we were waiting
+            if self._index is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._index
+            signature = self.get_signature()
+            if self._index is None or signature != self._index.signature:
+                self._index = self.build_index(signature)
+            self._checked_at = time.monotonic()
+            return self._index
+        finally:
+            self._lock.release()
+
+    # people
+
+    def get_person_by_matricola(self, matricola):
+        """Returns the record of the person with the given matricola, or None."""
+        return self.index.get_person_by_matricola(matricola)
+
+    def get_person_by_email(self, email):
+        """Returns the record of the person with the given email (case-insensitive), or None."""
+        if not email:
+            return None
+        return self.index.get_person_by_email(email)
+
+    def get_structure_by_email(self, email):
+        """Returns the uaf of the structure of the person with the given email, or None."""
+        record = self.get_person_by_email(email)
+        if record is None:
+            return None
+        return get_field(record, STRUCTURE)
+
+    def get_people_by_structure(self, uaf):
+        """Returns the records of the people assigned to the structure uaf (not to its sub-structures)."""
+        return self.index.get_people_by_structure(uaf)
+
+    def get_persons(self):
+        """Returns the whole persons dump."""
+        return self.index.get_persons()
+
+    # structures
+
+    def get_structures(self):
+        """Returns the whole structures dump, indexed by uaf."""
+        return self.index.get_structures()
+
+    def get_structure(self, uaf):
+        return self.index.get_structure(uaf)
+
+    def get_structure_name(self, uaf):
+        record = self.get_structure(uaf)
+        if record is None:
+            return None
+        return record[STRUCTURE_NAME]
+
+    def get_parent_uaf(self, uaf):
+        record = self.get_structure(uaf)
+        if record is None:
+            return None
+        return record[PARENT_UAF]
+
+    def get_children_uafs(self, uaf):
+        """Returns the uafs of the direct sub-structures of uaf."""
+        return self.index.get_children(uaf)
+
+    def get_sub_structures(self, uaf):
+        """Returns uaf and the uafs of all its sub-structures, recursively."""
+        return self.index.get_subtree(uaf)
+
+    def get_people_in_subtree(self, uaf):
+        """Returns the records of the people of structure uaf and of all its sub-structures."""
+        return self.index.get_subtree_people(uaf)
+
+
+__directory = None
+__directory_lock = threading.Lock()
+
+
+def get_directory():
+    """Returns the OrganisationDirectory shared by the whole process."""
+    global __directory
+    if __directory is None:
+        with __directory_lock:
+            if __directory is None:
+                __directory = OrganisationDirectory()
+    return __directory
+
+
+def preload_directory():
+    """
+    Loads the HR dumps now, so that the first lookup of a worker does not wait for them.
+
+    Called by wsgi.py: with a preloading server (e.g. gunicorn --preload) the dumps are loaded once in the
+    master process and shared by the forked workers.
+    """
+    start = time.perf_counter()
+    try:
+        get_directory().index
+    except (OSError, ValueError) as e:
+        syslog.syslog(syslog.LOG_ERR, f'preload_directory: {e}')
+        return
+    syslog.syslog(syslog.LOG_INFO, f'preload_directory: HR dumps loaded in {time.perf_counter() - start:.2f} s')
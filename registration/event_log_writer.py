@@ -0,0 +1,111 @@
+import atexit
+import os
+import queue
+import threading
+
+from django.db import connection, close_old_connections, OperationalError, InterfaceError
+
+from registration.logic import write_event_logs
+
+BATCH_SIZE = 200
+# seconds: a log is written at most FLUSH_INTERVAL seconds after it has been created
+FLUSH_INTERVAL = 1.0
+MAX_QUEUE_SIZE = 10000
+
+
+class EventLogWriter:
+    """
+    Writes the EventLog rows in batches from a background thread, so that requests do not wait for them.
+
+    The thread is started at the first put() in each process: a process forked by the server (e.g. gunicorn with
+    preload) gets its own queue and thread. The pending logs are written at exit. When the queue is full, the
+    logs are written by the caller.
+
+    :param batch_size: maximum number of logs written with one query
+    :param flush_interval: maximum seconds a log waits in the queue
+    :param max_queue_size: maximum number of logs waiting in the queue
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue_size=MAX_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.thread = None
+
+    def start(self):
+        """Starts the thread, if not already running in this process."""
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.queue = queue.Queue(self.max_queue_size)
+            self.thread = threading.Thread(target=self.run, name='event-log-writer', daemon=True)
+            self.thread.start()
+
+    def put(self, entries):
+        """Queues the (EventLog, payload) built by logic.make_event_log."""
+        self.start()
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                write_event_logs([entry])
+
+    def run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            flush_events = [entry for entry in batch if isinstance(entry, threading.Event)]
+            entries = [entry for entry in batch if not isinstance(entry, threading.Event)]
+            if entries:
+                try:
+                    self.write(entries)
+                except Exception as e:
+                    print(f"EventLogWriter: {len(entries)} logs not written: {e}")
+                    # the connection may be broken: a new one is opened at the next query
+                    connection.close()
+            for flush_event in flush_events:
+                flush_event.set()
+
+    def write(self, entries):
+        """
+        Writes a batch of logs.
+
+        The connection of the thread stays idle between the batches and may have been closed by the server
+        (e.g. MySQL wait_timeout): the batch is written again, once, on a new connection.
+        """
+        close_old_connections()
+        try:
+            write_event_logs(entries)
+        except (OperationalError, InterfaceError):
+            connection.close()
+            write_event_logs(entries)
+
+    def flush(self, timeout=10):
+        """Waits until the logs queued so far have been written."""
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        flush_event = threading.Event()
+        self.queue.put(flush_event)
+        flush_event.wait(timeout)
+
+
+_writer = EventLogWriter()
+
+
+def get_event_log_writer():
+    return _writer
+
+
+@atexit.register
+def flush_event_logs():
+    _writer.flush()
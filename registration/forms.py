@@ -33,10 +33,13 @@ class EventParticipationForm(forms.Form):
             event_date__gte=current_date
         )
 
-        for event in enabled_events:
+        # the events of the form, by id
+        self.events = enabled_events.in_bulk()
+
+        for event in self.events.values():
             self.fields[f'event_{event.id}'] = forms.BooleanField(
                 label=event.to_html_table(),
                 required=False
             )
 
-        self.number_of_events = len(enabled_events)
\ No newline at end of file
+        self.number_of_events = len(self.events)
\ No newline at end of file
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+
+FRAGMENT_WEB = 'web'
+FRAGMENT_EMAIL = 'email'
+
+FRAGMENT_KINDS = (FRAGMENT_WEB, FRAGMENT_EMAIL)
+
+
+def get_fragment_key(kind, event_id, language=None):
+    if language is None:
+        language = translation.get_language()
+    return f"event_fragment:{kind}:{event_id}:{language}"
+
+
+def get_event_fragment(event, kind, render):
+    """
+    Returns the HTML fragment of kind for event, rendering it with render() only when it is not cached.
+
+    The cached value carries event.updated_at: a fragment rendered before the last save of the event is never
+    returned, even if the invalidation has been missed (e.g. with a cache shared by several servers).
+
+    :param event: InformationEvent instance
+    :param kind: FRAGMENT_WEB or FRAGMENT_EMAIL
+    :param render: function returning the HTML
+    """
+    key = get_fragment_key(kind, event.pk)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == event.updated_at:
+        return cached[1]
+
+    html = render()
+    if event.pk is not None:
+        cache.set(key, (event.updated_at, str(html)), getattr(settings, 'EVENT_FRAGMENT_CACHE_TIMEOUT', None))
+    return html
+
+
+def invalidate_event_fragments(event_id):
+    """Deletes the cached fragments of an event, in all the languages."""
+    languages = {language for language, _ in settings.LANGUAGES}
+    languages.update({settings.LANGUAGE_CODE, translation.get_language()})
+    cache.delete_many([get_fragment_key(kind, event_id, language)
+                       for kind in FRAGMENT_KINDS for language in languages if language])
+
+
+def warm_event_fragments(events):
+    """Renders and caches both fragments of events; returns the number of events."""
+    count = 0
+    for event in events:
+        event.to_html_table()
+        event.to_html_table_email()
+        count += 1
+    return count
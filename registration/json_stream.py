@@ -0,0 +1,98 @@
+import json
+import re
+
+READ_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class JSONObjectReader:
+    """
+    Incremental reader of a file containing a single JSON object, as the HR dumps ({key: [fields...], ...}).
+
+    Only the current record is decoded and kept in memory, together with a read buffer.
+
+    :param file: text file object
+    :param read_size: number of characters read at a time
+    """
+
+    def __init__(self, file, read_size=READ_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        """Reads more data, dropping the part of the buffer already consumed; returns False at the end of file."""
+        if self.eof:
+            return False
+        data = self.file.read(max(self.read_size, len(self.buffer) - self.position))
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+        if not data:
+            self.eof = True
+        return bool(data)
+
+    def peek(self):
+        """Returns the next character which is not whitespace, without consuming it ('' at the end of file)."""
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ''
+
+    def expect(self, characters):
+        c = self.peek()
+        if c not in characters or not c:
+            raise JSONStreamError(f"expected one of {characters!r}, found {c!r}")
+        self.position += 1
+        return c
+
+    def decode_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+                # a number at the end of the buffer may continue in the next read
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise JSONStreamError(str(e)) from e
+            self.fill()
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.decode_value()
+            if not isinstance(key, str):
+                raise JSONStreamError(f"object keys must be strings, found {key!r}")
+            self.expect(':')
+            value = self.decode_value()
+            yield key, value
+            if self.expect(',}') == '}':
+                return
+
+
+def iter_json_object(file_name, read_size=READ_SIZE):
+    """
+    Yields the (key, value) items of the JSON object stored in file_name, one at a time.
+
+    Example:
+        for key, record in iter_json_object('registration/res/persfvg_dump_persone_entita.json'):
+            ...
+    """
+    with open(file_name, 'r', encoding='utf-8') as file:
+        yield from JSONObjectReader(file, read_size)
@@ -1,6 +1,11 @@
-from .models import Subscriber, EventLog
+from .models import Subscriber, EventLog, EventLogPayload
+from django.conf import settings
 from django.utils import timezone
 
+# event_data longer than PAYLOAD_THRESHOLD characters is moved to an EventLogPayload, keeping a preview
+PAYLOAD_THRESHOLD = 1024
+PAYLOAD_PREVIEW = 200
+
 
 def create_subscriber(email, name, surname, matricola):
     """
@@ -20,29 +25,125 @@ def create_subscriber(email, name, surname, matricola):
     return subscriber
 
 
-def create_event_log(event_type, event_title, event_data, event_target=None):
+def make_event_log(event_type, event_title, event_data=None, event_target=None, subscriber=None,
+                   information_event=None, ip_address=None, data=None, payload=None):
+    """
+    Builds an unsaved EventLog; see create_event_log for the arguments.
+
+    Returns:
+    tuple: (EventLog, payload text or None); the payload is stored by write_event_logs.
+    """
+    if payload is None and event_data is not None and len(event_data) > PAYLOAD_THRESHOLD:
+        payload, event_data = event_data, event_data[:PAYLOAD_PREVIEW]
+    event_log = EventLog(
+        event_type=event_type,
+        event_title=event_title,
+        event_data=event_data,
+        event_target=event_target,
+        subscriber_id=getattr(subscriber, 'pk', subscriber),
+        information_event_id=getattr(information_event, 'pk', information_event),
+        ip_address=ip_address or None,
+        data=data,
+        created_at=timezone.now()
+    )
+    return event_log, payload
+
+
+def store_payloads(texts):
+    """
+    Stores the texts as EventLogPayload, once for each distinct text.
+
+    Returns:
+    dict: digest -> EventLogPayload id, for all the texts.
+    """
+    payloads = {}
+    for text in texts:
+        payload = EventLogPayload.from_text(text)
+        payloads[payload.digest] = payload
+    if not payloads:
+        return {}
+    existing = dict(EventLogPayload.objects.filter(digest__in=payloads).values_list('digest', 'id'))
+    missing = [payload for digest, payload in payloads.items() if digest not in existing]
+    if missing:
+        # ignore_conflicts: the same payload may be stored concurrently by another process
+        EventLogPayload.objects.bulk_create(missing, ignore_conflicts=True)
+        existing.update(EventLogPayload.objects.filter(digest__in=[payload.digest for payload in missing])
+                        .values_list('digest', 'id'))
+    return existing
+
+
+def write_event_logs(entries):
+    """
+    Saves the (EventLog, payload text) built by make_event_log, with one query for the payloads and one for the
+    logs.
+    """
+    payload_ids = store_payloads(payload for _, payload in entries if payload is not None)
+    event_logs = []
+    for event_log, payload in entries:
+        if payload is not None:
+            event_log.payload_id = payload_ids[EventLogPayload.get_digest(payload)]
+        event_logs.append(event_log)
+    return EventLog.objects.bulk_create(event_logs)
+
+
+def save_event_logs(entries):
+    """Writes the entries in the background if EVENT_LOG_ASYNC is set, immediately otherwise."""
+    if settings.EVENT_LOG_ASYNC:
+        from .event_log_writer import get_event_log_writer
+        get_event_log_writer().put(entries)
+    else:
+        write_event_logs(entries)
+
+
+def create_event_log(event_type, event_title, event_data=None, event_target=None, subscriber=None,
+                     information_event=None, ip_address=None, data=None, payload=None):
     """
     Creates an instance of EventLog with the provided details.
 
+    With EVENT_LOG_ASYNC the row is written in the background, in batches, by the EventLogWriter.
+
     Args:
     event_type (str): The type of the event (e.g., EMAIL_SENT, NEWSLETTER_SUBSCRIPTION_CONFIRMED).
     event_title (str): A short title or description of the event.
-    event_data (str): Additional data or details about the event.
+    event_data (str, optional): Additional details about the event, as short text; a text longer than
+        PAYLOAD_THRESHOLD is stored as payload.
     event_target (str, optional): The target or subject of the event. Defaults to None.
+    subscriber (Subscriber or int, optional): The subscriber concerned.
+    information_event (InformationEvent or int, optional): The event concerned.
+    ip_address (str, optional): The IP address of the client.
+    data (dict, optional): Other structured details (JSON serializable).
+    payload (str, optional): Large text (e.g. an email body), stored once and compressed.
 
     Returns:
-    EventLog: The created EventLog instance.
+    EventLog: The created EventLog instance (not yet saved with EVENT_LOG_ASYNC).
     """
     try:
-        event_log = EventLog(
-            event_type=event_type,
-            event_title=event_title,
-            event_data=event_data,
-            event_target=event_target,
-            created_at=timezone.now()
-        )
-        event_log.save()
-        return event_log
+        entry = make_event_log(event_type, event_title, event_data, event_target, subscriber, information_event,
+                               ip_address, data, payload)
+        save_event_logs([entry])
+        return entry[0]
     except Exception as e:
         print(e)
         return None
+
+
+def bulk_create_event_logs(event_logs):
+    """
+    Creates several EventLog instances with a single query.
+
+    Args:
+    event_logs (list): dictionaries with the arguments of create_event_log
+        (event_type, event_title and optionally the others).
+
+    Returns:
+    list: The created EventLog instances (not yet saved with EVENT_LOG_ASYNC).
+    """
+    if not event_logs:
+        return []
+    try:
+        entries = [make_event_log(**event_log) for event_log in event_logs]
+        save_event_logs(entries)
+        return [event_log for event_log, _ in entries]
+    except Exception as e:
+        print(e)
+        return []
@@ -0,0 +1,91 @@
+import re
+
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+MARKER = '\x00mm:{}\x00'
+MARKER_RE = re.compile('\x00mm:([a-z_]+)\x00')
+
+
+class RecipientPlaceholder:
+    """
+    Stands for the recipient while rendering: each field renders as a marker, replaced later.
+
+    With empty=True, each field renders as an empty string instead.
+    """
+
+    def __init__(self, fields, empty=False):
+        self._fields = fields
+        self._empty = empty
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._fields:
+            raise AttributeError(name)
+        return '' if self._empty else MARKER.format(name)
+
+    def __str__(self):
+        return '' if self._empty else MARKER.format('__str__')
+
+
+class MailMerge:
+    """
+    Renders a template for many recipients, where only the fields of the recipient change.
+
+    The template is rendered once with the shared context and a placeholder recipient; the output is split in
+    constant segments and recipient fields, so that each message is a join of strings with the escaped values
+    of the recipient.
+
+    This holds only if the fields are output as they are. The template is also rendered with empty fields: if the
+    output is not the constant segments alone, the fields are used by tags or filters (e.g. {% if subscriber.name %}
+    or {{ subscriber.name|upper }}) and every message is rendered with the template. The uses which give the same
+    output with an empty field and with the marker (e.g. a comparison with a constant) are not detected: the first
+    message is also rendered with the template and compared, but the following recipients are not checked.
+
+    Example:
+        merge = MailMerge('fragment/information_event_send_remainder_it.html', {'event': event, ...})
+        for subscriber in subscribers:
+            body = merge.render(subscriber)
+
+    :param template_name: name of the template
+    :param context: context shared by all the recipients
+    :param recipient_name: name of the recipient in the context of the template
+    :param fields: attributes of the recipient which may be used by the template
+    """
+
+    def __init__(self, template_name, context, recipient_name='subscriber', fields=('name', 'surname', 'email')):
+        self.template_name = template_name
+        self.context = dict(context)
+        self.recipient_name = recipient_name
+        self.fields = fields
+        self.verified = False
+        self.fallback = False
+
+        output = render_to_string(template_name, {**self.context, recipient_name: RecipientPlaceholder(fields)})
+        # even positions: constant text, odd positions: field names
+        self.segments = MARKER_RE.split(output)
+
+        empty_output = render_to_string(template_name,
+                                        {**self.context, recipient_name: RecipientPlaceholder(fields, empty=True)})
+        if empty_output != ''.join(self.segments[0::2]):
+            self.fallback = True
+
+    def merge(self, recipient):
+        segments = self.segments[:]
+        for i in range(1, len(segments), 2):
+            value = recipient if segments[i] == '__str__' else getattr(recipient, segments[i])
+            segments[i] = escape(value)
+        return ''.join(segments)
+
+    def render(self, recipient):
+        """Returns the output of the template for recipient."""
+        if self.fallback:
+            return render_to_string(self.template_name, {**self.context, self.recipient_name: recipient})
+
+        output = self.merge(recipient)
+        if not self.verified:
+            self.verified = True
+            rendered = render_to_string(self.template_name, {**self.context, self.recipient_name: recipient})
+            if rendered != output:
+                self.fallback = True
+                return rendered
+        return output
@@ -1,131 +1,121 @@
-import json
+import time
 
 from django.core.management import BaseCommand
+from django.db import transaction
 
-from registration.logic import create_subscriber
+from registration.json_stream import iter_json_object
 from registration.models import Subscriber
+from registration.subscriber_check import invalidate_subscriber_checks, normalize_pair
+
+BATCH_SIZE = 1000
+
+
+def read_dump_records(file_path):
+    """Yields (key, matricola, email, surname, name) of the records of the persons dump."""
+    for k, v in iter_json_object(file_path):
+        yield k, v[0], v[1], v[3], v[4]
+
+
+def batches(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class Command(BaseCommand):
+    help = 'Import the subscribers from the HR persons dump: create the new ones, update the names ' \
+           'and disable the ones no longer in the dump.'
+
     def add_arguments(self, parser):
-        # parser.add_argument("file_path1", type=str,)
         parser.add_argument("file_path2", type=str,)
 
         # optional argument '--reset'
         parser.add_argument("--reset", action="store_true", help="Reset the database before importing the data.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the changes, do not apply them.")
 
     def handle(self, *args, **options):
+        verbosity = options["verbosity"]
+        dry_run = options["dry_run"]
+        start = time.perf_counter()
 
         # if the '--reset' option is provided, delete all the existing subscribers
-        if options["reset"]:
-            print("Deleting all the existing subscribers...")
+        if options["reset"] and not dry_run:
+            self.stdout.write("Deleting all the existing subscribers...")
             Subscriber.objects.all().delete()
-            print("All the existing subscribers have been deleted.")
-
-        # file_path1 = options["file_path1"]
-        file_path2 = options["file_path2"]
-
-        # with open(file_path1, "r") as file:
-        #     # read json from file
-        #     json_str1 = file.read()
-        #
-        #     # parse json string
-        #     data1 = json.loads(json_str1)
-
-        # print(data1)
-
-        with open(file_path2, "r") as file:
-            # read json from file
-            json_str2 = file.read()
-
-            # parse json string
-            data2 = json.loads(json_str2)
-
-        # print(data2)
-
-        counter = 0
-
+            self.stdout.write("All the existing subscribers have been deleted.")
+
+        # (matricola, email) as normalize_pair returns it -> (id, surname, name, enabled): the database ignored the
+        # case and the trailing spaces when the subscribers were looked up one at a time
+        existing = {
+            normalize_pair(matricola, email): (pk, surname, name, enabled)
+            for pk, matricola, email, surname, name, enabled in
+            Subscriber.objects.values_list('id', 'matricola', 'email', 'surname', 'name', 'enabled').iterator()
+        }
+        loaded = time.perf_counter()
+
+        to_create = {}
+        to_update = {}
+        dump_matricole = set()
         not_valid = {}
 
-        matricola_email = {}
-
-        for k, v in data2.items():
-
-            print(f"key: {k}")
-            print(f"value: {v}")
-
-            matricola = v[0]
-            email = v[1]
-            surname = v[3]
-            name = v[4]
-
-            matricola_email[matricola] = email
-
-            print()
-            print(f"matricola: {matricola}")
-            print(f"email: {email}")
-            print(f"surname: {surname}")
-            print(f"name: {name}")
-            print()
+        for k, matricola, email, surname, name in read_dump_records(options["file_path2"]):
+            dump_matricole.add(str(matricola).strip())
 
             if not email:
-                print(f"Skipping subscriber with  key={k} matricola: {matricola} and email: {email}.")
-                print("***")
-                print()
-
-                not_valid[k] = v
-                continue
-
-            # check if an instance of Subscriber with the same matricola and email already exists
-
-            if Subscriber.objects.filter(matricola=matricola, email=email).exists():
-                print(f"Subscriber with matricola: {matricola} and email: {email} already exists.")
-                print("***")
-                print()
+                if verbosity >= 2:
+                    self.stdout.write(f"Skipping subscriber with key={k} matricola: {matricola} and email: {email}.")
+                not_valid[k] = matricola
                 continue
 
-            # if not, create a new instance of Subscriber
-            create_subscriber(email, name, surname, matricola)
-
-            print(f"Subscriber with matricola: {matricola} and email: {email} created.")
-            print("***")
-            print()
-
-            counter += 1
-
-        print(f"Total subscribers created: {counter}")
-
-        print()
-
-        print(not_valid)
-
-        print()
-
-        print("*************")
-
-        # now check that each Subscriber instance exists in the data2 dictionary
-
-        counter = 0
-
-        for subscriber in Subscriber.objects.all():
-            matricola = subscriber.matricola
-            email = subscriber.email
-
-            if not subscriber.enabled:
-                continue
-
-            if matricola not in matricola_email:
-                print(f"Subscriber with matricola: {matricola} and email: {email} not found in matricola_email.")
-                counter += 1
-
-                subscriber.enabled = False
-                subscriber.save()
-            else:
-                # print(f"Subscriber with matricola: {matricola} and email: {email} found in matricola_email.")
-                continue
-
-        print(f"Total subscribers not found in matricola_email: {counter}")
-        print("*************")
-
-
-
+            key = normalize_pair(str(matricola), email)
+            if key in existing:
+                pk, old_surname, old_name, enabled = existing[key]
+                if (old_surname, old_name) != (surname, name):
+                    to_update[pk] = Subscriber(id=pk, surname=surname, name=name)
+                    if verbosity >= 2:
+                        self.stdout.write(f"Update matricola: {matricola} email: {email}: "
+                                          f"{old_name} {old_surname} -> {name} {surname}")
+            elif key not in to_create:
+                to_create[key] = Subscriber(email=email, name=name, surname=surname, matricola=matricola)
+                if verbosity >= 2:
+                    self.stdout.write(f"Create matricola: {matricola} email: {email} {name} {surname}")
+
+        # enabled subscribers whose matricola is not in the dump anymore; disabled ones are never re-enabled
+        to_disable = []
+        for (matricola, email), (pk, surname, name, enabled) in existing.items():
+            if enabled and matricola not in dump_matricole:
+                to_disable.append(pk)
+                if verbosity >= 2:
+                    self.stdout.write(f"Disable matricola: {matricola} email: {email}")
+
+        diffed = time.perf_counter()
+
+        summary = f"existing subscribers: {len(existing)}, records in the dump: {len(dump_matricole)}, " \
+                  f"without email: {len(not_valid)}, to create: {len(to_create)}, to update: {len(to_update)}, " \
+                  f"to disable: {len(to_disable)}"
+        self.stdout.write(summary)
+
+        if dry_run:
+            if verbosity == 1:
+                for matricola, email in to_create:
+                    self.stdout.write(f"+ {matricola} {email}")
+                for pk in to_update:
+                    self.stdout.write(f"~ subscriber #{pk}")
+                for pk in to_disable:
+                    self.stdout.write(f"- subscriber #{pk}")
+            self.stdout.write(self.style.WARNING("Dry run: no changes applied."))
+        else:
+            with transaction.atomic():
+                Subscriber.objects.bulk_create(to_create.values(), batch_size=BATCH_SIZE)
+                Subscriber.objects.bulk_update(to_update.values(), ['surname', 'name'], batch_size=BATCH_SIZE)
+                for batch in batches(to_disable):
+                    Subscriber.objects.filter(id__in=batch).update(enabled=False)
+            # the bulk operations do not send the signals which invalidate the cached checks
+            invalidate_subscriber_checks()
+            self.stdout.write(self.style.SUCCESS(
+                f"Total subscribers created: {len(to_create)}, updated: {len(to_update)}, "
+                f"disabled: {len(to_disable)}"))
+
+        end = time.perf_counter()
+        self.stdout.write(f"Timing: load existing {loaded - start:.2f} s, parse and diff {diffed - loaded:.2f} s, "
+                          f"apply {end - diffed:.2f} s, total {end - start:.2f} s")
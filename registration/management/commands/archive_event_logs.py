@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from mediamatrixhub.settings import EVENT_LOG_ARCHIVE_DIR
+from registration.models import EventLog, EventLogPayload
+
+FIELDS = ('id', 'created_at', 'event_type', 'event_title', 'event_data', 'event_target', 'subscriber_id',
+          'information_event_id', 'ip_address', 'data')
+
+
+def get_archive_path(output_dir, month):
+    """event_log_YYYY-MM.jsonl.gz, or event_log_YYYY-MM.N.jsonl.gz if the month has already been archived."""
+    path = os.path.join(output_dir, f"event_log_{month:%Y-%m}.jsonl.gz")
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(output_dir, f"event_log_{month:%Y-%m}.{counter}.jsonl.gz")
+        counter += 1
+    return path
+
+
+def next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+class Command(BaseCommand):
+    help = 'Export the EventLog rows older than --days to a gzipped JSONL file for each month, then delete them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='Archive the rows older than DAYS days')
+        parser.add_argument('--output-dir', default=EVENT_LOG_ARCHIVE_DIR, help='Directory of the archive files')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows read and deleted at a time')
+        parser.add_argument('--keep', action='store_true', help='Export the rows without deleting them')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows to be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        old_logs = EventLog.objects.filter(created_at__lt=cutoff)
+
+        months = list(old_logs.datetimes('created_at', 'month'))
+        if not months:
+            self.stdout.write(f"No event logs older than {cutoff:%Y-%m-%d}.")
+            return
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+        total = 0
+        for month in months:
+            month_logs = old_logs.filter(created_at__gte=month, created_at__lt=next_month(month))
+
+            if options['dry_run']:
+                count = month_logs.count()
+                self.stdout.write(f"{month:%Y-%m}: {count} rows")
+                total += count
+                continue
+
+            path = get_archive_path(options['output_dir'], month)
+            temp_path = path + '.tmp'
+            count = 0
+            last_id = 0
+            with open(temp_path, 'wb') as raw:
+                with gzip.open(raw, 'wt', encoding='utf-8') as f:
+                    # keyset pagination on the id: each batch is a short indexed query
+                    while True:
+                        batch = list(month_logs.filter(id__gt=last_id).order_by('id')
+                                     .select_related('payload')[:batch_size])
+                        if not batch:
+                            break
+                        for event_log in batch:
+                            row = {field: getattr(event_log, field) for field in FIELDS}
+                            row['payload'] = event_log.payload.get_text() if event_log.payload_id else None
+                            f.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+                            f.write('\n')
+                        count += len(batch)
+                        last_id = batch[-1].id
+                raw.flush()
+                os.fsync(raw.fileno())
+            os.replace(temp_path, path)
+            total += count
+            self.stdout.write(f"{month:%Y-%m}: {count} rows archived to {path}")
+
+            if not options['keep']:
+                # only the exported rows: the ids are increasing, rows written meanwhile have greater ids
+                exported = month_logs.filter(id__lte=last_id)
+                while True:
+                    ids = list(exported.values_list('id', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    EventLog.objects.filter(id__in=ids).delete()
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Dry run: {total} rows to be archived."))
+            return
+
+        deleted_payloads = 0
+        if not options['keep']:
+            # payloads no longer referenced; the recent ones may belong to logs still being written
+            deleted_payloads, _ = EventLogPayload.objects.filter(
+                eventlog__isnull=True, created_at__lt=timezone.now() - timedelta(hours=1)).delete()
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} rows, deleted {deleted_payloads} payloads."))
@@ -0,0 +1,78 @@
+import json
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand
+from django.test import RequestFactory
+
+from mediamatrixhub.settings import WS_SRC_IP_ALLOWED
+from registration.event_log_writer import get_event_log_writer
+from registration.models import Subscriber, EventLog
+from registration.subscriber_check import invalidate_subscriber_checks, MAX_BATCH_SIZE
+from registration.views import CheckSubscriberView, CheckSubscribersView
+
+MATRICOLA_PREFIX = 'checktest-'
+# the logs written by the benchmark, deleted at the end
+LOG_TYPES = (EventLog.LOGIN_SUCCESS_JSON, EventLog.LOGIN_FAILED_JSON, EventLog.LOGIN_FAILED_JSON_USER_DISABLED,
+             EventLog.CHECK_SUBSCRIBERS_JSON)
+
+
+class Command(BaseCommand):
+    help = 'Measure the lookups per second of check-subscriber (uncached and cached) and check-subscribers ' \
+           'on temporary subscribers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=1000, help='Number of temporary subscribers')
+        parser.add_argument('--keep', action='store_true', help='Do not delete the temporary subscribers')
+
+    def handle(self, *args, **options):
+        Subscriber.objects.bulk_create([
+            Subscriber(email=f'{MATRICOLA_PREFIX}{i}@example.org', name='Check', surname=f'Test {i}',
+                       matricola=f'{MATRICOLA_PREFIX}{i}')
+            for i in range(options['subscribers'])
+        ])
+        pairs = [(f'{MATRICOLA_PREFIX}{i}', f'{MATRICOLA_PREFIX}{i}@example.org')
+                 for i in range(options['subscribers'])]
+        # every fourth lookup is of an unknown subscriber
+        pairs = [(matricola, email if i % 4 else 'unknown@example.org') for i, (matricola, email) in enumerate(pairs)]
+
+        factory = RequestFactory()
+        remote_ip = WS_SRC_IP_ALLOWED[0] if WS_SRC_IP_ALLOWED else ''
+        single_view = CheckSubscriberView.as_view()
+        batch_view = CheckSubscribersView.as_view()
+        first_log_id = EventLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        try:
+            def run_single():
+                start = time.perf_counter()
+                for matricola, email in pairs:
+                    request = factory.get('/check-subscriber/', {'matricola': matricola, 'email': email},
+                                          HTTP_X_REAL_IP=remote_ip)
+                    request.user = AnonymousUser()
+                    response = single_view(request)
+                    assert response.status_code == 200, response.content
+                return len(pairs) / (time.perf_counter() - start)
+
+            def run_batch():
+                start = time.perf_counter()
+                for i in range(0, len(pairs), MAX_BATCH_SIZE):
+                    body = json.dumps({'subscribers': [{'matricola': matricola, 'email': email}
+                                                       for matricola, email in pairs[i:i + MAX_BATCH_SIZE]]})
+                    request = factory.post('/check-subscribers/', body, content_type='application/json',
+                                           HTTP_X_REAL_IP=remote_ip)
+                    request.user = AnonymousUser()
+                    response = batch_view(request)
+                    assert response.status_code == 200, response.content
+                return len(pairs) / (time.perf_counter() - start)
+
+            invalidate_subscriber_checks()
+            self.stdout.write(f"check-subscriber, uncached: {run_single():.0f} lookups/s")
+            self.stdout.write(f"check-subscriber, cached: {run_single():.0f} lookups/s")
+            invalidate_subscriber_checks()
+            self.stdout.write(f"check-subscribers, uncached: {run_batch():.0f} lookups/s")
+            self.stdout.write(f"check-subscribers, cached: {run_batch():.0f} lookups/s")
+        finally:
+            if not options['keep']:
+                Subscriber.objects.filter(matricola__startswith=MATRICOLA_PREFIX).delete()
+                get_event_log_writer().flush()
+                EventLog.objects.filter(id__gt=first_log_id, event_type__in=LOG_TYPES).delete()
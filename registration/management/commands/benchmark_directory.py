@@ -0,0 +1,102 @@
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from django.core.management import BaseCommand
+
+from registration.directory import OrganisationDirectory, PERSONS_FILE, STRUCTURES_FILE, SNAPSHOT_FILE, MATRICOLA, \
+    EMAIL, build_snapshot
+
+
+def get_rss_mb():
+    """Returns the resident memory of the process in MB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak, in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_synthetic_dumps(directory, number_of_persons, number_of_structures):
+    """Writes dumps with the same layout of the HR ones; returns (persons file, structures file)."""
+    structures = {'S0': ['Root', '', '', 'S0']}
+    for i in range(1, number_of_structures):
+        structures[f'S{i}'] = [f'Structure {i}', '', '', f'S{random.randrange(i)}']
+
+    persons = {}
+    for i in range(number_of_persons):
+        matricola = f'{i:06d}'
+        persons[f'person {i}'] = [matricola, f'person{i}@example.org', '', f'Surname{i}', f'Name{i}',
+                                  f'UAF{i % 100}', f'S{random.randrange(number_of_structures)}']
+
+    persons_file = os.path.join(directory, 'persons.json')
+    structures_file = os.path.join(directory, 'structures.json')
+    with open(persons_file, 'w', encoding='utf-8') as f:
+        json.dump(persons, f)
+    with open(structures_file, 'w', encoding='utf-8') as f:
+        json.dump(structures, f)
+    return persons_file, structures_file
+
+
+class Command(BaseCommand):
+    help = 'Measure the load time, the lookups per second and the memory of the organisation directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=100000, help='Number of lookups of each kind')
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Use synthetic dumps with this number of persons instead of the real ones')
+        parser.add_argument('--structures', type=int, default=2000,
+                            help='Number of structures of the synthetic dumps')
+        parser.add_argument('--snapshot', action='store_true',
+                            help='Query the SQLite snapshot (built first for synthetic dumps) instead of the JSON dumps')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if options['synthetic']:
+                persons_file, structures_file = write_synthetic_dumps(tmp_dir, options['synthetic'],
+                                                                      options['structures'])
+                snapshot_file = os.path.join(tmp_dir, 'snapshot.sqlite3')
+                if options['snapshot']:
+                    build_snapshot(persons_file, structures_file, snapshot_file)
+            else:
+                persons_file, structures_file, snapshot_file = PERSONS_FILE, STRUCTURES_FILE, SNAPSHOT_FILE
+
+            rss_before = get_rss_mb()
+            start = time.perf_counter()
+            directory = OrganisationDirectory(persons_file, structures_file,
+                                              snapshot_file if options['snapshot'] else None)
+            index = directory.index
+            number_of_persons, number_of_structures = index.get_size()
+            self.stdout.write(f"Loaded {number_of_persons} persons and {number_of_structures} structures "
+                              f"({type(index).__name__}) in {time.perf_counter() - start:.2f} s, "
+                              f"RSS {rss_before:.1f} -> {get_rss_mb():.1f} MB")
+
+            records = list(index.get_persons().values())
+            if not records:
+                self.stdout.write(self.style.WARNING("The dumps are empty: nothing to measure."))
+                return
+
+            sample = [random.choice(records) for _ in range(options['lookups'])]
+            uafs = list(index.get_structures().keys()) or [None]
+            sample_uafs = [random.choice(uafs) for _ in range(min(options['lookups'], 1000))]
+
+            self.measure('matricola', directory.get_person_by_matricola, [r[MATRICOLA] for r in sample])
+            self.measure('email', directory.get_person_by_email, [r[EMAIL] for r in sample])
+            self.measure('sub-structures', directory.get_sub_structures, sample_uafs)
+            self.measure('people in subtree', directory.get_people_in_subtree, sample_uafs)
+
+            self.stdout.write(f"RSS at the end: {get_rss_mb():.1f} MB")
+
+    def measure(self, label, lookup, keys):
+        start = time.perf_counter()
+        for key in keys:
+            lookup(key)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{label}: {len(keys)} lookups in {elapsed:.3f} s, {len(keys) / elapsed:,.0f} lookups/s")
@@ -0,0 +1,76 @@
+import time
+
+from django.core.management import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from mediamatrixhub.email_utils import MyTemporaryFile, EmailMessageBuilder, build_email_message
+from mediamatrixhub.settings import REGISTRATION_URL, VIDEOTECA_URL, TECHNICAL_CONTACT_EMAIL, TECHNICAL_CONTACT
+from registration.mail_merge import MailMerge
+from registration.models import InformationEvent, Subscriber
+
+TEMPLATE_NAME = 'fragment/information_event_send_remainder_it.html'
+
+
+class Command(BaseCommand):
+    help = 'Compare the generation of the reminder messages rendering the template for each recipient ' \
+           'and with the mail merge (nothing is saved nor sent).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=5000, help='Number of recipients')
+        parser.add_argument('--attachments', type=int, default=1, help='Number of ICS attachments of each message')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        event = InformationEvent(
+            id=1, title='Benchmark', description='Lorem ipsum dolor sit amet. ' * 20, event_date=now.date(),
+            event_start_time=now.time(), event_end_time=now.time(), meeting_url='https://example.org/meeting',
+            speaker='Speaker', updated_at=now,
+        )
+        # names with characters to be escaped, to check that both ways give the same output
+        recipients = [Subscriber(id=i, name=f"Nome{i} D'Amico", surname=f'Cognome <{i}> & C.',
+                                 email=f'subscriber{i}@example.org') for i in range(options['recipients'])]
+        attachments = [MyTemporaryFile(f'event{i}.ics', event.generate_ics_content())
+                       for i in range(options['attachments'])]
+        shared_context = {
+            'event': event,
+            'APPLICATION_TITLE': 'Media Matrix Hub',
+            'TECHNICAL_CONTACT_EMAIL': TECHNICAL_CONTACT_EMAIL,
+            'TECHNICAL_CONTACT': TECHNICAL_CONTACT,
+            'REGISTRATION_URL': REGISTRATION_URL,
+            'VIDEOTECA_URL': VIDEOTECA_URL,
+            'tomorrow_str': 'domani',
+        }
+
+        # before: the event table and the template rendered, the attachments encoded, for each recipient
+        start = time.perf_counter()
+        rendered = []
+        for subscriber in recipients:
+            rendered.append(render_to_string(TEMPLATE_NAME, {**shared_context, 'subscriber': subscriber,
+                                                             'event_html_table': event.render_html_table_email()}))
+        before_bodies = time.perf_counter() - start
+        for subscriber, body in zip(recipients, rendered):
+            build_email_message('from@example.org', [subscriber.email], 'Promemoria', body,
+                                attachments=attachments).as_bytes()
+        before = time.perf_counter() - start
+
+        # after: rendered once per event, recipient fields substituted, headers and attachment parts shared
+        start = time.perf_counter()
+        merge = MailMerge(TEMPLATE_NAME, {**shared_context, 'event_html_table': event.render_html_table_email()})
+        merged = [merge.render(subscriber) for subscriber in recipients]
+        after_bodies = time.perf_counter() - start
+        builder = EmailMessageBuilder('from@example.org', 'Promemoria', attachments)
+        for subscriber, body in zip(recipients, merged):
+            builder.build([subscriber.email], body).as_bytes()
+        after = time.perf_counter() - start
+
+        count = len(recipients)
+        self.stdout.write(f"render per recipient: bodies {before_bodies:.2f} s, with MIME {before:.2f} s, "
+                          f"{count / before:.0f} messages/s")
+        self.stdout.write(f"mail merge: bodies {after_bodies:.2f} s ({before_bodies / after_bodies:.0f}x), "
+                          f"with MIME {after:.2f} s, {count / after:.0f} messages/s ({before / after:.1f}x, "
+                          f"fallback {merge.fallback})")
+        if rendered == merged:
+            self.stdout.write(self.style.SUCCESS("OK: identical bodies"))
+        else:
+            self.stdout.write(self.style.ERROR("FAILED: the bodies differ"))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management import BaseCommand
+
+from registration.directory import build_snapshot, PERSONS_FILE, STRUCTURES_FILE, SNAPSHOT_FILE
+
+
+class Command(BaseCommand):
+    help = 'Convert the HR JSON dumps into the SQLite snapshot queried by the organisation directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--persons', default=PERSONS_FILE, help='Path of persfvg_dump_persone_entita.json')
+        parser.add_argument('--structures', default=STRUCTURES_FILE, help='Path of persfvg_dump_final.json')
+        parser.add_argument('--output', default=SNAPSHOT_FILE, help='Path of the snapshot to be written')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        number_of_persons, number_of_structures = build_snapshot(options['persons'], options['structures'],
+                                                                 options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshot {options['output']} written: {number_of_persons} persons, {number_of_structures} structures "
+            f"in {time.perf_counter() - start:.2f} s"))
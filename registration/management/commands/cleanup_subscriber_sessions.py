@@ -0,0 +1,57 @@
+from django.contrib.sessions.models import Session
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from registration.subscriber_session import get_mode, SESSION_DB
+
+# the keys of the session data of an admin login
+AUTH_KEYS = ('_auth_user_id',)
+
+
+class Command(BaseCommand):
+    help = 'Delete the rows of the session table left by the subscriber logins: the expired ones, the logged out ' \
+           'ones and, unless REGISTRATION_SESSION_MODE is "db", all the others. The admin sessions are kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Sessions read and deleted at a time')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the sessions to be deleted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # with the db mode the sessions of the logged subscribers are still in use
+        delete_logged = get_mode() != SESSION_DB
+        now = timezone.now()
+
+        counts = {'expired': 0, 'logged out': 0, 'subscriber': 0, 'kept': 0}
+        last_key = ''
+        while True:
+            # keyset pagination on the primary key: each batch is a short indexed query
+            batch = list(Session.objects.filter(session_key__gt=last_key).order_by('session_key')[:batch_size])
+            if not batch:
+                break
+            last_key = batch[-1].session_key
+
+            to_delete = []
+            for session in batch:
+                if session.expire_date < now:
+                    reason = 'expired'
+                else:
+                    data = session.get_decoded()
+                    if any(key in data for key in AUTH_KEYS) or 'subscriber_id' not in data:
+                        reason = 'kept'
+                    elif not data['subscriber_id']:
+                        reason = 'logged out'
+                    elif delete_logged:
+                        reason = 'subscriber'
+                    else:
+                        reason = 'kept'
+                counts[reason] += 1
+                if reason != 'kept':
+                    to_delete.append(session.session_key)
+
+            if to_delete and not options['dry_run']:
+                Session.objects.filter(session_key__in=to_delete).delete()
+
+        action = 'to be deleted' if options['dry_run'] else 'deleted'
+        deleted = ', '.join(f"{counts[reason]} {reason}" for reason in ('expired', 'logged out', 'subscriber'))
+        self.stdout.write(self.style.SUCCESS(f"Sessions {action}: {deleted}; kept: {counts['kept']}"))
@@ -0,0 +1,49 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand
+
+from registration.models import EmailOutbox
+from registration.outbox import OutboxDelivery, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = 'Send the due messages of the email outbox, retrying the failed ones with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Number of threads sending the messages')
+        parser.add_argument('--per-host', type=int, default=4,
+                            help='Maximum number of messages sent concurrently to the same SMTP host')
+        parser.add_argument('--batch-size', type=int, default=200, help='Number of messages claimed at a time')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help='Number of attempts after which a message is marked as failed')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between two polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            delivery = OutboxDelivery(workers=options['workers'], per_host=options['per_host'],
+                                      max_attempts=options['max_attempts'])
+            processed = delivery.run(batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - start
+
+            if processed or not options['loop']:
+                self.report(delivery, processed, elapsed)
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def report(self, delivery, processed, elapsed):
+        self.stdout.write(f"Processed {processed} messages in {elapsed:.2f} s: sent {delivery.sent}, "
+                          f"to be retried {delivery.retried}, failed {delivery.failed}")
+        if delivery.latencies:
+            latencies = sorted(delivery.latencies)
+            self.stdout.write(f"delivery latency s: p50 {statistics.median(latencies):.1f}, "
+                              f"p95 {latencies[max(int(len(latencies) * 0.95) - 1, 0)]:.1f}, "
+                              f"max {latencies[-1]:.1f}")
+        pending = EmailOutbox.objects.filter(status__in=[EmailOutbox.PENDING, EmailOutbox.SENDING]).count()
+        if pending:
+            self.stdout.write(self.style.WARNING(f"{pending} messages still waiting in the outbox"))
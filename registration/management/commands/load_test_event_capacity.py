@@ -0,0 +1,89 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+
+from registration.capacity import reserve_seat
+from registration.models import InformationEvent, Subscriber, EventParticipation, EventCapacity
+
+MATRICOLA_PREFIX = 'loadtest-'
+
+
+class Command(BaseCommand):
+    help = 'Simulate a burst of concurrent subscriptions to a test event and check that it is never oversubscribed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=300, help='Number of concurrent subscriptions')
+        parser.add_argument('--max-participants', type=int, default=100, help='Seats of the test event')
+        parser.add_argument('--threads', type=int, default=50, help='Number of concurrent threads')
+        parser.add_argument('--keep', action='store_true', help='Do not delete the test event and subscribers')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        event = InformationEvent.objects.create(
+            title='Load test', event_date=now.date(), event_start_time=now.time(), meeting_url='https://example.org/',
+            speaker='load test', enabled=False, max_participants=options['max_participants'],
+        )
+        subscribers = Subscriber.objects.bulk_create([
+            Subscriber(email=f'{MATRICOLA_PREFIX}{i}@example.org', name='Load', surname=f'Test {i}',
+                       matricola=f'{MATRICOLA_PREFIX}{i}')
+            for i in range(options['subscribers'])
+        ])
+        subscriber_ids = list(Subscriber.objects.filter(matricola__startswith=MATRICOLA_PREFIX)
+                              .values_list('id', flat=True)[:len(subscribers)])
+
+        start_signal = threading.Event()
+
+        def subscribe(subscriber_id):
+            start_signal.wait()
+            start = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    if not reserve_seat(event):
+                        return False, time.perf_counter() - start
+                    # bulk_create: the seat is already counted by reserve_seat
+                    EventParticipation.objects.bulk_create([EventParticipation(event=event,
+                                                                               subscriber_id=subscriber_id)])
+                return True, time.perf_counter() - start
+            except DatabaseError as e:
+                return e, time.perf_counter() - start
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            futures = [executor.submit(subscribe, subscriber_id) for subscriber_id in subscriber_ids]
+            burst_start = time.perf_counter()
+            start_signal.set()
+            results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - burst_start
+
+        accepted = sum(1 for result, _ in results if result is True)
+        rejected = sum(1 for result, _ in results if result is False)
+        errors = [result for result, _ in results if isinstance(result, Exception)]
+        latencies = sorted(latency for _, latency in results)
+
+        participations = EventParticipation.objects.filter(event=event).count()
+        taken = EventCapacity.objects.get(event=event).taken
+
+        self.stdout.write(f"{len(results)} subscriptions in {elapsed:.2f} s with {options['threads']} threads: "
+                          f"accepted {accepted}, rejected {rejected}, errors {len(errors)}")
+        if errors:
+            self.stdout.write(self.style.WARNING(f"first error: {errors[0]}"))
+        self.stdout.write(f"latency ms: p50 {statistics.median(latencies) * 1000:.1f}, "
+                          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}, "
+                          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}, "
+                          f"max {latencies[-1] * 1000:.1f}")
+        self.stdout.write(f"seats {options['max_participants']}, counter {taken}, participations {participations}")
+
+        if participations > options['max_participants'] or taken != participations:
+            self.stdout.write(self.style.ERROR("FAILED: the event has been oversubscribed or the counter is wrong"))
+        else:
+            self.stdout.write(self.style.SUCCESS("OK: no oversubscription"))
+
+        if not options['keep']:
+            event.delete()
+            Subscriber.objects.filter(id__in=subscriber_ids).delete()
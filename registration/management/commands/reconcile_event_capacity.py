@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand, CommandError
+
+from registration.capacity import reconcile_capacities
+from registration.models import InformationEvent
+
+
+class Command(BaseCommand):
+    help = 'Recompute the seats taken (the participation counts) of the events from their participations and ' \
+           'fix the counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', default=[], help='Id of the event (can be repeated)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the counters which differ')
+        parser.add_argument('--check', action='store_true',
+                            help='Like --dry-run, but exit with an error if a counter differs (e.g. for monitoring)')
+
+    def handle(self, *args, **options):
+        events = InformationEvent.objects.all()
+        if options['event']:
+            events = events.filter(id__in=options['event'])
+
+        dry_run = options['dry_run'] or options['check']
+        differences = reconcile_capacities(events, dry_run=dry_run)
+
+        for event_id, taken, actual in differences:
+            self.stdout.write(self.style.WARNING(f"event #{event_id}: counter {taken}, participations {actual}"))
+
+        if options['check'] and differences:
+            raise CommandError(f"Counters which differ: {len(differences)}")
+
+        action = 'found' if dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f"Counters {action}: {len(differences)}"))
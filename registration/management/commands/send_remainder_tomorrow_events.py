@@ -1,13 +1,12 @@
 from datetime import timedelta
 
 from django.core.management import BaseCommand
-from django.template.loader import render_to_string
 from django.utils import timezone, formats
 
-from mediamatrixhub.email_utils import my_send_email
 from mediamatrixhub.settings import REGISTRATION_URL, SUBJECT_EMAIL, DEBUG_EMAIL, TECHNICAL_CONTACT_EMAIL, \
     TECHNICAL_CONTACT, VIDEOTECA_URL, FROM_EMAIL, EMAIL_HOST
-from registration.logic import create_event_log
+from registration.mail_merge import MailMerge
+from registration.outbox import make_outbox_message, enqueue_emails, enqueue_email, deliver_outbox
 from registration.models import InformationEvent, Subscriber, EventLog
 
 
@@ -19,6 +18,9 @@ class Command(BaseCommand):
         parser.add_argument('--debug', action='store_true', help='Debug mode')
         # add optional argument 'days' to specify the number of days to look ahead
         parser.add_argument('--days', type=int, help='Number of days to look ahead')
+        parser.add_argument('--workers', type=int, default=8, help='Number of threads delivering the outbox')
+        parser.add_argument('--no-deliver', dest='deliver', action='store_false',
+                            help='Only enqueue the messages, leaving the delivery to deliver_outbox')
 
     def handle(self, *args, **options):
         debug_mode = options['debug']
@@ -65,73 +67,65 @@ class Command(BaseCommand):
                 continue
 
             counter = 0
+            messages = []
+
+            # the event part of the message is rendered once, only the subscriber fields change
+            context = {
+                'event': event,
+                'event_html_table': event.to_html_table_email(),
+                'APPLICATION_TITLE': 'Media Matrix Hub',
+                'TECHNICAL_CONTACT_EMAIL': TECHNICAL_CONTACT_EMAIL,
+                'TECHNICAL_CONTACT': TECHNICAL_CONTACT,
+                'REGISTRATION_URL': REGISTRATION_URL,
+                'VIDEOTECA_URL': VIDEOTECA_URL,
+                'tomorrow_str': tomorrow_str,
+            }
+            merge = MailMerge('fragment/information_event_send_remainder_it.html', context)
+
+            message_subject = f'{SUBJECT_EMAIL} Promemoria per la prossima pillola informativa'
 
             # self.stdout.write(self.style.SUCCESS('Subscribers for this event:'))
             for subscriber in subscribers_for_event:
                 self.stdout.write(f"Subscriber: {subscriber.name} {subscriber.surname}, {subscriber.email}")
 
-                context = {
-                    'subscriber': subscriber,
-                    'event': event,
-                    'event_html_table': event.to_html_table_email(),
-                    'APPLICATION_TITLE': 'Media Matrix Hub',
-                    'TECHNICAL_CONTACT_EMAIL': TECHNICAL_CONTACT_EMAIL,
-                    'TECHNICAL_CONTACT': TECHNICAL_CONTACT,
-                    'REGISTRATION_URL': REGISTRATION_URL,
-                    'VIDEOTECA_URL': VIDEOTECA_URL,
-                    'tomorrow_str': tomorrow_str,
-                }
-
-                message_body = render_to_string('fragment/information_event_send_remainder_it.html', context)
-
-                message_subject = f'{SUBJECT_EMAIL} Promemoria per la prossima pillola informativa'
+                message_body = merge.render(subscriber)
 
                 if not debug_mode:
-                    try:
-
-                        my_send_email(
-                            FROM_EMAIL,
-                            [subscriber.email],
-                            message_subject,
-                            message_body,
-                            bcc_addresses=None,
-                            attachments=None,
-                            email_host=EMAIL_HOST
-                        )
-
-                        create_event_log(
-                            event_type=EventLog.REMAINDER_EMAIL_SENT,
-                            event_title=message_subject,
-                            event_data=f"subscriber: {subscriber} email: {subscriber.email} {message_body}",
-                            event_target=subscriber.email,
-                        )
-                        self.stdout.write(self.style.SUCCESS(f"Email sent to {subscriber.email}"))
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"Error sending email to {subscriber.email}: {e}"))
-
-                        create_event_log(EventLog.ERROR_SENDING_EMAIL,
-                                         f"Error sending email to {subscriber.email}",
-                                         f"Error sending email to {subscriber.email}: {e}",
-                                         subscriber.email)
+                    # the key makes a second run of the command on the same day harmless
+                    messages.append(make_outbox_message(
+                        FROM_EMAIL,
+                        [subscriber.email],
+                        message_subject,
+                        message_body,
+                        email_host=EMAIL_HOST,
+                        idempotency_key=f"reminder:{event.id}:{event.event_date}:{subscriber.id}",
+                        log_event_type=EventLog.REMAINDER_EMAIL_SENT,
+                    ))
                 else:
                     self.stdout.write(f"debug mode: fake sending email to {subscriber.email}")
                     self.stdout.write(f"message: {message_body}  (debug mode)")
 
                 counter += 1
 
-            self.stdout.write(self.style.SUCCESS(f"Email sent to {counter} subscribers for event {event.title}"))
+            queued = enqueue_emails(messages)
+            self.stdout.write(f"{queued} reminders added to the outbox ({len(messages) - queued} already there)")
+
+            self.stdout.write(self.style.SUCCESS(f"Email queued for {counter} subscribers for event {event.title}"))
 
             message_subject = f'{SUBJECT_EMAIL} Resoconto invio email promemoria per la prossima pillola informativa'
             message_body = f'Promemoria inviato a {counter} iscritti per l\'evento {event.title} del {tomorrow_str}.'
 
-            my_send_email(
+            enqueue_email(
                 FROM_EMAIL,
                 [DEBUG_EMAIL],
                 message_subject,
                 message_body,
-                bcc_addresses=None,
-                attachments=None,
                 email_host=EMAIL_HOST
             )
 
+        if not debug_mode and options['deliver']:
+            delivery = deliver_outbox(workers=options['workers'])
+            self.stdout.write(f"Outbox: sent {delivery.sent}, to be retried {delivery.retried}, "
+                              f"failed {delivery.failed}")
+
         self.stdout.write(self.style.SUCCESS('Done.'))
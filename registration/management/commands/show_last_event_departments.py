@@ -1,6 +1,3 @@
-import json
-import os
-
 from django.core.management.base import BaseCommand
 from django.db.models import Count
 from django.utils import formats, timezone
@@ -8,19 +5,7 @@ from django.utils import formats, timezone
 from mediamatrixhub.email_utils import my_send_email
 from mediamatrixhub.settings import SUBJECT_EMAIL, MONITOR_EMAIL_ADDRESSES, FROM_EMAIL, EMAIL_HOST
 from registration.models import InformationEvent
-
-
-def read_json_file(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        data = json.load(file)
-    return data
-
-
-def lookup_email(data, email):
-    for person, details in data.items():
-        if details[1] == email:
-            return details[6]
-    return None
+from registration.reports import participants_by_structure, UNKNOWN_STRUCTURE
 
 
 class Command(BaseCommand):
@@ -29,50 +14,55 @@ class Command(BaseCommand):
     # parse parameters
     def add_arguments(self, parser):
         parser.add_argument('--send_email', action='store_true', help='Send email to subscribers')
+        parser.add_argument('--event', type=int, action='append', default=[],
+                            help='Id of the event to report on (can be repeated), default: the last enabled event')
+        parser.add_argument('--csv', help='Also write the report to this CSV file')
+        parser.add_argument('--xlsx', help='Also write the report to this XLSX file')
 
     def handle(self, *args, **options):
         send_email = options['send_email']
 
-        # fetch the last event
-        last_event = InformationEvent.enabled_events.first()
+        if options['event']:
+            events = list(InformationEvent.objects.filter(id__in=options['event']).order_by('id'))
+        else:
+            # fetch the last event
+            last_event = InformationEvent.enabled_events.first()
+            events = [last_event] if last_event else []
 
-        if not last_event:
+        if not events:
             self.stdout.write(self.style.WARNING('No enabled events found.'))
             return
 
-        self.stdout.write(self.style.SUCCESS(f'Departments of the last event "{last_event.title}":'))
-
-        # fetch all EventParticipation objects for the last event
-        event_participations = last_event.eventparticipation_set.all()
+        if len(events) == 1:
+            title = f"Strutture di appartenenza degli iscritti alla pillola #{events[0].id} {events[0].title }"
+        else:
+            title = "Strutture di appartenenza degli iscritti alle pillole " + \
+                    ", ".join(f"#{event.id}" for event in events)
 
-        # print current working directory
-        print(os.getcwd())
+        self.stdout.write(self.style.SUCCESS(f'{title}:'))
 
-        json_data = read_json_file('registration/res/persfvg_dump_persone_entita.json')
-
-        dict_department = {}
+        report = participants_by_structure(events)
 
         email_body = ""
 
-        email_body += f"<h1>Strutture di appartenenza degli iscritti alla pillola #{last_event.id} {last_event.title }</h1><br><br>"
-
-        for event_participation in event_participations:
-            email = event_participation.subscriber.email
-            department = lookup_email(json_data, email)
-            # self.stdout.write(f"{email}: {department}")
-
-            if department in dict_department:
-                dict_department[department] += 1
-            else:
-                dict_department[department] = 1
-
-        # sort dict_department by key
-        dict_department = dict(sorted(dict_department.items(), key=lambda item: item[0]))
-
-        # print dict_department
-        for key, value in dict_department.items():
-            self.stdout.write(f"{key}: {value}")
-            email_body += f"{key}: {value}<br>"
+        email_body += f"<h1>{title}</h1><br><br>"
+
+        for uaf in report.get_structures():
+            label = uaf or UNKNOWN_STRUCTURE
+            if report.structure_names.get(uaf):
+                label += f" {report.structure_names[uaf]}"
+            value = report.get_total(uaf)
+            self.stdout.write(f"{label}: {value}")
+            email_body += f"{label}: {value}<br>"
+
+        attachments = []
+        if options['csv']:
+            with open(options['csv'], 'w', newline='', encoding='utf-8') as f:
+                report.write_csv(f)
+            attachments.append(options['csv'])
+        if options['xlsx']:
+            report.write_xlsx(options['xlsx'])
+            attachments.append(options['xlsx'])
 
         current_date = timezone.now().date()
         # add today date to email_body
@@ -80,7 +70,7 @@ class Command(BaseCommand):
 
         # Specify email details
         list_of_email_addresses = MONITOR_EMAIL_ADDRESSES  # Add actual recipient email address
-        subject = f'{SUBJECT_EMAIL} Strutture di appartenenza degli iscritti alla pillola #{last_event.id} {last_event.title }'
+        subject = f'{SUBJECT_EMAIL} {title}'
 
         my_send_email(
             FROM_EMAIL,
@@ -88,7 +78,7 @@ class Command(BaseCommand):
             subject,
             email_body,
             bcc_addresses=None,
-            attachments=None,
+            attachments=attachments,
             email_host=EMAIL_HOST
         )
 
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone, translation
+
+from registration.fragments import warm_event_fragments
+from registration.models import InformationEvent
+
+
+class Command(BaseCommand):
+    help = 'Render and cache the HTML fragments (web and email) of the upcoming enabled events.'
+
+    def handle(self, *args, **options):
+        events = InformationEvent.objects.filter(enabled=True, event_date__gte=timezone.now().date())
+
+        # the fragments are cached per language: warm the default one and the ones the site can be viewed in
+        languages = [settings.LANGUAGE_CODE] + [language for language, _ in settings.LANGUAGES]
+        count = 0
+        for language in dict.fromkeys(languages):
+            with translation.override(language):
+                count = warm_event_fragments(events)
+
+        self.stdout.write(self.style.SUCCESS(f"Fragments cached for {count} events"))
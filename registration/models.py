@@ -1,22 +1,28 @@
+import hashlib
 import uuid
 import datetime
+import zlib
 
 import pytz
 from django.db import models
-from django.db.models import Count
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 from django.utils import formats
 from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 from django.utils import timezone
 
 from django.utils.translation import gettext_lazy as _
 
 from mediamatrixhub.settings import PRODID, INTERNET_DOMAIN, BASE_URL
+from registration.fragments import get_event_fragment, FRAGMENT_WEB, FRAGMENT_EMAIL
 
 
 class InformationEventQuerySet(models.QuerySet):
     def with_participation_count(self):
-        return self.annotate(participation_count=Count('eventparticipation'))
+        # the counter kept by EventCapacity (see registration/capacity.py): no aggregation of the participations
+        return self.annotate(participation_count=Coalesce(F('capacity__taken'), 0))
 
 
 class EnabledEventManager(models.Manager):
@@ -26,7 +32,7 @@ class EnabledEventManager(models.Manager):
 
     def with_participation_count(self):
         # Ensure it operates on the current queryset
-        return self.get_queryset().annotate(participation_count=Count('eventparticipation'))
+        return self.get_queryset().with_participation_count()
 
     # return the last event
     def last_event(self):
@@ -117,6 +123,9 @@ class InformationEvent(models.Model):
                     >>> print(html_table)
                     <table>...</table>
         """
+        return get_event_fragment(self, FRAGMENT_EMAIL, self.render_html_table_email)
+
+    def render_html_table_email(self):
         # Format date as 'mercoledì 28 febbraio 2024'
         formatted_event_date = formats.date_format(self.event_date, "l j F Y") if self.event_date else "N/A"
 
@@ -141,6 +150,9 @@ class InformationEvent(models.Model):
                     >>> print(html_table)
                     <table>...</table>
         """
+        return mark_safe(get_event_fragment(self, FRAGMENT_WEB, self.render_html_table))
+
+    def render_html_table(self):
         # formatted_event_date = date_format(self.event_date, "d/m/Y")  # Format date to Italian format DD/MM/YYYY
 
         # Format date as 'mercoledì 28 febbraio 2024'
@@ -162,12 +174,15 @@ class InformationEvent(models.Model):
         """
         return f"{self.title.replace(' ', '_')}_{self.event_date.strftime('%Y%m%d')}_{self.event_start_time.strftime('%H%M')}.ics"
 
-    def generate_ics_content(self):
+    def generate_ics_vevent(self, dtstamp=None):
         """
-        Generates the content of an .ics file for importing the event into calendar applications.
+        Generates the VEVENT component of the event, to be put in a VCALENDAR.
+
+        Args:
+            dtstamp (datetime, optional): The DTSTAMP of the component; the current time if not given.
 
         Returns:
-            str: The .ics file content as a string.
+            str: The VEVENT component as a string, or an empty string if the event has no date or start time.
         """
         # Format start and end times into the required format
         if self.event_date and self.event_start_time:
@@ -187,6 +202,9 @@ class InformationEvent(models.Model):
         dt_start_utc = dt_start.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
         dt_end_utc = dt_end.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
 
+        if dtstamp is None:
+            dtstamp = timezone.now()
+
         # Generate UID based on event details to ensure uniqueness
         uid = f"{self.ref_token}@{INTERNET_DOMAIN}"
 
@@ -197,13 +215,9 @@ class InformationEvent(models.Model):
 
         ics_location = f"Online Meeting: {self.meeting_url}" if self.event_type == "virtual" else self.location
 
-        # Prepare .ics content
-        ics_content = f"""BEGIN:VCALENDAR
-VERSION:2.0
-PRODID:-{PRODID}
-BEGIN:VEVENT
+        return f"""BEGIN:VEVENT
 UID:{uid}
-DTSTAMP:{timezone.now().astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')}
+DTSTAMP:{dtstamp.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')}
 DTSTART:{dt_start_utc}
 DTEND:{dt_end_utc}
 SUMMARY:{self.title}
@@ -211,7 +225,24 @@ DESCRIPTION:{ics_description}
 LOCATION:{ics_location or "N/A"}
 URL:{self.meeting_url}
 END:VEVENT
-END:VCALENDAR
+"""
+
+    def generate_ics_content(self):
+        """
+        Generates the content of an .ics file for importing the event into calendar applications.
+
+        Returns:
+            str: The .ics file content as a string.
+        """
+        vevent = self.generate_ics_vevent()
+        if not vevent:
+            return ""
+
+        # Prepare .ics content
+        ics_content = f"""BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-{PRODID}
+{vevent}END:VCALENDAR
 """
         return ics_content
 
@@ -236,9 +267,22 @@ class Subscriber(models.Model):
 
     enabled = models.BooleanField(default=True, verbose_name=_("Enabled"))
 
+    # address of the calendar feed, assigned at the first request (see get_calendar_token)
+    calendar_token = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
     def __str__(self):
         return f"{self.name} {self.surname}"
 
+    def get_calendar_token(self):
+        """Returns the token of the calendar feed of the subscriber, assigning it if needed."""
+        if self.calendar_token is None:
+            self.calendar_token = uuid.uuid4()
+            Subscriber.objects.filter(pk=self.pk, calendar_token__isnull=True).update(
+                calendar_token=self.calendar_token)
+            # another request may have assigned it first
+            self.calendar_token = Subscriber.objects.values_list('calendar_token', flat=True).get(pk=self.pk)
+        return self.calendar_token
+
     class Meta:
         verbose_name = _("Subscriber")
         verbose_name_plural = _("Subscribers")
@@ -269,6 +313,68 @@ class EventParticipation(models.Model):
         verbose_name_plural = _("Event Participations")
 
 
+class EventCapacity(models.Model):
+    """
+    Counter of the seats taken for an InformationEvent.
+
+    Seats are reserved with a conditional UPDATE on this single row (see registration/capacity.py), so that
+    concurrent subscriptions never count the participations nor lock the participation table.
+
+    taken is also the participation count of the listings (InformationEventQuerySet.with_participation_count):
+    it follows every participation added or removed, and the reconcile_event_capacity command checks and
+    repairs it.
+
+    Attributes:
+        event (InformationEvent): The event.
+        taken (int): The number of seats taken.
+        max_participants (int, optional): Copy of event.max_participants; None means no limit.
+    """
+    event = models.OneToOneField(InformationEvent, on_delete=models.CASCADE, related_name='capacity',
+                                 verbose_name=_("Evento"))
+    taken = models.PositiveIntegerField(default=0, verbose_name=_("Posti occupati"))
+    max_participants = models.IntegerField(null=True, blank=True, verbose_name=_("Numero massimo partecipanti"))
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.event} {self.taken}/{self.max_participants if self.max_participants is not None else '-'}"
+
+    class Meta:
+        verbose_name = _("Event Capacity")
+        verbose_name_plural = _("Event Capacities")
+
+
+class EventLogPayload(models.Model):
+    """
+    A large text attached to EventLog rows (e.g. the body of an email), stored once and compressed.
+
+    Attributes:
+        digest (str): sha256 of the text, unique: the same text is stored only once.
+        content (bytes): the text compressed with zlib.
+        size (int): length in characters of the text.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    content = models.BinaryField()
+    size = models.PositiveIntegerField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def get_digest(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @classmethod
+    def from_text(cls, text):
+        """Returns an unsaved EventLogPayload storing text."""
+        return cls(digest=cls.get_digest(text), content=zlib.compress(text.encode(), 6), size=len(text))
+
+    def get_text(self):
+        return zlib.decompress(self.content).decode()
+
+    def __str__(self):
+        return f"EventLogPayload #{self.id} {self.digest[:12]} {self.size} chars"
+
+
 class EventLog(models.Model):
     """
     Represents an event log entry.
@@ -276,8 +382,13 @@ class EventLog(models.Model):
     Args:
         event_type (str): The type of the event.
         event_title (str): The title of the event.
-        event_data (str): The data associated with the event.
+        event_data (str): The data associated with the event (short free text).
         event_target (str, optional): The target of the event.
+        subscriber_id (int, optional): The Subscriber concerned (not a foreign key: the log outlives it).
+        information_event_id (int, optional): The InformationEvent concerned.
+        ip_address (str, optional): The IP address of the client.
+        data (dict, optional): Other structured details.
+        payload (EventLogPayload, optional): Large text, deduplicated and compressed.
 
     Returns:
         str: A string representation of the EventLog.
@@ -300,18 +411,100 @@ class EventLog(models.Model):
     LOGIN_FAILED_JSON_USER_DISABLED = "LOGIN_FAILED_JSON_USER_DISABLED"
     REMAINDER_EMAIL_SENT = "REMAINDER_EMAIL_SENT"
     MULTIPLE_SUBSCRIBER_DETECTED = "MULTIPLE_SUBSCRIBER_DETECTED"
+    SUBSCRIPTION_REJECTED = "SUBSCRIPTION_REJECTED"
     LOGIN_FAILED_UNKNOWN = "LOGIN_FAILED_UNKNOWN"
+    EMAIL_QUEUED = "EMAIL_QUEUED"
+    CHECK_SUBSCRIBERS_JSON = "CHECK_SUBSCRIBERS_JSON"
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    # set when the event happens, not when the (possibly asynchronous) write takes place
+    created_at = models.DateTimeField(default=timezone.now)
 
     event_type = models.CharField(max_length=128, null=True)
     event_title = models.CharField(max_length=256, null=True)
     event_data = models.TextField(null=True)
     event_target = models.CharField(max_length=256, null=True, blank=True)
 
+    subscriber_id = models.IntegerField(null=True, blank=True, db_index=True)
+    information_event_id = models.IntegerField(null=True, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    data = models.JSONField(null=True, blank=True)
+    payload = models.ForeignKey(EventLogPayload, on_delete=models.PROTECT, null=True, blank=True)
+
     def __str__(self):
         return f"EventLog #{self.id}  event_type={self.event_type} event_target={self.event_target} event_title={self.event_title} {self.created_at}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['event_type', 'created_at']),
+        ]
+
+
+class EmailOutbox(models.Model):
+    """
+    An email waiting to be delivered (or already delivered) by the deliver_outbox command.
+
+    Views and commands enqueue the messages (see registration/outbox.py) instead of talking to the SMTP
+    server; the delivery workers claim the due messages, send them and retry the failed ones with backoff.
+
+    Attributes:
+        idempotency_key (str): Unique key of the message: enqueuing the same key again has no effect.
+        status (str): PENDING, SENDING (claimed by a worker until next_attempt_at), SENT or FAILED.
+        attachments (list): [{"file_name": ..., "content": ...}] or [{"path": ...}].
+        attempts (int): Number of delivery attempts.
+        next_attempt_at (datetime): When the message can be (re)tried.
+        log_event_type (str): EventLog type recorded when the message is sent.
+    """
+    PENDING = 'PENDING'
+    SENDING = 'SENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, _('Pending')),
+        (SENDING, _('Sending')),
+        (SENT, _('Sent')),
+        (FAILED, _('Failed')),
+    ]
+
+    idempotency_key = models.CharField(max_length=191, unique=True)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+
+    email_host = models.CharField(max_length=255)
+    from_email = models.CharField(max_length=255)
+    to_addresses = models.TextField()
+    cc_addresses = models.TextField(blank=True, default='')
+    bcc_addresses = models.TextField(blank=True, default='')
+    subject = models.CharField(max_length=998)
+    body = models.TextField()
+    attachments = models.JSONField(default=list, blank=True)
+
+    log_event_type = models.CharField(max_length=128, default=EventLog.EMAIL_SENT)
+    log_event_target = models.CharField(max_length=256, null=True, blank=True)
+
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def delivery_latency(self):
+        """Seconds from the enqueuing to the delivery, None if not sent."""
+        if self.sent_at is None:
+            return None
+        return (self.sent_at - self.created_at).total_seconds()
+
+    def __str__(self):
+        return f"EmailOutbox #{self.id} {self.status} to={self.to_addresses} subject={self.subject}"
+
+    class Meta:
+        verbose_name = _("Email Outbox")
+        verbose_name_plural = _("Email Outbox")
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
 
 class SubscriptionAlertMessage(models.Model):
     enabled = models.BooleanField(default=True, verbose_name=_("Enabled"))
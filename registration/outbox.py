@@ -0,0 +1,272 @@
+import json
+import random
+import smtplib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Count
+from django.utils import timezone
+
+from mediamatrixhub.email_utils import MyTemporaryFile, EmailMessageBuilder, get_smtp_pool
+from mediamatrixhub.metrics import EMAIL_OUTBOX_MESSAGES, register_collector
+from mediamatrixhub.settings import EMAIL_HOST
+from registration.logic import bulk_create_event_logs
+from registration.models import EmailOutbox, EventLog
+
+MAX_ATTEMPTS = 6
+# first retry after BACKOFF_BASE seconds, doubling at each attempt up to BACKOFF_MAX
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 60 * 60
+# a claimed message not sent within this time (e.g. the worker died) is claimed again
+CLAIM_TIMEOUT = 10 * 60
+
+
+def serialize_attachments(attachments):
+    result = []
+    for attachment in attachments or []:
+        if isinstance(attachment, MyTemporaryFile):
+            result.append({'file_name': attachment.get_file_name(), 'content': attachment.get_content()})
+        else:
+            result.append({'path': str(attachment)})
+    return result
+
+
+def deserialize_attachments(attachments):
+    return [MyTemporaryFile(attachment['file_name'], attachment['content']) if 'file_name' in attachment
+            else attachment['path'] for attachment in attachments]
+
+
+def make_outbox_message(from_email, to_addresses, subject, body, cc_addresses=None, bcc_addresses=None,
+                        attachments=None, email_host=None, idempotency_key=None, log_event_type=EventLog.EMAIL_SENT,
+                        log_event_target=None):
+    """Returns an unsaved EmailOutbox; the arguments are the ones of my_send_email."""
+    return EmailOutbox(
+        idempotency_key=idempotency_key or uuid.uuid4().hex,
+        email_host=email_host or EMAIL_HOST,
+        from_email=from_email,
+        to_addresses=','.join(to_addresses),
+        cc_addresses=','.join(cc_addresses or []),
+        bcc_addresses=','.join(bcc_addresses or []),
+        subject=subject,
+        body=body,
+        attachments=serialize_attachments(attachments),
+        log_event_type=log_event_type,
+        log_event_target=log_event_target if log_event_target is not None else ','.join(to_addresses),
+    )
+
+
+def enqueue_email(from_email, to_addresses, subject, body, **kwargs):
+    """
+    Adds a message to the outbox; it is sent by the deliver_outbox command.
+
+    The keyword arguments are the ones of make_outbox_message. If a message with the same idempotency_key has
+    already been enqueued, nothing is added.
+
+    :return: (EmailOutbox, created)
+    """
+    message = make_outbox_message(from_email, to_addresses, subject, body, **kwargs)
+    existing = EmailOutbox.objects.filter(idempotency_key=message.idempotency_key).first()
+    if existing is not None:
+        return existing, False
+    try:
+        with transaction.atomic():
+            message.save()
+    except IntegrityError:
+        # enqueued by a concurrent request with the same key
+        return EmailOutbox.objects.get(idempotency_key=message.idempotency_key), False
+    return message, True
+
+
+def enqueue_emails(messages, batch_size=500):
+    """
+    Adds several unsaved EmailOutbox (see make_outbox_message) with bulk inserts, skipping the idempotency keys
+    already enqueued.
+
+    :return: the number of messages added
+    """
+    messages = {message.idempotency_key: message for message in messages}
+    keys = list(messages)
+    for i in range(0, len(keys), batch_size):
+        for key in EmailOutbox.objects.filter(idempotency_key__in=keys[i:i + batch_size]) \
+                .values_list('idempotency_key', flat=True):
+            del messages[key]
+    EmailOutbox.objects.bulk_create(messages.values(), batch_size=batch_size, ignore_conflicts=True)
+    return len(messages)
+
+
+def get_backoff(attempts):
+    """Seconds before the next attempt, after attempts failed ones (exponential, with jitter)."""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def is_permanent_error(error):
+    """5xx replies and refused recipients will not succeed when retried."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def claim_messages(limit):
+    """
+    Claims up to limit due messages, marking them SENDING until now + CLAIM_TIMEOUT.
+
+    SKIP LOCKED lets several deliver_outbox processes drain the outbox concurrently without claiming the same
+    messages.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(EmailOutbox.objects.select_for_update(skip_locked=True)
+                   .filter(status__in=[EmailOutbox.PENDING, EmailOutbox.SENDING], next_attempt_at__lte=now)
+                   .order_by('next_attempt_at').values_list('id', flat=True)[:limit])
+        EmailOutbox.objects.filter(id__in=ids).update(status=EmailOutbox.SENDING,
+                                                      next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT))
+    return list(EmailOutbox.objects.filter(id__in=ids).order_by('next_attempt_at', 'id'))
+
+
+class OutboxDelivery:
+    """
+    Delivers the claimed messages on a thread pool, with at most per_host concurrent connections to each SMTP
+    host.
+
+    :param workers: number of threads
+    :param per_host: maximum number of messages sent concurrently to the same host
+    :param max_attempts: a message is FAILED after max_attempts failed attempts
+    """
+
+    def __init__(self, workers=8, per_host=4, max_attempts=MAX_ATTEMPTS):
+        self.workers = workers
+        self.per_host = per_host
+        self.max_attempts = max_attempts
+        self.host_semaphores = {}
+        self.message_builders = {}
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def get_host_semaphore(self, email_host):
+        with self.lock:
+            semaphore = self.host_semaphores.get(email_host)
+            if semaphore is None:
+                semaphore = self.host_semaphores[email_host] = threading.BoundedSemaphore(self.per_host)
+            return semaphore
+
+    def get_message_builder(self, message):
+        """
+        EmailMessageBuilder of message, shared by the messages with the same sender, subject and attachments:
+        the headers and the attachment parts are built once.
+        """
+        key = (message.from_email, message.subject, json.dumps(message.attachments, sort_keys=True))
+        with self.lock:
+            builder = self.message_builders.get(key)
+        if builder is None:
+            builder = EmailMessageBuilder(message.from_email, message.subject,
+                                          deserialize_attachments(message.attachments))
+            with self.lock:
+                self.message_builders[key] = builder
+        return builder
+
+    def send(self, message):
+        """Sends message; returns None or the error."""
+        to_addresses = message.to_addresses.split(',')
+        cc_addresses = [address for address in message.cc_addresses.split(',') if address]
+        bcc_addresses = [address for address in message.bcc_addresses.split(',') if address]
+        try:
+            msg = self.get_message_builder(message).build(to_addresses, message.body, cc_addresses)
+            with self.get_host_semaphore(message.email_host):
+                get_smtp_pool(message.email_host).send_message(
+                    msg, from_addr=message.from_email, to_addrs=to_addresses + cc_addresses + bcc_addresses)
+        except Exception as e:
+            return e
+        return None
+
+    def deliver(self, message):
+        """Sends message and records the outcome; returns the EventLog to be created."""
+        error = self.send(message)
+        now = timezone.now()
+        attempts = message.attempts + 1
+
+        if error is None:
+            EmailOutbox.objects.filter(id=message.id).update(status=EmailOutbox.SENT, attempts=attempts,
+                                                             sent_at=now, last_error='')
+            latency = (now - message.created_at).total_seconds()
+            with self.lock:
+                self.sent += 1
+                self.latencies.append(latency)
+            return {
+                'event_type': message.log_event_type,
+                'event_title': message.subject,
+                'event_target': message.log_event_target,
+                'data': {'outbox_id': message.id, 'to': message.to_addresses, 'attempts': attempts,
+                         'latency': round(latency, 3)},
+            }
+
+        if attempts >= self.max_attempts or is_permanent_error(error):
+            EmailOutbox.objects.filter(id=message.id).update(status=EmailOutbox.FAILED, attempts=attempts,
+                                                             last_error=repr(error))
+            with self.lock:
+                self.failed += 1
+            return {
+                'event_type': EventLog.ERROR_SENDING_EMAIL,
+                'event_title': f"Error sending email to {message.to_addresses}",
+                'event_data': str(error),
+                'event_target': message.log_event_target,
+                'data': {'outbox_id': message.id, 'to': message.to_addresses, 'attempts': attempts},
+            }
+
+        EmailOutbox.objects.filter(id=message.id).update(
+            status=EmailOutbox.PENDING, attempts=attempts, last_error=repr(error),
+            next_attempt_at=now + timedelta(seconds=get_backoff(attempts)))
+        with self.lock:
+            self.retried += 1
+        return None
+
+    def deliver_in_thread(self, message):
+        try:
+            return self.deliver(message)
+        finally:
+            # each worker thread has its own database connection
+            connection.close()
+
+    def run(self, batch_size=200):
+        """Claims and delivers batches of due messages until the outbox has none; returns the number processed."""
+        processed = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            while True:
+                messages = claim_messages(batch_size)
+                if not messages:
+                    break
+                if executor is None:
+                    results = map(self.deliver, messages)
+                else:
+                    results = executor.map(self.deliver_in_thread, messages)
+                bulk_create_event_logs([event_log for event_log in results if event_log])
+                processed += len(messages)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return processed
+
+
+def deliver_outbox(workers=8, per_host=4, max_attempts=MAX_ATTEMPTS, batch_size=200):
+    """Sends all the due messages of the outbox; returns the OutboxDelivery with the counters and latencies."""
+    delivery = OutboxDelivery(workers=workers, per_host=per_host, max_attempts=max_attempts)
+    delivery.run(batch_size=batch_size)
+    return delivery
+
+
+# the statuses of the messages still in the queue: the sent ones are not counted at every scrape
+QUEUE_STATUSES = (EmailOutbox.PENDING, EmailOutbox.SENDING, EmailOutbox.FAILED)
+
+
+@register_collector
+def collect_outbox_metrics():
+    counts = dict(EmailOutbox.objects.filter(status__in=QUEUE_STATUSES).values_list('status')
+                  .annotate(count=Count('id')).order_by())
+    return [(EMAIL_OUTBOX_MESSAGES, {'status': status}, counts.get(status, 0)) for status in QUEUE_STATUSES]
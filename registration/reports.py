@@ -0,0 +1,90 @@
+import csv
+from collections import defaultdict
+
+from openpyxl.workbook import Workbook
+
+from registration.directory import get_directory
+from registration.models import EventParticipation
+
+UNKNOWN_STRUCTURE = 'dato non presente'
+
+
+class ParticipantsByStructure:
+    """
+    Number of participants of a set of events grouped by the structure they belong to.
+
+    Attributes:
+        events (list): the events, in the order of the columns of the report.
+        counts (dict): structure uaf (None if unknown) -> {event id: number of participants}.
+        structure_names (dict): structure uaf -> name of the structure.
+    """
+
+    def __init__(self, events, counts, structure_names):
+        self.events = events
+        self.counts = counts
+        self.structure_names = structure_names
+
+    def get_structures(self):
+        """Returns the uafs of the structures sorted by uaf, the unknown structure last."""
+        return sorted(self.counts, key=lambda uaf: (uaf is None, uaf or ''))
+
+    def get_total(self, uaf):
+        return sum(self.counts[uaf].values())
+
+    def get_header(self):
+        return ['uaf', 'struttura'] + [f"#{event.id} {event.title}" for event in self.events] + ['totale']
+
+    def get_rows(self):
+        for uaf in self.get_structures():
+            counts = self.counts[uaf]
+            yield ([uaf or UNKNOWN_STRUCTURE, self.structure_names.get(uaf) or '']
+                   + [counts.get(event.id, 0) for event in self.events]
+                   + [self.get_total(uaf)])
+
+    def write_csv(self, file):
+        writer = csv.writer(file)
+        writer.writerow(self.get_header())
+        writer.writerows(self.get_rows())
+
+    def write_xlsx(self, file):
+        wb = Workbook()
+        ws = wb.active
+        ws.title = 'Partecipanti per struttura'
+        ws.append(self.get_header())
+        for row in self.get_rows():
+            ws.append(row)
+        wb.save(file)
+
+
+def participants_by_structure(events, directory=None):
+    """
+    Counts the participants of the given events by the structure of the organisation directory.
+
+    The participations are read with a single query joined with the subscribers; each email is looked up once in
+    the email index of the directory.
+
+    :param events: iterable of InformationEvent
+    :param directory: OrganisationDirectory, the shared one by default
+    :return: ParticipantsByStructure
+    """
+    if directory is None:
+        directory = get_directory()
+
+    events = list(events)
+    counts = defaultdict(lambda: defaultdict(int))
+    structure_by_email = {}
+
+    participations = EventParticipation.objects \
+        .filter(event__in=events) \
+        .values_list('event_id', 'subscriber__email') \
+        .iterator(chunk_size=2000)
+
+    for event_id, email in participations:
+        try:
+            structure = structure_by_email[email]
+        except KeyError:
+            structure = structure_by_email[email] = directory.get_structure_by_email(email)
+        counts[structure][event_id] += 1
+
+    structure_names = {uaf: directory.get_structure_name(uaf) for uaf in counts if uaf is not None}
+    return ParticipantsByStructure(events, counts, structure_names)
@@ -0,0 +1,67 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from mediamatrixhub.metrics import CACHE_INVALIDATIONS, EVENT_PARTICIPATIONS
+from registration.calendar_feed import invalidate_calendar_feed, invalidate_calendar_feeds, forget_calendar_token
+from registration.capacity import get_or_create_capacity, add_seats, release_seat
+from registration.fragments import invalidate_event_fragments
+from registration.models import InformationEvent, EventCapacity, Subscriber, EventParticipation
+from registration.subscriber_check import invalidate_subscriber_checks
+
+
+@receiver(post_save, sender=InformationEvent)
+def sync_event_capacity(sender, instance, created, **kwargs):
+    """Keep the max_participants of the seat counter in line with the event."""
+    if created:
+        EventCapacity.objects.create(event=instance, max_participants=instance.max_participants)
+    elif not EventCapacity.objects.filter(event=instance).update(max_participants=instance.max_participants):
+        get_or_create_capacity(instance)
+
+
+@receiver(post_save, sender=InformationEvent)
+def invalidate_event_fragments_on_save(sender, instance, **kwargs):
+    invalidate_event_fragments(instance.pk)
+    CACHE_INVALIDATIONS.inc(cache='event_fragments')
+
+
+@receiver(post_save, sender=InformationEvent)
+@receiver(post_delete, sender=InformationEvent)
+def invalidate_calendar_feeds_on_change(sender, **kwargs):
+    invalidate_calendar_feeds()
+    CACHE_INVALIDATIONS.inc(cache='calendar_feed')
+
+
+@receiver(post_save, sender=Subscriber)
+@receiver(post_delete, sender=Subscriber)
+def invalidate_subscriber_checks_on_change(sender, instance, **kwargs):
+    invalidate_subscriber_checks()
+    invalidate_calendar_feed(instance.pk)
+    forget_calendar_token(instance.calendar_token)
+    CACHE_INVALIDATIONS.inc(cache='subscriber_check')
+
+
+@receiver(post_save, sender=EventParticipation)
+def count_participation_on_create(sender, instance, created, raw=False, **kwargs):
+    """
+    Keeps EventCapacity.taken in line with the participations saved one at a time (e.g. from the admin).
+
+    The subscriptions of manage_subscription reserve the seat with reserve_seat and create the participations with
+    bulk_create, which sends no signal: they are not counted twice.
+    """
+    if created and not raw:
+        add_seats(instance.event_id)
+        EVENT_PARTICIPATIONS.inc(action='added')
+
+
+@receiver(post_delete, sender=EventParticipation)
+def release_seat_on_delete(sender, instance, **kwargs):
+    # also for the deletions of a queryset and the cascades, which send post_delete for each row
+    release_seat(instance.event_id)
+    EVENT_PARTICIPATIONS.inc(action='removed')
+
+
+@receiver(post_save, sender=EventParticipation)
+@receiver(post_delete, sender=EventParticipation)
+def invalidate_calendar_feed_on_participation_change(sender, instance, **kwargs):
+    # the bulk changes of manage_subscription invalidate the feed themselves
+    invalidate_calendar_feed(instance.subscriber_id)
@@ -0,0 +1,126 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from mediamatrixhub.metrics import CACHE_REQUESTS
+from registration.directory import get_directory, get_field, UAF, STRUCTURE
+from registration.models import Subscriber
+
+GENERATION_KEY = 'subscriber_check:generation'
+# maximum number of (matricola, email) pairs of a batch request
+MAX_BATCH_SIZE = 1000
+MISSING = 'dato non presente'
+
+FOUND = 'found'
+DISABLED = 'disabled'
+UNKNOWN = 'unknown'
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def invalidate_subscriber_checks():
+    """
+    Discards all the cached results, e.g. after a change of the subscribers.
+
+    The generation is part of the cache keys: after the increment the old entries are never read again and
+    expire by themselves.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 1, None)
+
+
+def normalize_pair(matricola, email):
+    """
+    The (matricola, email) pair as it is looked up and cached.
+
+    The lookup was done by the database, whose collation ignores the case and the trailing spaces: the pairs
+    which differ only in those are the same subscriber.
+    """
+    return matricola.strip(), email.strip().lower()
+
+
+def get_cache_key(generation, matricola, email):
+    digest = hashlib.sha1(f"{matricola}\x00{email}".encode()).hexdigest()
+    return f"subscriber_check:{generation}:{digest}"
+
+
+def to_json(result):
+    """The response of the check-subscriber endpoint for a result of check_subscribers."""
+    status, subscriber_data = result
+    if status == FOUND:
+        return {'exists': True, 'subscriber': subscriber_data}
+    return {'exists': False}
+
+
+def get_subscriber_data(subscriber, directory):
+    """The JSON description of an enabled subscriber, with the structure from the HR dump."""
+    extended_data = directory.get_person_by_matricola(subscriber.matricola)
+    if extended_data is None:
+        uaf = MISSING
+        structure = MISSING
+    else:
+        # the records of the dump may be short
+        uaf = get_field(extended_data, UAF) or MISSING
+        structure = get_field(extended_data, STRUCTURE) or MISSING
+
+    return {
+        'id': subscriber.id,
+        'matricola': subscriber.matricola,
+        'email': subscriber.email,
+        'name': subscriber.name,
+        'surname': subscriber.surname,
+        'uaf': uaf,
+        'structure': structure,
+    }
+
+
+def check_subscribers(pairs):
+    """
+    Looks up the subscribers with the given (matricola, email) pairs.
+
+    The results, positive and negative, are cached for SUBSCRIBER_CHECK_CACHE_TIMEOUT seconds; the pairs not in
+    the cache are looked up with a single query.
+
+    :param pairs: list of (matricola, email), compared as normalize_pair does
+    :return: (list of (FOUND, subscriber data), (DISABLED, None) or (UNKNOWN, None) in the same order as pairs,
+        number of results taken from the cache)
+    """
+    generation = get_generation()
+    pairs = [normalize_pair(matricola, email) for matricola, email in pairs]
+    keys = [get_cache_key(generation, matricola, email) for matricola, email in pairs]
+    cached = cache.get_many(keys)
+
+    missing = {pair: key for pair, key in zip(pairs, keys) if key not in cached}
+    if missing:
+        found = {}
+        subscribers = Subscriber.objects.filter(matricola__in={matricola for matricola, _ in missing},
+                                                email__in={email for _, email in missing}).order_by('id')
+        for subscriber in subscribers:
+            # the first one, as the single lookup did, when the pair is not unique
+            found.setdefault(normalize_pair(subscriber.matricola, subscriber.email), subscriber)
+
+        directory = get_directory()
+        results = {}
+        for pair, key in missing.items():
+            subscriber = found.get(pair)
+            if subscriber is None:
+                results[key] = (UNKNOWN, None)
+            elif not subscriber.enabled:
+                results[key] = (DISABLED, None)
+            else:
+                results[key] = (FOUND, get_subscriber_data(subscriber, directory))
+        cache.set_many(results, settings.SUBSCRIBER_CHECK_CACHE_TIMEOUT)
+        cached.update(results)
+
+    CACHE_REQUESTS.inc(len(keys) - len(missing), cache='subscriber_check', result='hit')
+    CACHE_REQUESTS.inc(len(missing), cache='subscriber_check', result='miss')
+    return [cached[key] for key in keys], len(keys) - len(missing)
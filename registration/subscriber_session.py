@@ -0,0 +1,90 @@
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+from registration.models import Subscriber
+
+# REGISTRATION_SESSION_MODE values
+SESSION_DB = 'db'
+SESSION_SIGNED_COOKIE = 'signed_cookie'
+SESSION_CACHE = 'cache'
+
+COOKIE_NAME = 'registration_subscriber'
+COOKIE_SALT = 'registration.subscriber_session'
+# the prefix of the registration urls in mediamatrixhub/urls.py: the cookie is not sent to the rest of the site
+COOKIE_PATH = '/registrazione/'
+CACHE_KEY_PREFIX = 'subscriber_session:'
+
+# the fields of the subscriber kept in the cookie or in the cache
+FIELDS = ('id', 'name', 'surname', 'email', 'enabled')
+
+
+def get_mode():
+    return settings.REGISTRATION_SESSION_MODE
+
+
+def get_subscriber_data(subscriber):
+    return {field: getattr(subscriber, field) for field in FIELDS}
+
+
+def get_cookie_options():
+    return {'max_age': settings.REGISTRATION_SESSION_AGE, 'path': COOKIE_PATH,
+            'secure': settings.SESSION_COOKIE_SECURE, 'httponly': True, 'samesite': 'Lax'}
+
+
+def login_subscriber(request, response, subscriber):
+    """Records in response that the client is logged in as subscriber."""
+    mode = get_mode()
+    if mode == SESSION_SIGNED_COOKIE:
+        value = signing.dumps(get_subscriber_data(subscriber), salt=COOKIE_SALT, compress=True)
+        response.set_cookie(COOKIE_NAME, value, **get_cookie_options())
+    elif mode == SESSION_CACHE:
+        token = secrets.token_urlsafe(32)
+        cache.set(CACHE_KEY_PREFIX + token, get_subscriber_data(subscriber), settings.REGISTRATION_SESSION_AGE)
+        response.set_cookie(COOKIE_NAME, token, **get_cookie_options())
+    else:
+        request.session['subscriber_id'] = subscriber.id
+
+
+def get_subscriber(request):
+    """
+    Returns the subscriber the client is logged in as, or None.
+
+    With the signed cookie and the cache modes no query is made: the result is a Subscriber built from the stored
+    fields (see FIELDS), not read from the database, and it is None if the subscriber was not enabled at login.
+    """
+    mode = get_mode()
+    if mode == SESSION_DB:
+        subscriber_id = request.session.get('subscriber_id')
+        if not subscriber_id:
+            return None
+        return Subscriber.objects.filter(id=subscriber_id).first()
+
+    if mode == SESSION_SIGNED_COOKIE:
+        try:
+            data = signing.loads(request.COOKIES.get(COOKIE_NAME, ''), salt=COOKIE_SALT,
+                                 max_age=settings.REGISTRATION_SESSION_AGE)
+        except signing.BadSignature:
+            # also a missing or expired cookie
+            data = None
+    else:
+        token = request.COOKIES.get(COOKIE_NAME)
+        data = cache.get(CACHE_KEY_PREFIX + token) if token else None
+
+    if not data or not data.get('enabled'):
+        return None
+    return Subscriber(**{field: data[field] for field in FIELDS})
+
+
+def logout_subscriber(request, response):
+    mode = get_mode()
+    if mode == SESSION_DB:
+        request.session['subscriber_id'] = None
+        return
+    if mode == SESSION_CACHE:
+        token = request.COOKIES.get(COOKIE_NAME)
+        if token:
+            cache.delete(CACHE_KEY_PREFIX + token)
+    response.delete_cookie(COOKIE_NAME, path=COOKIE_PATH)
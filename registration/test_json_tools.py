@@ -0,0 +1,152 @@
+import json
+import random
+
+import pytest
+
+from registration.directory import DirectoryIndex, OrganisationDirectory, SnapshotIndex, build_snapshot
+from registration.json_stream import iter_json_object, JSONStreamError
+
+NUMBER_OF_STRUCTURES = 20000
+NUMBER_OF_PERSONS = 40000
+
+
+def reference_get_uaf_children_recursively(data, uaf):
+    # the algorithm of the original json_tools.get_uaf_children_recursively, without the in-place mutation
+    children_structures = {}
+    for k, v in data.items():
+        parent_uaf = v[3]
+        if k != parent_uaf:
+            children_structures.setdefault(parent_uaf, [])
+            if k not in children_structures[parent_uaf]:
+                children_structures[parent_uaf].append(k)
+
+    def get_recursive_children(uaf):
+        result = list(children_structures.get(uaf, []))
+        result2 = []
+        for uaf2 in result:
+            result2.extend(get_recursive_children(uaf2))
+        result.extend(result2)
+        result.append(uaf)
+        return list(set(result))
+
+    return get_recursive_children(uaf)
+
+
+def reference_get_all_employees_uaf(structures, persons, uaf):
+    list_of_uafs = set(reference_get_uaf_children_recursively(structures, uaf))
+    return [v for v in persons.values() if len(v) > 6 and v[6] and v[6] in list_of_uafs]
+
+
+@pytest.fixture(scope='module')
+def synthetic_dumps():
+    rng = random.Random(20000)
+    structures = {'S0': ['Root', '', '', 'S0']}
+    for i in range(1, NUMBER_OF_STRUCTURES):
+        # mostly shallow, with some long chains
+        parent = i - 1 if rng.random() < 0.2 else rng.randrange(i)
+        structures[f'S{i}'] = [f'Structure {i}', '', '', f'S{parent}']
+    # a structure whose parent is missing from the dump
+    structures['ORPHAN'] = ['Orphan', '', '', 'MISSING']
+
+    persons = {}
+    for i in range(NUMBER_OF_PERSONS):
+        structure = f'S{rng.randrange(NUMBER_OF_STRUCTURES)}' if i % 50 else ''
+        persons[f'person {i}'] = [f'{i:06d}', f'person{i}@example.org', '', 'Surname', 'Name', 'UAF', structure]
+    persons['short record'] = ['999999', 'short@example.org']
+    return structures, persons
+
+
+@pytest.fixture(scope='module')
+def index(synthetic_dumps):
+    structures, persons = synthetic_dumps
+    return DirectoryIndex(persons, structures)
+
+
+def sample_uafs(structures):
+    rng = random.Random(1)
+    return ['S0', 'S1', 'ORPHAN', 'MISSING', 'UNKNOWN'] + rng.sample(sorted(structures), 50)
+
+
+def test_subtree_matches_original_algorithm(synthetic_dumps, index):
+    structures, persons = synthetic_dumps
+    for uaf in sample_uafs(structures):
+        assert sorted(index.get_subtree(uaf)) == sorted(reference_get_uaf_children_recursively(structures, uaf))
+
+
+def test_subtree_people_match_original_algorithm(synthetic_dumps, index):
+    structures, persons = synthetic_dumps
+    for uaf in sample_uafs(structures)[:15]:
+        expected = reference_get_all_employees_uaf(structures, persons, uaf)
+        assert sorted(r[0] for r in index.get_subtree_people(uaf)) == sorted(r[0] for r in expected)
+
+
+def test_repeated_queries_do_not_change_the_index(index):
+    first = index.get_subtree('S0')
+    first.append('garbage')
+    assert index.get_subtree('S0') == first[:-1]
+    assert len(index.get_subtree('S0')) == NUMBER_OF_STRUCTURES
+
+
+def test_cycles_do_not_loop():
+    structures = {'A': ['a', '', '', 'B'], 'B': ['b', '', '', 'A'], 'C': ['c', '', '', 'B']}
+    index = DirectoryIndex({}, structures)
+    assert sorted(index.get_subtree('A')) == ['A', 'B', 'C']
+    assert sorted(index.get_subtree('C')) == ['C']
+
+
+def write_dumps(directory, synthetic_dumps):
+    structures, persons = synthetic_dumps
+    persons_file = directory / 'persons.json'
+    structures_file = directory / 'structures.json'
+    persons_file.write_text(json.dumps(persons), encoding='utf-8')
+    structures_file.write_text(json.dumps(structures), encoding='utf-8')
+    return str(persons_file), str(structures_file)
+
+
+def test_directory_reads_the_dumps(tmp_path, synthetic_dumps):
+    persons_file, structures_file = write_dumps(tmp_path, synthetic_dumps)
+
+    directory = OrganisationDirectory(persons_file, structures_file, snapshot_file=None)
+    assert directory.get_person_by_matricola('000001')[1] == 'person1@example.org'
+    assert directory.get_person_by_email('PERSON1@example.org')[0] == '000001'
+    assert len(directory.get_sub_structures('S0')) == NUMBER_OF_STRUCTURES
+
+
+def test_snapshot_matches_the_dumps(tmp_path, synthetic_dumps, index):
+    structures, persons = synthetic_dumps
+    persons_file, structures_file = write_dumps(tmp_path, synthetic_dumps)
+    snapshot_file = str(tmp_path / 'snapshot.sqlite3')
+    build_snapshot(persons_file, structures_file, snapshot_file)
+
+    directory = OrganisationDirectory(persons_file, structures_file, snapshot_file)
+    snapshot = directory.index
+    assert isinstance(snapshot, SnapshotIndex)
+    assert snapshot.get_size() == index.get_size()
+
+    for key in ['000000', '000123', '999999', 'unknown']:
+        assert snapshot.get_person_by_matricola(key) == index.get_person_by_matricola(key)
+    assert snapshot.get_person_by_email('Short@example.org') == index.get_person_by_email('Short@example.org')
+    for uaf in sample_uafs(structures)[:15]:
+        assert snapshot.get_subtree(uaf) == index.get_subtree(uaf)
+        assert snapshot.get_subtree_people(uaf) == index.get_subtree_people(uaf)
+        assert snapshot.get_children(uaf) == index.get_children(uaf)
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 4096])
+def test_json_stream_reads_the_items_in_order(tmp_path, read_size):
+    data = {'a': ['0001', 'a@example.org', None, 'Rossi', 'Mario', 12, 3.5e-2, True],
+            'b "quoted"': {'nested': [1, 2, {'x': 'y'}]},
+            'è': [],
+            'n': 1234567}
+    file_name = tmp_path / 'dump.json'
+    file_name.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    assert list(iter_json_object(str(file_name), read_size=read_size)) == list(data.items())
+
+
+def test_json_stream_rejects_truncated_files(tmp_path):
+    file_name = tmp_path / 'dump.json'
+    file_name.write_text('{"a": [1, 2], "b": [3', encoding='utf-8')
+
+    with pytest.raises(JSONStreamError):
+        list(iter_json_object(str(file_name)))
@@ -170,3 +170,320 @@ def test_with_participation_count(participation_count, expected_count):
 
     # Assert
     assert event_with_count.participation_count == expected_count
+
+
+@pytest.mark.django_db
+def test_html_table_fragment_is_cached_until_the_event_is_saved():
+    # Arrange
+    event = InformationEvent.objects.create(
+        event_date=timezone.now().date(),
+        event_start_time=timezone.now().time(),
+        meeting_url="https://example.com/meeting",
+        speaker="John Doe",
+        title="Test Event",
+        description="Description of test event",
+        enabled=True
+    )
+    first_html = event.to_html_table()
+
+    # Act
+    InformationEvent.objects.filter(pk=event.pk).update(speaker="Not rendered")
+    event.refresh_from_db()
+    cached_html = event.to_html_table()
+
+    event.speaker = "Jane Doe"
+    event.save()
+    saved_html = event.to_html_table()
+
+    # Assert
+    assert cached_html == first_html
+    assert "Not rendered" not in cached_html
+    assert "Jane Doe" in saved_html
+
+
+@pytest.mark.django_db
+def test_email_outbox_is_idempotent_and_retried_with_backoff(settings):
+    from registration.models import EmailOutbox
+    from registration.outbox import enqueue_email, OutboxDelivery
+
+    # the logs are asserted: written by the request, not by the background writer
+    settings.EVENT_LOG_ASYNC = False
+    # nothing listens on port 1: the connection is refused, a temporary error
+    message, created = enqueue_email('from@example.org', ['to@example.org'], 'Subject', '<p>body</p>',
+                                     email_host='127.0.0.1:1', idempotency_key='test-key')
+    _, created_again = enqueue_email('from@example.org', ['to@example.org'], 'Subject', '<p>body</p>',
+                                     email_host='127.0.0.1:1', idempotency_key='test-key')
+    assert created and not created_again
+    assert EmailOutbox.objects.count() == 1
+
+    delivery = OutboxDelivery(workers=1, max_attempts=2)
+    assert delivery.run() == 1
+    message.refresh_from_db()
+    assert (message.status, message.attempts, delivery.retried) == (EmailOutbox.PENDING, 1, 1)
+    assert message.next_attempt_at > timezone.now()
+
+    # not due yet
+    assert delivery.run() == 0
+
+    EmailOutbox.objects.update(next_attempt_at=timezone.now())
+    delivery.run()
+    message.refresh_from_db()
+    assert (message.status, message.attempts, delivery.failed) == (EmailOutbox.FAILED, 2, 1)
+    assert EventLog.objects.filter(event_type=EventLog.ERROR_SENDING_EMAIL).count() == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("template_name", [
+    'fragment/information_event_send_remainder_it.html',
+    'fragment/information_event_postponement_it.html',
+])
+def test_mail_merge_matches_the_template(template_name):
+    from django.template.loader import render_to_string
+    from registration.mail_merge import MailMerge
+
+    event = InformationEvent.objects.create(event_date=timezone.now().date(), event_start_time=timezone.now().time(),
+                                            meeting_url="https://example.com/meeting", speaker="Speaker",
+                                            title="Title", description="Description")
+    context = {'event': event, 'event_html_table': event.to_html_table_email(), 'tomorrow_str': 'domani',
+               'REGISTRATION_URL': 'https://example.com/r/', 'VIDEOTECA_URL': 'https://example.com/v/'}
+    merge = MailMerge(template_name, context)
+
+    for name in ["Mario", "D'Amico <b>&</b>", ""]:
+        subscriber = Subscriber(name=name, surname="Rossi", email="m@example.com")
+        assert merge.render(subscriber) == render_to_string(template_name, {**context, 'subscriber': subscriber})
+    assert not merge.fallback
+
+
+@pytest.mark.django_db
+def test_mail_merge_renders_the_template_when_a_tag_uses_the_recipient(settings, tmp_path):
+    from django.template.loader import render_to_string
+    from registration.mail_merge import MailMerge
+
+    (tmp_path / 'greeting.html').write_text("Ciao{% if subscriber.name %} {{ subscriber.name }}{% endif %}, "
+                                            "{{ subscriber.surname|upper }}")
+    settings.TEMPLATES = [{**settings.TEMPLATES[0], 'DIRS': [tmp_path]}]
+
+    # the recipient with the empty field first, and last
+    for names in (["", "Mario"], ["Mario", ""]):
+        merge = MailMerge('greeting.html', {})
+        for name in names:
+            subscriber = Subscriber(name=name, surname="Rossi", email="m@example.com")
+            assert merge.render(subscriber) == render_to_string('greeting.html', {'subscriber': subscriber})
+        assert merge.fallback
+
+
+@pytest.mark.django_db
+def test_event_log_payloads_are_deduplicated_and_archived(settings, tmp_path):
+    import gzip
+    import json
+    from datetime import timedelta
+    from django.core.management import call_command
+    from registration.logic import create_event_log, bulk_create_event_logs
+    from registration.models import EventLogPayload
+
+    settings.EVENT_LOG_ASYNC = False
+    body = "<p>email body</p>" * 200
+    create_event_log(EventLog.EMAIL_QUEUED, "Subject", event_target="a@example.com", payload=body)
+    bulk_create_event_logs([{'event_type': EventLog.EMAIL_SENT, 'event_title': "Subject", 'event_data': body,
+                             'data': {'outbox_id': 1}}])
+    assert EventLogPayload.objects.count() == 1
+    payload = EventLogPayload.objects.get()
+    assert payload.get_text() == body and len(payload.content) < len(body)
+    assert EventLog.objects.filter(payload=payload).count() == 2
+
+    EventLog.objects.update(created_at=timezone.now() - timedelta(days=400))
+    EventLogPayload.objects.update(created_at=timezone.now() - timedelta(days=400))
+    call_command('archive_event_logs', '--days', '365', '--output-dir', str(tmp_path))
+
+    assert EventLog.objects.count() == 0 and EventLogPayload.objects.count() == 0
+    [archive] = tmp_path.iterdir()
+    with gzip.open(archive, 'rt') as f:
+        rows = [json.loads(line) for line in f]
+    assert [row['payload'] for row in rows] == [body, body]
+    assert rows[1]['data'] == {'outbox_id': 1}
+
+
+@pytest.mark.django_db
+def test_subscriber_checks_are_batched_cached_and_invalidated():
+    from registration.subscriber_check import check_subscribers, FOUND, DISABLED, UNKNOWN
+
+    mario = Subscriber.objects.create(name="Mario", surname="Rossi", matricola="1", email="mario@example.com")
+    Subscriber.objects.create(name="Anna", surname="Bianchi", matricola="2", email="anna@example.com", enabled=False)
+    pairs = [("1", "mario@example.com"), ("2", "anna@example.com"), ("1", "anna@example.com")]
+
+    results, cache_hits = check_subscribers(pairs)
+    assert [status for status, _ in results] == [FOUND, DISABLED, UNKNOWN]
+    assert results[0][1]['id'] == mario.id and cache_hits == 0
+
+    # the case and the surrounding spaces do not matter, as with the lookup by the database
+    [result], _ = check_subscribers([(" 1", "Mario@Example.com ")])
+    assert result[1]['id'] == mario.id
+
+    _, cache_hits = check_subscribers(pairs)
+    assert cache_hits == 3
+
+    mario.enabled = False
+    mario.save()
+    results, cache_hits = check_subscribers(pairs)
+    assert results[0] == (DISABLED, None) and cache_hits == 0
+
+
+@pytest.mark.django_db
+def test_calendar_feed_is_cached_with_etag_and_invalidated(client):
+    import uuid
+    from django.urls import reverse
+
+    subscriber = Subscriber.objects.create(name="Mario", surname="Rossi", matricola="1", email="mario@example.com")
+    events = [InformationEvent.objects.create(event_date=timezone.now().date(), event_start_time=timezone.now().time(),
+                                              meeting_url="https://example.com/meeting", speaker="Speaker",
+                                              title=f"Event {i}", description="Description") for i in range(2)]
+    EventParticipation.objects.create(event=events[0], subscriber=subscriber)
+    url = reverse('calendar-feed', args=[subscriber.get_calendar_token()])
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content.count(b"BEGIN:VEVENT") == 1
+    etag = response['ETag']
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    EventParticipation.objects.create(event=events[1], subscriber=subscriber)
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.content.count(b"BEGIN:VEVENT") == 2
+
+    events[1].title = "Renamed"
+    events[1].save()
+    assert b"SUMMARY:Renamed" in client.get(url).content
+
+    subscriber.enabled = False
+    subscriber.save()
+    assert client.get(url).status_code == 404
+    assert client.get(reverse('calendar-feed', args=[uuid.uuid4()])).status_code == 404
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("mode", ['signed_cookie', 'cache', 'db'])
+def test_subscriber_session_modes(client, settings, mode):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    settings.REGISTRATION_SESSION_MODE = mode
+    subscriber = Subscriber.objects.create(name="Mario", surname="Rossi", matricola="1", email="mario@example.com")
+
+    response = client.post('/registrazione/login/', {'matricola': "1", 'email': "mario@example.com"})
+    assert response.status_code == 302
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get('/registrazione/manage-subscription/')
+    assert response.status_code == 200 and response.context['subscriber'].id == subscriber.id
+    tables = " ".join(query['sql'] for query in queries.captured_queries)
+    if mode != 'db':
+        assert "django_session" not in tables and "registration_subscriber" not in tables
+
+    # disabled after the login: the changes are refused
+    Subscriber.objects.filter(pk=subscriber.pk).update(enabled=False)
+    response = client.post('/registrazione/manage-subscription/', {})
+    assert response.status_code == 302 and response.url.endswith('/login/')
+
+    client.get('/registrazione/logout/')
+    assert client.get('/registrazione/manage-subscription/').status_code == 302
+
+
+@pytest.mark.django_db
+def test_participation_count_follows_single_and_bulk_changes():
+    from django.core.management import call_command
+    from django.core.management.base import CommandError
+    from registration.capacity import bulk_add_participations, reserve_seat
+    from registration.models import EventCapacity
+
+    event = InformationEvent.objects.create(event_date=timezone.now().date(), event_start_time=timezone.now().time(),
+                                            meeting_url="https://example.com/meeting", speaker="Speaker",
+                                            title="Title", description="Description")
+    subscribers = [Subscriber.objects.create(name=f"Name {i}", surname="Surname", matricola=str(i),
+                                             email=f"{i}@example.com") for i in range(4)]
+
+    def participation_count():
+        return InformationEvent.enabled_events.with_participation_count().get(pk=event.pk).participation_count
+
+    EventParticipation.objects.create(event=event, subscriber=subscribers[0])
+    bulk_add_participations([EventParticipation(event=event, subscriber=subscriber) for subscriber in subscribers[1:3]])
+    assert reserve_seat(event)
+    EventParticipation.objects.bulk_create([EventParticipation(event=event, subscriber=subscribers[3])])
+    assert participation_count() == 4
+
+    EventParticipation.objects.filter(subscriber__in=subscribers[:2]).delete()
+    subscribers[2].delete()
+    assert participation_count() == 1
+
+    EventCapacity.objects.filter(event=event).update(taken=7)
+    with pytest.raises(CommandError):
+        call_command('reconcile_event_capacity', '--check')
+    call_command('reconcile_event_capacity')
+    assert participation_count() == 1
+
+
+@pytest.mark.django_db
+def test_instrumentation_records_requests_for_the_staff(client, settings):
+    from django.contrib.auth.models import User
+    from mediamatrixhub.instrumentation import reset_instrumentation_data
+
+    settings.INSTRUMENTATION_ENABLED = True
+    settings.INSTRUMENTATION_SLOW_REQUEST_MS = 0
+    settings.INSTRUMENTATION_SLOW_LOG_SAMPLE_RATE = 1.0
+    settings.INSTRUMENTATION_PROFILE_SAMPLE_RATE = 1.0
+    reset_instrumentation_data()
+
+    assert client.get('/registrazione/login/').status_code == 200
+    assert client.get('/instrumentation/').status_code == 302
+
+    client.force_login(User.objects.create_user('staff', is_staff=True))
+    data = client.get('/instrumentation/', {'reset': 1}).json()
+    stats = data['views']['subscriber-login']
+    assert stats['requests'] == 1 and stats['avg_template_ms'] > 0
+    slow_request = next(entry for entry in data['slow_requests'] if entry['view'] == 'subscriber-login')
+    assert slow_request['path'] == '/registrazione/login/' and slow_request['profile']
+    assert client.get('/instrumentation/').json()['views'].keys() == {'instrumentation'}
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_adds_up_the_processes(client, settings, tmp_path):
+    import os
+    import uuid
+    from mediamatrixhub.metrics import get_snapshot, write_json, get_process_file
+
+    settings.METRICS_DIR = str(tmp_path)
+    settings.METRICS_ALLOWED_IPS = ['10.1.0.0/16']
+
+    def scrape():
+        response = client.get('/metrics/', HTTP_X_REAL_IP='10.1.2.3')
+        assert response.status_code == 200
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    sample = 'mmh_cache_requests_total{cache="calendar_feed",result="miss"}'
+    before = int(scrape().get(sample, 0))
+    assert client.get(f'/registrazione/calendar/{uuid.uuid4()}.ics').status_code == 404
+    assert int(scrape()[sample]) == before + 1
+
+    # the file of another running process (the parent of the test process) is added
+    write_json(get_process_file(os.getppid()), get_snapshot())
+    assert int(scrape()[sample]) == 2 * (before + 1)
+
+    assert client.get('/metrics/', HTTP_X_REAL_IP='192.168.1.1').status_code == 403
+
+
+@pytest.mark.django_db
+def test_import_pers_dump_matches_subscribers_regardless_of_case_and_spaces(tmp_path):
+    import io
+    import json
+    from django.core.management import call_command
+
+    Subscriber.objects.create(name="Mario", surname="Rossi", matricola="1", email="mario.rossi@example.com")
+    dump = tmp_path / 'persons.json'
+    dump.write_text(json.dumps({'k1': ["1", "Mario.Rossi@Example.com ", None, "Rossi", "Mario"],
+                                'k2': ["2", "anna@example.com", None, "Bianchi", "Anna"]}))
+
+    call_command('ImportPersDump', str(dump), stdout=io.StringIO())
+    assert Subscriber.objects.filter(matricola="1").count() == 1
+    assert Subscriber.objects.filter(matricola="1", enabled=True).exists()
+    assert Subscriber.objects.count() == 2
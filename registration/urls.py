@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views
-from .views import CheckSubscriberView
+from .views import CheckSubscriberView, CheckSubscribersView
 
 urlpatterns = [
     path('login/', views.subscriber_login, name='subscriber-login'),
@@ -8,6 +8,8 @@ urlpatterns = [
     path('manage-subscription/', views.manage_subscription, name='manage-subscription'),
     path('logout/', views.subscriber_logout, name='subscriber-logout'),
     path('events/download/<uuid:ref_token>/', views.download_ics_file, name='download_ics_event'),
+    path('calendar/<uuid:calendar_token>.ics', views.calendar_feed, name='calendar-feed'),
     path('check-subscriber/', CheckSubscriberView.as_view(), name='check-subscriber'),
+    path('check-subscribers/', CheckSubscribersView.as_view(), name='check-subscribers'),
 ]
 
@@ -1,23 +1,37 @@
+import json
 import syslog
 import uuid
+from collections import Counter
 
 from django.core.exceptions import MultipleObjectsReturned
+from django.db import transaction
 from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
 from mediamatrixhub import settings
-from mediamatrixhub.email_utils import my_send_email, MyTemporaryFile
+from mediamatrixhub.email_utils import MyTemporaryFile
+from mediamatrixhub.metrics import SUBSCRIBER_LOGINS, SUBSCRIBER_CHECKS, EVENT_PARTICIPATIONS
 from mediamatrixhub.settings import DEBUG, DEBUG_EMAIL, SUBJECT_EMAIL, VIDEOTECA_URL, APPLICATION_TITLE, \
     TECHNICAL_CONTACT_EMAIL, TECHNICAL_CONTACT, FROM_EMAIL, EMAIL_HOST, WS_SRC_IP_ALLOWED
 from mediamatrixhub.view_tools import is_private_ip
 from .forms import SubscriberLoginForm, EventParticipationForm
-from .json_tools import lookup_subscriber_json_data_by_matricola
-from .logic import create_event_log
+from .calendar_feed import generate_calendar, get_calendar_feed, invalidate_calendar_feed
+from .capacity import is_registration_open, reserve_seat
+from .logic import create_event_log, bulk_create_event_logs
+from .outbox import enqueue_email
+from .subscriber_check import check_subscribers, to_json, MAX_BATCH_SIZE, FOUND, DISABLED, UNKNOWN
+from .subscriber_session import login_subscriber, get_subscriber, logout_subscriber
 from .models import Subscriber, InformationEvent, EventParticipation, EventLog, SubscriptionAlertMessage
 
+CALENDAR_FILE_NAME = 'pillole_informative.ics'
+
 
 def subscriber_login(request):
     # get ip address from request META
@@ -51,20 +65,22 @@ def subscriber_login(request):
                                     f'Grazie.<br><br>' \
                                     f'Questo messaggio è stato inviato automaticamente dal sistema.<br><br>'
 
-                    my_send_email(
+                    enqueue_email(
                         FROM_EMAIL,
                         [TECHNICAL_CONTACT_EMAIL],
                         message_subject,
                         message_body,
                         bcc_addresses=[DEBUG_EMAIL],
-                        attachments=[],
-                        email_host=EMAIL_HOST
+                        email_host=EMAIL_HOST,
+                        idempotency_key=f"multiple-subscriber:{matricola}:{email}:{timezone.localdate()}",
                     )
 
                     create_event_log(
                         event_type=EventLog.MULTIPLE_SUBSCRIBER_DETECTED,
                         event_title="Multiple subscriber detected",
-                        event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
+                        event_target=email,
+                        ip_address=http_real_ip,
+                        data={'matricola': matricola, 'email': email},
                     )
 
                     subscribers = Subscriber.objects.filter(matricola=matricola, email=email)
@@ -76,40 +92,55 @@ def subscriber_login(request):
 
 
                 if not subscriber.enabled:
+                    SUBSCRIBER_LOGINS.inc(result='disabled')
                     create_event_log(
                         event_type=EventLog.LOGIN_FAILED_USER_DISABLED,
                         event_title="Subscriber login failed - user disabled",
-                        event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
+                        event_target=email,
+                        subscriber=subscriber,
+                        ip_address=http_real_ip,
+                        data={'matricola': matricola, 'email': email},
                     )
 
                     messages.error(request, 'errore: matricola o email non validi')
                 else:
+                    SUBSCRIBER_LOGINS.inc(result='success')
                     create_event_log(
                         event_type=EventLog.LOGIN_SUCCESS,
                         event_title="Subscriber login success",
-                        event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
+                        event_target=email,
+                        subscriber=subscriber,
+                        ip_address=http_real_ip,
+                        data={'matricola': matricola, 'email': email},
                     )
 
                     # login(request, user, backend=AUTHENTICATION_BACKENDS[0])
 
-                    # Simulate login by saving subscriber's ID in session (example)
-                    request.session['subscriber_id'] = subscriber.id
-                    return redirect('manage-subscription')
+                    # Simulate login: the subscriber is remembered as configured by REGISTRATION_SESSION_MODE
+                    response = redirect('manage-subscription')
+                    login_subscriber(request, response, subscriber)
+                    return response
             except Subscriber.DoesNotExist:
-
+                SUBSCRIBER_LOGINS.inc(result='unknown')
                 create_event_log(
                     event_type=EventLog.LOGIN_FAILED,
                     event_title="Subscriber login failed",
-                    event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
+                    event_target=email,
+                    ip_address=http_real_ip,
+                    data={'matricola': matricola, 'email': email},
                 )
 
                 messages.error(request, 'errore: matricola o email non validi')
 
             except Exception as e:
+                SUBSCRIBER_LOGINS.inc(result='error')
                 create_event_log(
                     event_type=EventLog.LOGIN_FAILED_UNKNOWN,
                     event_title="Subscriber login failed - unknown error",
-                    event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip} error: {str(e)}",
+                    event_data=f"error: {str(e)}",
+                    event_target=email,
+                    ip_address=http_real_ip,
+                    data={'matricola': matricola, 'email': email},
                 )
 
                 syslog.syslog(syslog.LOG_ERR, f'SubscriberLoginForm: matricola: {matricola} email: {email} http_real_ip: {http_real_ip} error: {str(e)}')
@@ -137,11 +168,9 @@ def manage_subscription(request):
         return render(request, 'show_message.html', {'message': "403 Forbidden - accesso consentito solo da intranet"},
                       status=403)
 
-    # check request.session['subscriber_id'] and retrieve the subscriber instance
-    subscriber_id = request.session.get('subscriber_id')
-    if subscriber_id:
-        subscriber = Subscriber.objects.get(id=subscriber_id)
-    else:
+    # retrieve the logged subscriber: without a query, unless REGISTRATION_SESSION_MODE is 'db'
+    subscriber = get_subscriber(request)
+    if subscriber is None:
         # send email to admin
         # redirect to login page
         return redirect('subscriber-login')
@@ -157,43 +186,106 @@ def manage_subscription(request):
         pass
 
     if request.method == 'POST':
+        # the changes are made for the subscriber in the database: it may have been disabled after the login
+        subscriber = Subscriber.objects.filter(id=subscriber.id, enabled=True).first()
+        if subscriber is None:
+            response = redirect('subscriber-login')
+            logout_subscriber(request, response)
+            return response
+
         form = EventParticipationForm(request.POST)
         if form.is_valid():
             subscriptions = []
             attachments = []
 
-            for key, value in form.cleaned_data.items():
-                event_id = key.split('_')[-1]
-                event = InformationEvent.objects.get(id=event_id)
+            # event id -> checked
+            selected = {int(key.split('_')[-1]): value for key, value in form.cleaned_data.items()}
 
-                if value:  # Checkbox is checked
-                    # Check if the EventParticipation instance exists and update or create accordingly
-                    EventParticipation.objects.update_or_create(
-                        event=event,
-                        subscriber=subscriber,
-                        defaults={'event': event, 'subscriber': subscriber}
-                    )
-
-                    create_event_log(
-                        event_type=EventLog.SUBSCRIPTION_SET,
-                        event_title="Subscription set",
-                        event_data=f"subscriber: {subscriber} event_id: {event_id}  event: {event}",
-                        event_target=subscriber.email,
-                    )
+            existing_event_ids = set(
+                EventParticipation.objects
+                .filter(subscriber=subscriber, event_id__in=selected.keys())
+                .values_list('event_id', flat=True)
+            )
+            added_event_ids = [event_id for event_id, value in selected.items()
+                               if value and event_id not in existing_event_ids]
+            removed_event_ids = [event_id for event_id, value in selected.items()
+                                 if not value and event_id in existing_event_ids]
+
+            with transaction.atomic():
+                # seats are reserved one event at a time with a conditional update of the event counter
+                rejected_events = []
+                accepted_event_ids = []
+                for event_id in added_event_ids:
+                    event = form.events[event_id]
+                    if not is_registration_open(event):
+                        rejected_events.append((event, "iscrizioni chiuse"))
+                    elif not reserve_seat(event):
+                        rejected_events.append((event, "posti esauriti"))
+                    else:
+                        accepted_event_ids.append(event_id)
+
+                EventParticipation.objects.bulk_create(
+                    [EventParticipation(event_id=event_id, subscriber=subscriber) for event_id in accepted_event_ids]
+                )
+                # bulk_create sends no post_save: counted here (the deletions are counted by the signal)
+                EVENT_PARTICIPATIONS.inc(len(accepted_event_ids), action='added')
+                if removed_event_ids:
+                    # the seats are given back by the post_delete signal of each participation
+                    EventParticipation.objects.filter(subscriber=subscriber, event_id__in=removed_event_ids).delete()
+
+                # log only the actual changes
+                event_logs = []
+                for event_id in accepted_event_ids:
+                    event_logs.append({
+                        'event_type': EventLog.SUBSCRIPTION_SET,
+                        'event_title': "Subscription set",
+                        'event_data': str(form.events[event_id]),
+                        'event_target': subscriber.email,
+                        'subscriber': subscriber,
+                        'information_event': event_id,
+                    })
+                for event, reason in rejected_events:
+                    event_logs.append({
+                        'event_type': EventLog.SUBSCRIPTION_REJECTED,
+                        'event_title': f"Subscription rejected - {reason}",
+                        'event_data': str(event),
+                        'event_target': subscriber.email,
+                        'subscriber': subscriber,
+                        'information_event': event,
+                    })
+                for event_id in removed_event_ids:
+                    event_logs.append({
+                        'event_type': EventLog.SUBSCRIPTION_REMOVED,
+                        'event_title': "Subscription removed",
+                        'event_data': str(form.events[event_id]),
+                        'event_target': subscriber.email,
+                        'subscriber': subscriber,
+                        'information_event': event_id,
+                    })
+                bulk_create_event_logs(event_logs)
+
+            for event, reason in rejected_events:
+                messages.warning(request, f'Non è stato possibile iscriverti alla pillola "{event.title}": {reason}.')
+
+            if accepted_event_ids or removed_event_ids:
+                invalidate_calendar_feed(subscriber.id)
+
+            subscribed_events = []
+            subscribed_event_ids = existing_event_ids.union(accepted_event_ids)
+            for event_id, value in selected.items():
+                if value and event_id in subscribed_event_ids:  # Checkbox is checked
+                    event = form.events[event_id]
 
                     subscriptions.append(event.to_html_table_email())
+                    subscribed_events.append(event)
 
-                    attachments.append(MyTemporaryFile(event.generate_ics_file_name(), event.generate_ics_content()))
+            # a single calendar with all the events, instead of an attachment for each one
+            if subscribed_events:
+                attachments.append(MyTemporaryFile(CALENDAR_FILE_NAME, generate_calendar(subscribed_events)))
 
-                else:
-                    EventParticipation.objects.filter(event=event, subscriber=subscriber).delete()
-
-                    create_event_log(
-                        event_type=EventLog.SUBSCRIPTION_REMOVED,
-                        event_title="Subscription removed",
-                        event_data=f"subscriber: {subscriber} event_id: {event_id}  event: {event}",
-                        event_target=subscriber.email,
-                    )
+            feed_url = f"{settings.BASE_URL}{reverse('calendar-feed', args=[subscriber.get_calendar_token()])}"
+            calendar_message = f'Per avere sempre nel tuo calendario le pillole informative a cui sei iscritto, ' \
+                               f'aggiungi il calendario a questo indirizzo: <a href="{feed_url}">{feed_url}</a>'
 
             messages.success(request,
                              'Iscrizioni alle pillole informative aggiornate con successo. '
@@ -205,6 +297,7 @@ def manage_subscription(request):
                                f'hai aggiornato con successo le tue iscrizioni alle prossime pillole informative.<br><br>' \
                                f'Ecco un riepilogo delle future pillole informative a cui ti sei iscritto:<br><br>' \
                                f'{"<br><hr>".join([f"{subscription}" for subscription in subscriptions])}<br><br>' \
+                               f"{calendar_message}<br><br>" \
                                f"{additional_message}<br><br>" \
                                f'Grazie per la tua partecipazione.<br><br>'
             else:
@@ -221,21 +314,24 @@ def manage_subscription(request):
                 print(f"debug mode: fake sending email to {subscriber.email}")
                 print(f"message: {message_body}  (debug mode)")
             else:
-                my_send_email(
+                # sent by deliver_outbox: the response does not wait for the SMTP server
+                enqueue_email(
                     FROM_EMAIL,
                     [subscriber.email],
                     message_subject,
                     message_body,
                     bcc_addresses=[DEBUG_EMAIL],
                     attachments=attachments,
-                    email_host=EMAIL_HOST
+                    email_host=EMAIL_HOST,
+                    log_event_target=subscriber.email,
                 )
 
             create_event_log(
-                event_type=EventLog.EMAIL_SENT,
+                event_type=EventLog.EMAIL_QUEUED,
                 event_title=message_subject,
-                event_data=f"subscriber: {subscriber} email: {subscriber.email} {message_body}",
                 event_target=subscriber.email,
+                subscriber=subscriber,
+                payload=message_body,
             )
 
             return redirect('manage-subscription')
@@ -251,10 +347,10 @@ def manage_subscription(request):
         existing_participations = EventParticipation.objects.filter(
             subscriber=subscriber,
             event__event_date__gte=current_date
-        )
-        for participation in existing_participations:
+        ).values_list('event_id', flat=True)
+        for event_id in existing_participations:
             try:
-                form.fields[f'event_{participation.event.id}'].initial = True
+                form.fields[f'event_{event_id}'].initial = True
             except KeyError:
                 pass
 
@@ -271,9 +367,10 @@ def manage_subscription(request):
 
 
 def subscriber_logout(request):
-    request.session['subscriber_id'] = None
+    response = redirect('subscriber-login')
+    logout_subscriber(request, response)
 
-    return redirect('subscriber-login')
+    return response
 
 
 def download_ics_file(request, ref_token):
@@ -293,21 +390,62 @@ def download_ics_file(request, ref_token):
     return response
 
 
+def calendar_feed(request, calendar_token):
+    """
+    The calendar of the upcoming events of a subscriber, to be subscribed to in a calendar application.
+
+    The clients poll the feed: when it has not changed since the last request (If-None-Match), the response is a 304
+    without content.
+    """
+    feed = get_calendar_feed(calendar_token)
+    if feed is None:
+        raise Http404("Calendar does not exist")
+    content, etag = feed
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = f'inline; filename="{CALENDAR_FILE_NAME}"'
+    response['ETag'] = etag
+    # the content is personal: only the client may keep it
+    patch_cache_control(response, private=True, max_age=300)
+    return response
+
+
+class IntegrationView(View):
+    """Base of the views called by other applications: allowed from WS_SRC_IP_ALLOWED, intranet or superusers."""
+
+    def check_access(self, request):
+        """Returns a 403 response if the client is not allowed, otherwise None."""
+        http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
+        # syslog.syslog(syslog.LOG_INFO, f'CheckSubscriberView: http_real_ip: {http_real_ip}')
+        # syslog.syslog(syslog.LOG_INFO, f'CheckSubscriberView: WS_SRC_IP_ALLOWED: {WS_SRC_IP_ALLOWED}')
+        if http_real_ip in WS_SRC_IP_ALLOWED:
+            pass
+        elif not request.user.is_authenticated or not request.user.is_superuser:
+            # Check if the IP is private
+            if http_real_ip != '' and not is_private_ip(http_real_ip) and not settings.DEBUG:
+                syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
+                return JsonResponse({'error': '403 Forbidden - accesso consentito solo da intranet'}, status=403)
+        return None
+
+
 # this view is called by other applications
-class CheckSubscriberView(View):
+class CheckSubscriberView(IntegrationView):
+    EVENT_LOGS = {
+        FOUND: (EventLog.LOGIN_SUCCESS_JSON, "Subscriber login success - JSON response", None),
+        DISABLED: (EventLog.LOGIN_FAILED_JSON_USER_DISABLED,
+                   "Subscriber login failed - user NOT ENABLED - JSON response", "user is not enabled"),
+        UNKNOWN: (EventLog.LOGIN_FAILED_JSON, "Subscriber login failed - JSON response", None),
+    }
+
     def get(self, request, *args, **kwargs):
 
         http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
         try:
-            # syslog.syslog(syslog.LOG_INFO, f'CheckSubscriberView: http_real_ip: {http_real_ip}')
-            # syslog.syslog(syslog.LOG_INFO, f'CheckSubscriberView: WS_SRC_IP_ALLOWED: {WS_SRC_IP_ALLOWED}')
-            if http_real_ip in WS_SRC_IP_ALLOWED:
-                pass
-            elif not request.user.is_authenticated or not request.user.is_superuser:
-                # Check if the IP is private
-                if http_real_ip != '' and not is_private_ip(http_real_ip) and not settings.DEBUG:
-                    syslog.syslog(syslog.LOG_ERR, f'IP address {http_real_ip} is not private')
-                    return JsonResponse({'error': '403 Forbidden - accesso consentito solo da intranet'}, status=403)
+            forbidden = self.check_access(request)
+            if forbidden is not None:
+                return forbidden
 
             matricola = request.GET.get('matricola')
             email = request.GET.get('email')
@@ -317,60 +455,67 @@ class CheckSubscriberView(View):
 
             syslog.syslog(syslog.LOG_INFO, f'CheckSubscriberView: matricola: {matricola} email: {email} http_real_ip: {http_real_ip}')
 
-            subscriber = Subscriber.objects.filter(matricola=matricola, email=email).first()
-
-            if subscriber:
-
-                if not subscriber.enabled:
-                    create_event_log(
-                        event_type=EventLog.LOGIN_FAILED_JSON_USER_DISABLED,
-                        event_title="Subscriber login failed - user NOT ENABLED - JSON response",
-                        event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip} user is not enabled",
-                    )
+            [result], _ = check_subscribers([(matricola, email)])
+            SUBSCRIBER_CHECKS.inc(endpoint='check-subscriber')
 
-                    return JsonResponse({'exists': False})
+            event_type, event_title, event_data = self.EVENT_LOGS[result[0]]
+            create_event_log(
+                event_type=event_type,
+                event_title=event_title,
+                event_data=event_data,
+                event_target=email,
+                subscriber=result[1]['id'] if result[1] else None,
+                ip_address=http_real_ip,
+                data={'matricola': matricola, 'email': email},
+            )
 
-                extended_data = lookup_subscriber_json_data_by_matricola(subscriber.matricola)
+            return JsonResponse(to_json(result))
 
-                if extended_data is None:
-                    uaf = 'dato non presente'
-                    structure = 'dato non presente'
-                else:
-                    # get data at position 5
-                    uaf = extended_data[5]
+        except Exception as e:
+            syslog.syslog(syslog.LOG_ERR, f'Unexpected error: {str(e)}')
+            return JsonResponse({'error': 'An unexpected error occurred. Please try again later.'}, status=500)
 
-                    structure = extended_data[6]
 
-                subscriber_data = {
-                    'id': subscriber.id,  # 'id': subscriber.id,
-                    'matricola': subscriber.matricola,
-                    'email': subscriber.email,
-                    'name': subscriber.name,
-                    'surname': subscriber.surname,
-                    'uaf': uaf,
-                    'structure': structure,
-                }
+# this view is called by other applications, with many subscribers at once
+@method_decorator(csrf_exempt, name='dispatch')
+class CheckSubscribersView(IntegrationView):
+    """
+    POST {"subscribers": [{"matricola": ..., "email": ...}, ...]} (at most MAX_BATCH_SIZE)
 
-                create_event_log(
-                    event_type=EventLog.LOGIN_SUCCESS_JSON,
-                    event_title="Subscriber login success - JSON response",
-                    event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
-                )
+    Returns {"results": [{"matricola": ..., "email": ..., "exists": ..., "subscriber": ...}, ...]} in the same
+    order; each result is the response of CheckSubscriberView. A single EventLog records the whole request.
+    """
 
-                return JsonResponse({'exists': True, 'subscriber': subscriber_data})
-            else:
+    def post(self, request, *args, **kwargs):
+        http_real_ip = request.META.get('HTTP_X_REAL_IP', '')
+        try:
+            forbidden = self.check_access(request)
+            if forbidden is not None:
+                return forbidden
 
-                create_event_log(
-                    event_type=EventLog.LOGIN_FAILED_JSON,
-                    event_title="Subscriber login failed - JSON response",
-                    event_data=f"matricola: {matricola} email: {email} http_real_ip: {http_real_ip}",
-                )
+            try:
+                items = json.loads(request.body)['subscribers']
+                pairs = [(str(item['matricola']), str(item['email'])) for item in items]
+            except (ValueError, KeyError, TypeError):
+                return JsonResponse({'error': 'a JSON object {"subscribers": [{"matricola": ..., "email": ...}]} '
+                                              'is required'}, status=400)
+            if len(pairs) > MAX_BATCH_SIZE:
+                return JsonResponse({'error': f'at most {MAX_BATCH_SIZE} subscribers per request'}, status=400)
+
+            results, cache_hits = check_subscribers(pairs)
+            SUBSCRIBER_CHECKS.inc(len(pairs), endpoint='check-subscribers')
+
+            counts = Counter(status for status, _ in results)
+            create_event_log(
+                event_type=EventLog.CHECK_SUBSCRIBERS_JSON,
+                event_title="Subscribers batch check - JSON response",
+                ip_address=http_real_ip,
+                data={'requested': len(pairs), 'cache_hits': cache_hits, **counts},
+            )
 
-                return JsonResponse({'exists': False})
+            return JsonResponse({'results': [{'matricola': matricola, 'email': email, **to_json(result)}
+                                             for (matricola, email), result in zip(pairs, results)]})
 
         except Exception as e:
             syslog.syslog(syslog.LOG_ERR, f'Unexpected error: {str(e)}')
             return JsonResponse({'error': 'An unexpected error occurred. Please try again later.'}, status=500)
-
-
-
@@ -0,0 +1,149 @@
+/**
+ * Resumable chunked uploader for the admin change forms (see core/uploads.py).
+ *
+ * The file is sent in fixed-size chunks by several parallel streams; each chunk carries its sha256 in the
+ * Upload-Checksum header. The upload id is kept in localStorage, so that an interrupted upload of the same file
+ * resumes from the chunks already received by the server.
+ */
+document.addEventListener('DOMContentLoaded', () => {
+  "use strict";
+
+  const container = document.querySelector('.chunked-upload');
+  if (!container) return;
+
+  const fileInput = container.querySelector('input[type="file"]');
+  const startButton = container.querySelector('.chunked-upload-start');
+  const progressBar = container.querySelector('progress');
+  const statusText = container.querySelector('.chunked-upload-status');
+
+  const createUrl = container.dataset.createUrl;
+  const targetType = container.dataset.targetType;
+  const targetId = container.dataset.targetId;
+  const parallelStreams = parseInt(container.dataset.parallelStreams || '4', 10);
+  const maxRetries = 5;
+
+  function getCookie(name) {
+    const match = document.cookie.match(new RegExp('(^|;\\s*)' + name + '=([^;]*)'));
+    return match ? decodeURIComponent(match[2]) : null;
+  }
+
+  const csrfToken = getCookie('csrftoken');
+
+  function storageKey(file) {
+    return `chunked-upload:${targetType}:${targetId}:${file.name}:${file.size}:${file.lastModified}`;
+  }
+
+  async function sha256Base64(buffer) {
+    if (!window.crypto || !window.crypto.subtle) return null;
+    const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+    return btoa(String.fromCharCode(...new Uint8Array(digest)));
+  }
+
+  async function request(method, url, options = {}) {
+    const headers = Object.assign({'X-CSRFToken': csrfToken}, options.headers || {});
+    const response = await fetch(url, {method: method, headers: headers, body: options.body, credentials: 'same-origin'});
+    if (!response.ok) {
+      let message = response.statusText;
+      try { message = (await response.json()).error || message; } catch (e) { /* empty body */ }
+      const error = new Error(message);
+      error.status = response.status;
+      throw error;
+    }
+    return response;
+  }
+
+  async function createOrResumeUpload(file) {
+    const key = storageKey(file);
+    const location = localStorage.getItem(key);
+
+    if (location) {
+      try {
+        const response = await request('GET', location);
+        const state = await response.json();
+        if (state.status === 'uploading') return {location: location, state: state};
+      } catch (e) {
+        // the upload does not exist anymore: start a new one
+      }
+      localStorage.removeItem(key);
+    }
+
+    const body = new FormData();
+    body.append('filename', file.name);
+    body.append('target_type', targetType);
+    body.append('target_id', targetId);
+
+    const response = await request('POST', createUrl, {headers: {'Upload-Length': String(file.size)}, body: body});
+    const state = await response.json();
+    const newLocation = response.headers.get('Location');
+    localStorage.setItem(key, newLocation);
+    return {location: newLocation, state: state};
+  }
+
+  async function sendChunk(file, location, chunkSize, index) {
+    const start = index * chunkSize;
+    const buffer = await file.slice(start, Math.min(start + chunkSize, file.size)).arrayBuffer();
+    const headers = {'Upload-Offset': String(start), 'Content-Type': 'application/offset+octet-stream'};
+    const checksum = await sha256Base64(buffer);
+    if (checksum) headers['Upload-Checksum'] = `sha256 ${checksum}`;
+
+    for (let attempt = 1; ; attempt++) {
+      try {
+        await request('PATCH', location, {headers: headers, body: buffer});
+        return;
+      } catch (e) {
+        if (attempt >= maxRetries || e.status === 403 || e.status === 404) throw e;
+        await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+      }
+    }
+  }
+
+  async function upload(file) {
+    const {location, state} = await createOrResumeUpload(file);
+    const chunkSize = state.chunk_size;
+    const numberOfChunks = Math.max(1, Math.ceil(file.size / chunkSize));
+    const received = new Set(state.received_chunks);
+    const pending = [];
+    for (let i = 0; i < numberOfChunks; i++) {
+      if (!received.has(i)) pending.push(i);
+    }
+
+    let done = received.size;
+    progressBar.max = numberOfChunks;
+    progressBar.value = done;
+
+    async function worker() {
+      while (pending.length) {
+        const index = pending.shift();
+        await sendChunk(file, location, chunkSize, index);
+        done += 1;
+        progressBar.value = done;
+        statusText.textContent = `${done} / ${numberOfChunks}`;
+      }
+    }
+
+    const workers = [];
+    for (let i = 0; i < parallelStreams; i++) workers.push(worker());
+    await Promise.all(workers);
+
+    statusText.textContent = 'processing...';
+    await request('POST', location + 'complete/');
+    localStorage.removeItem(storageKey(file));
+  }
+
+  startButton.addEventListener('click', async (event) => {
+    event.preventDefault();
+    const file = fileInput.files[0];
+    if (!file) return;
+
+    startButton.disabled = true;
+    try {
+      await upload(file);
+      statusText.textContent = 'upload completed';
+      window.location.reload();
+    } catch (e) {
+      statusText.textContent = `upload failed: ${e.message} (retry to resume)`;
+    } finally {
+      startButton.disabled = false;
+    }
+  });
+});